@@ -0,0 +1,17 @@
+from django.contrib import admin
+
+from .models import LabRun, LabRunEvent
+
+
+@admin.register(LabRun)
+class LabRunAdmin(admin.ModelAdmin):
+    list_display = ("run_id", "module", "status", "started_at", "duration_ms", "frame_count")
+    list_filter = ("status", "module")
+    search_fields = ("run_id", "request_id")
+    ordering = ("-started_at", "-id")
+
+
+@admin.register(LabRunEvent)
+class LabRunEventAdmin(admin.ModelAdmin):
+    list_display = ("run", "event_id", "created_at")
+    search_fields = ("run__run_id",)
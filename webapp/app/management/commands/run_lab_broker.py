@@ -0,0 +1,50 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from services.lab_run_broker import LabRunBroker
+
+
+class Command(BaseCommand):
+    """
+    同じホストの web ワーカーで lab の run を共有するブローカー (services.lab_run_broker) を起動するコマンド。
+
+    使用例:
+    LAB_RUN_BROKER_SOCKET=/tmp/lab-runs.sock python manage.py run_lab_broker
+    python manage.py run_lab_broker --socket /tmp/lab-runs.sock
+
+    web ワーカー側も同じソケット (settings.LAB_RUNS['broker_socket_path']) を指定して起動すること。
+    """
+
+    help = "Run the local broker that shares lab runs between web workers on this host."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--socket", help="Unix domain socket path. Defaults to LAB_RUNS['broker_socket_path'].")
+
+    def handle(self, *args, **options):
+        config = dict(getattr(settings, "LAB_RUNS", {}))
+        socket_path = options["socket"] or config.get("broker_socket_path")
+        if not socket_path:
+            raise CommandError("Specify --socket or set LAB_RUNS['broker_socket_path'] (LAB_RUN_BROKER_SOCKET).")
+
+        # NOTE: リプレイバッファなどの上限はワーカーと同じ設定を使う。
+        broker = LabRunBroker(
+            socket_path,
+            **{
+                key: config[key]
+                for key in (
+                    "replay_buffer_max_frames",
+                    "replay_buffer_max_bytes",
+                    "replay_buffer_ttl",
+                    "finished_run_ttl",
+                    "subscriber_queue_size",
+                )
+                if key in config
+            },
+        )
+        self.stdout.write(f"Lab run broker listening on {socket_path}")
+        try:
+            asyncio.run(broker.serve_forever())
+        except KeyboardInterrupt:
+            pass
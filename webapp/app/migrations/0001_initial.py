@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LabRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('run_id', models.CharField(max_length=64, unique=True)),
+                ('request_id', models.CharField(max_length=64)),
+                ('module', models.CharField(max_length=128)),
+                ('args', models.JSONField(default=dict)),
+                ('status', models.CharField(
+                    choices=[
+                        ('running', 'Running'),
+                        ('completed', 'Completed'),
+                        ('error', 'Error'),
+                        ('cancelled', 'Cancelled'),
+                    ],
+                    default='running',
+                    max_length=16,
+                )),
+                ('error', models.TextField(blank=True, default='')),
+                ('started_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('duration_ms', models.FloatField(blank=True, null=True)),
+                ('frame_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [
+                    models.Index(fields=['-started_at', '-id'], name='lab_run_started_idx'),
+                    models.Index(fields=['module', '-started_at', '-id'], name='lab_run_module_started_idx'),
+                    models.Index(fields=['status', '-started_at', '-id'], name='lab_run_status_started_idx'),
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name='LabRunEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.PositiveIntegerField()),
+                ('data', models.JSONField()),
+                ('created_at', models.DateTimeField()),
+                ('run', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE,
+                    related_name='events',
+                    to='app.labrun',
+                    to_field='run_id',
+                )),
+            ],
+            options={
+                'ordering': ['run', 'event_id'],
+                'constraints': [models.UniqueConstraint(fields=('run', 'event_id'), name='lab_run_event_unique')],
+            },
+        ),
+    ]
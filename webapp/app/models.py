@@ -0,0 +1,58 @@
+from django.db import models
+
+
+class LabRun(models.Model):
+    """
+    lab モジュールの run の履歴。 run が終わってストリームが閉じても残る。
+    NOTE: 書き込みは services.lab_run_recorder がバックグラウンドでまとめて行う。ストリームは INSERT を待たない。
+          実行中の run (ActiveLabRun) そのものではないので、 status が running のまま更新が遅れることがある。
+    """
+
+    class Status(models.TextChoices):
+        RUNNING = "running"
+        COMPLETED = "completed"
+        ERROR = "error"
+        CANCELLED = "cancelled"
+
+    run_id = models.CharField(max_length=64, unique=True)
+    request_id = models.CharField(max_length=64)
+    module = models.CharField(max_length=128)
+    args = models.JSONField(default=dict)
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.RUNNING)
+    # エラーで終わった・キャンセルされた場合の理由。
+    error = models.TextField(blank=True, default="")
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration_ms = models.FloatField(null=True, blank=True)
+    frame_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        # NOTE: 履歴 API (LabRunHistoryView) は (started_at, id) の降順で keyset ページングするので、
+        #       絞り込み条件ごとにその並びの複合インデックスを持っておく。
+        indexes = [
+            models.Index(fields=["-started_at", "-id"], name="lab_run_started_idx"),
+            models.Index(fields=["module", "-started_at", "-id"], name="lab_run_module_started_idx"),
+            models.Index(fields=["status", "-started_at", "-id"], name="lab_run_status_started_idx"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.run_id} ({self.module}, {self.status})"
+
+
+class LabRunEvent(models.Model):
+    """
+    run が送ったフレームひとつ分。 data はフレームの data (JSON) そのもの。
+    """
+
+    # NOTE: recorder が LabRun を引かずに run_id の文字列のまま入れられるよう、 to_field は run_id 。
+    run = models.ForeignKey(LabRun, on_delete=models.CASCADE, to_field="run_id", related_name="events")
+    event_id = models.PositiveIntegerField()
+    data = models.JSONField()
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["run", "event_id"], name="lab_run_event_unique")]
+        ordering = ["run", "event_id"]
+
+    def __str__(self) -> str:
+        return f"{self.run_id} #{self.event_id}"
@@ -0,0 +1,142 @@
+"""
+app.tests.test_lab_views
+"""
+
+import json
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from services.lab_run_manager import LabRunManager
+
+# NOTE: bar は count 回 1 秒ずつ待つので、 count=1 なら 1 秒ほどで終わる。
+BAR_RUN = json.dumps({"module": "bar", "args": {"count": 1}})
+
+
+def _sse_frames(body: bytes) -> list[dict]:
+    """
+    SSE のボディを、フレームごとの {"id": ..., "event": ..., "data": ...} にする。コメントは除く。
+    """
+    frames = []
+    for block in body.split(b"\n\n"):
+        fields = dict(line.split(b": ", 1) for line in block.split(b"\n") if line and not line.startswith(b":"))
+        if b"data" in fields:
+            frames.append(
+                {
+                    "id": int(fields[b"id"]) if b"id" in fields else None,
+                    "event": fields[b"event"].decode() if b"event" in fields else None,
+                    "data": json.loads(fields[b"data"]),
+                }
+            )
+    return frames
+
+
+class TestLabViews(SimpleTestCase):
+
+    def setUp(self) -> None:
+        # NOTE: run の履歴を DB に書かないよう、 recorder なしのマネージャを使う。
+        #       切断された run がすぐ止まるよう、再接続を待つ猶予は短くしておく。
+        self.manager = LabRunManager(recorder=None, abandoned_run_grace_period=0.1)
+        patcher = mock.patch("app.views.get_lab_run_manager", return_value=self.manager)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_post_lab_streams_sse(self) -> None:
+        # Accept: text/event-stream (EventSource) で、連番の id つきの SSE が最後まで届くことを確認。
+        response = self.client.post(
+            "/api/app/lab", BAR_RUN, content_type="application/json", HTTP_ACCEPT="text/event-stream"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        frames = _sse_frames(b"".join(response.streaming_content))
+        messages = [frame for frame in frames if frame["event"] is None]
+        self.assertEqual([frame["id"] for frame in messages], list(range(1, len(messages) + 1)))
+        self.assertTrue(messages[0]["data"]["data"]["runId"].startswith("run-"))
+        self.assertEqual(messages[-1]["data"]["data"]["message"], "Stream completed")
+        self.assertEqual(frames[-1]["event"], "summary")
+
+    def test_post_lab_streams_ndjson(self) -> None:
+        # Accept: application/x-ndjson なら、 1 行にひとつの JSON で、 id がキーになることを確認。
+        response = self.client.post(
+            "/api/app/lab", BAR_RUN, content_type="application/json", HTTP_ACCEPT="application/x-ndjson"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        objects = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        messages = [obj for obj in objects if "data" in obj and "event" not in obj]
+        self.assertEqual([obj["id"] for obj in messages], list(range(1, len(messages) + 1)))
+        self.assertEqual(messages[-1]["data"]["message"], "Stream completed")
+        self.assertEqual(objects[-1]["event"], "summary")
+
+    def test_resume_with_last_event_id(self) -> None:
+        # POST /api/app/lab/runs で始めた run を、 Last-Event-ID の続きから受け取れることを確認。
+        response = self.client.post("/api/app/lab/runs", BAR_RUN, content_type="application/json")
+        self.assertEqual(response.status_code, 202)
+        run_id = response.json()["data"]["runId"]
+
+        response = self.client.get(f"/api/app/lab/runs/{run_id}", HTTP_LAST_EVENT_ID="2")
+        self.assertEqual(response.status_code, 200)
+        frames = [frame for frame in _sse_frames(b"".join(response.streaming_content)) if frame["event"] is None]
+        self.assertEqual(frames[0]["id"], 3)
+        self.assertEqual(frames[-1]["data"]["data"]["message"], "Stream completed")
+
+        response = self.client.get("/api/app/lab/runs/run-nope")
+        self.assertEqual(response.status_code, 404)
+
+    def test_client_going_away_cancels_the_run(self) -> None:
+        # resumable でない run は、クライアントがストリームを閉じたら、猶予のあとにキャンセルされることを確認。
+        response = self.client.post(
+            "/api/app/lab", json.dumps({"module": "bar", "args": {"count": 10}}), content_type="application/json"
+        )
+        first = next(iter(response.streaming_content))
+        run_id = _sse_frames(first)[0]["data"]["data"]["runId"]
+        response.close()
+
+        run = self.manager.get(run_id)
+        deadline = time.monotonic() + 2
+        while not run.finished and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertTrue(run.finished)
+        self.assertEqual(run.cancel_reason, "client went away")
+
+    def test_unknown_module_is_rejected_before_the_run_starts(self) -> None:
+        # 存在しないモジュールは、ストリームを開く前に 400 になり、 run も始まらないことを確認。
+        body = json.dumps({"module": "no_such_module", "args": {}})
+        for path in ("/api/app/lab", "/api/app/lab/runs"):
+            response = self.client.post(path, body, content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("module", response.json()["error"])
+        self.assertEqual(self.manager._runs, {})
+
+    def test_catalog_if_none_match(self) -> None:
+        # ETag が一致すれば 304 で、本文を返さないことを確認。
+        response = self.client.get("/api/app/lab/catalog")
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        response = self.client.get("/api/app/lab/catalog", HTTP_IF_NONE_MATCH=f"W/{etag}")
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["ETag"], etag)
+
+    def test_not_acceptable(self) -> None:
+        # ストリームの形式に無い Accept は 406 で、 run も始まらないことを確認。
+        response = self.client.post(
+            "/api/app/lab", BAR_RUN, content_type="application/json", HTTP_ACCEPT="application/xml"
+        )
+        self.assertEqual(response.status_code, 406)
+        self.assertEqual(self.manager._runs, {})
+
+    def test_sse_view_negotiates_stream_formats(self) -> None:
+        # SSEView も Accept: text/event-stream で 406 にならず、 NDJSON でも受け取れることを確認。
+        with mock.patch("app.views.time.sleep"):
+            response = self.client.get("/api/app/sse", HTTP_ACCEPT="text/event-stream")
+            self.assertEqual(response.status_code, 200)
+            frames = _sse_frames(b"".join(response.streaming_content))
+            self.assertEqual(frames[0]["data"]["data"]["message"], "SSE connection started")
+
+            response = self.client.get("/api/app/sse", HTTP_ACCEPT="application/x-ndjson")
+            self.assertEqual(response["Content-Type"], "application/x-ndjson")
+            lines = b"".join(response.streaming_content).splitlines()
+            self.assertEqual(json.loads(lines[0])["data"]["message"], "SSE connection started")
@@ -13,4 +13,17 @@ urlpatterns = [
     path('sse', views.SSEView.as_view()),
     # Lab API エンドポイント。
     path('lab', views.LabView.as_view()),
+    # Lab モジュールのカタログ (一覧) 。 ETag / If-None-Match 対応。
+    path('lab/catalog', views.LabCatalogView.as_view()),
+    # Lab モジュールを接続と切り離して実行する (runId を返す) 。
+    path('lab/runs', views.LabRunsView.as_view()),
+    # Lab モジュールの run の購読・再接続。 Last-Event-ID 対応。
+    path('lab/runs/<str:run_id>', views.LabRunView.as_view()),
+    # DB に残した Lab モジュールの run の履歴。 keyset ページング (cursor) 。
+    path('lab/history', views.LabRunHistoryView.as_view()),
+    path('lab/history/<str:run_id>', views.LabRunHistoryDetailView.as_view()),
+    # Lab モジュールのプロファイル (options.profile) のダウンロード。
+    path('lab/profiles/<str:request_id>', views.LabProfileView.as_view()),
+    # Prometheus 形式のメトリクス。
+    path('metrics', views.MetricsView.as_view()),
 ]
@@ -1,18 +1,44 @@
 import asyncio
+import hmac
 import logging
+import math
 import time
+from contextlib import aclosing
 from datetime import datetime
-from typing import Generator
+from typing import AsyncIterator, Generator
 
 from asgiref.sync import async_to_sync
-from django.http import HttpRequest, JsonResponse, StreamingHttpResponse
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import (
+    FileResponse,
+    HttpRequest,
+    HttpResponse,
+    HttpResponseNotModified,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
 from rest_framework.decorators import api_view
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import APIException, NotFound, PermissionDenied, Throttled, ValidationError
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
-from services.lab_module_execute_sse_service import LabModuleExecuteSSEService
+from app.models import LabRun, LabRunEvent
+from lab.module_specs import ModuleSpec
+from services.lab_module_args_validator import LabModuleArgsError
+from services.lab_module_registry import LabModuleImportError
 from services.lab_module_spec_service import LabModuleSpecService
-from shared.sse_formatters import SSEFormatter
+from services.lab_profile_store import PROFILE_FORMATS, get_lab_profile_store
+from services.lab_run_admission import LabRunRejected, get_lab_run_admission
+from services.lab_run_broker import RemoteLabRun
+from services.lab_run_history_service import LabRunHistoryService
+from services.lab_run_manager import ActiveLabRun, get_lab_run_manager
+from shared.async_streams import StreamLimitExceeded, aiterate_sync_iterator, iterate_async_iterator_sync, keepalive
+from shared.metrics import registry
+from shared.renderers import STREAM_RENDERER_CLASSES
+from shared.stream_formatters import SSE_STREAM_FORMATTER, StreamFormatter, StreamFrame, StreamFrameEncoder
 
 logger = logging.getLogger(__name__)
 
@@ -127,40 +153,49 @@ class SSEView(APIView):
         console.log('Received:', event.data);
     };
 
+    NDJSON などほかの形式でも受け取れる (LabView と同じく Accept か ?format=ndjson で選ぶ) 。
+    curl -i --no-buffer -H "Accept: application/x-ndjson" http://localhost:8001/api/app/sse
+
     urls では:
     path('sse', views.SSEView.as_view())
     """
 
+    # NOTE: EventSource は Accept: text/event-stream を送るので、ストリームのレンダラーが無いと 406 になる。
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, *STREAM_RENDERER_CLASSES]
+
     def get(self, request: HttpRequest, *args, **kwargs) -> StreamingHttpResponse:
         """
         SSE ストリームを開始する。
+        NOTE: LabView と同じく、 heartbeat とストリームの上限 (settings.SSE_KEEPALIVE) をつける。
         """
-        response = StreamingHttpResponse(self._create_sse_stream(request), content_type="text/event-stream")
-        response["Cache-Control"] = "no-cache"
-        return response
+        return _create_stream_response(request, aiterate_sync_iterator(self._create_sse_stream(request)))
 
-    def _create_sse_stream(self, request: HttpRequest) -> Generator[str, None, None]:
+    def _create_sse_stream(self, request: HttpRequest) -> Generator[StreamFrame, None, None]:
         """
-        SSE形式のストリームを作成する。
+        SSE のストリームのフレームを作成する。送る形式には _create_stream_response でエンコードする。
         """
+        # NOTE: requestId などの毎フレーム同じ部分は、ストリームごとに一度だけ JSON にしておく。
+        encoder = StreamFrameEncoder(request.request_id)
         try:
             # 接続開始メッセージ
-            yield SSEFormatter.format_message(request.request_id, "SSE connection started")
+            yield encoder.message("SSE connection started")
 
             # ビジネスロジックからメッセージを取得してSSE形式に変換
             for i, message in enumerate(self._generate_demo_messages(), 1):
-                yield SSEFormatter.format_message(request.request_id, message, progress=f"{i * 10}%")
-                logger.info(f"SSE message sent: {message}")
+                yield encoder.message(message, progress=f"{i * 10}%")
+                # NOTE: フレームごとのログは % 形式で渡す。組み立てはログのスレッドで行われ、
+                #       settings.LOGGING の per_frame フィルタで間引かれたものは組み立てもされない。
+                logger.info("SSE message sent: %s", message)
 
             # 完了メッセージ
-            yield SSEFormatter.format_completion(request.request_id)
+            yield encoder.completion()
             logger.info("SSE stream completed")
 
         except Exception as e:
             # エラーが発生した場合のログ出力
             logger.error(f"SSE stream error: {e}")
             # エラーメッセージをクライアントに送信
-            yield SSEFormatter.format_error(request.request_id, f"SSE stream error occurred: {str(e)}")
+            yield encoder.error(f"SSE stream error occurred: {str(e)}")
 
     def _generate_demo_messages(self) -> Generator[str, None, None]:
         """
@@ -184,6 +219,9 @@ class LabView(APIView):
     path('v1/lab', views.LabView.as_view())
     """
 
+    # NOTE: POST のストリームの形式を Accept で選べるようにする (_create_stream_response を参照) 。
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, *STREAM_RENDERER_CLASSES]
+
     def get(self, request, *args, **kwargs):
         """
         モジュール情報を返す API。
@@ -208,11 +246,7 @@ class LabView(APIView):
             response_data = {
                 "requestId": request.request_id,
                 "message": f"How to use {module_name}",
-                "data": {
-                    "module": module_spec.module,
-                    "description": module_spec.description,
-                    "args": module_spec.args,
-                },
+                "data": _serialize_module_spec(module_spec),
             }
 
             return JsonResponse(response_data)
@@ -221,6 +255,10 @@ class LabView(APIView):
             # モジュールが見つからない場合
             raise ValidationError({"module": [f"Module '{module_name}' not found in lab directory."]})
 
+        except LabModuleImportError as e:
+            # モジュールの import に失敗している場合
+            raise ValidationError({"module": [str(e)]})
+
         except AttributeError:
             # get_spec 関数が見つからない場合
             raise ValidationError({"module": [f"Module '{module_name}' does not have a 'get_spec' function."]})
@@ -228,58 +266,564 @@ class LabView(APIView):
     def post(self, request, *args, **kwargs):
         """
         モジュールを実行する API (SSE ストリーミング対応)。
+        lab モジュールの main は同期ジェネレータでも async ジェネレータ (lab.bar を参照) でも OK。
 
         使用例:
         curl -i -X POST "http://localhost:8001/api/app/lab" \
             -H "Content-Type: application/json" \
             -d '{"module": "foo", "args": {"arg1": "12345", "arg2": "67890"}}'
+
+        options でストリームの挙動を変えられる:
+        - coalesce: 大量のメッセージを出すモジュール向け。メッセージを一定時間・一定件数ごとにまとめて
+                    ひとつのイベント (data.messages に配列) で送る。 true なら settings.LAB_SSE_COALESCE のデフォルト。
+                    {"maxLatencyMs": 50, "maxBatchSize": 100} のように個別に指定もできる。
+        curl -i -X POST "http://localhost:8001/api/app/lab" \
+            -H "Content-Type: application/json" \
+            -d '{"module": "foo", "args": {}, "options": {"coalesce": true}}'
+        - profile: true ならモジュールの実行をプロファイルする。 staff ユーザーか、
+                   X-Lab-Profile-Token ヘッダ (settings.LAB_PROFILE_TOKEN) を送った呼び出し元だけ。
+                   ストリームの最後に "Profile saved" のメッセージで、ダウンロード先 (LabProfileView) が届く。
+        - resumable: true なら、切断されても run を止めずに再接続 (Last-Event-ID) を待つ (settings.LAB_RUNS の
+                     orphan_run_timeout 秒) 。デフォルトの false では、クライアントがいなくなってから
+                     abandoned_run_grace_period 秒のうちに再接続されなければ run を止めて、スレッドやプロセスを空ける。
+
+        run を始める前にアドミッションコントロール (settings.LAB_RUN_ADMISSION) を通す。
+        クライアントごと・モジュールごとのレート制限を超えたら 429 、同時実行数と待ち行列がいっぱいなら 503 を
+        Retry-After つきで返す。待ち行列に入った run は "Waiting for a free lab run slot" を送って、空くまで待つ。
+
+        各フレームには連番の id (SSE の id フィールド) がつく。 resumable なら開始メッセージの runId を使って、
+        切断後も GET /api/app/lab/runs/<runId> (Last-Event-ID つき) で続きから受け取れる (LabRunView を参照) 。
+
+        EventSource を使わないクライアントは、 Accept (あるいは ?format=) でストリームの形式を選べる
+        (shared.stream_formatters) 。指定が無ければ SSE 。
+        - application/x-ndjson (?format=ndjson): 1 行にひとつの JSON オブジェクト。 id は "id" キーになる。
+        - application/vnd.msgpack (?format=msgpack): 4 バイトの長さ + MessagePack 。
+        curl -i --no-buffer -X POST "http://localhost:8001/api/app/lab" \
+            -H "Content-Type: application/json" -H "Accept: application/x-ndjson" \
+            -d '{"module": "foo", "args": {"arg1": "12345", "arg2": "67890"}}'
         """
-        # リクエストボディからmoduleとargsを取得
-        module_name = request.data.get("module")
-        args = request.data.get("args", {})
+        module_name, args, coalesce, profile, resumable = _parse_lab_run_request(request)
 
-        if not module_name:
-            raise ValidationError({"module": ["This field is required."]})
+        # run を始めて、そのストリームを SSE で返却
+        # NOTE: モジュールは LabRunManager のバックグラウンドで回る。 resumable なら接続が切れても run は続くので、
+        #       開始メッセージの runId と Last-Event-ID で LabRunView から続きを受け取れる。
+        run = _start_lab_run(request, module_name, args, coalesce, profile, resumable)
+        _annotate_lab_run_timing(request, run)
+        return _create_stream_response(request, run.astream())
+
+
+class LabRunsView(APIView):
+    """
+    Lab モジュールを、 HTTP 接続とは切り離して実行する (run を始める) API エンドポイント。
+    すぐに runId を返すので、あとは何人でも GET /api/app/lab/runs/<runId> で同じ run を購読できる。
+    ダッシュボードを 10 個開いても、モジュールの実行は 1 回で済む。
+
+    使用例:
+    curl -i -X POST "http://localhost:8001/api/app/lab/runs" \
+        -H "Content-Type: application/json" \
+        -d '{"module": "foo", "args": {"arg1": "12345", "arg2": "67890"}}'
+
+    urls では:
+    path('lab/runs', views.LabRunsView.as_view())
+    """
+
+    def post(self, request, *args, **kwargs):
+        """
+        run を始めて、 runId を返す。ボディは POST /api/app/lab と同じ。
+        NOTE: 後から購読する前提なので、 options.resumable にかかわらず resumable な run になる。
+        """
+        module_name, args, coalesce, profile, _ = _parse_lab_run_request(request)
 
-        if not isinstance(args, dict):
-            raise ValidationError({"args": ["This field must be a dictionary."]})
+        run = _start_lab_run(request, module_name, args, coalesce, profile, resumable=True)
 
-        # SSE ストリーミングレスポンスを返却
-        response = StreamingHttpResponse(
-            self._create_lab_sse_stream(request, module_name, args), content_type="text/event-stream"
+        return JsonResponse(
+            {
+                "requestId": request.request_id,
+                "message": f"Started module: {module_name}",
+                "data": {"runId": run.run_id, "module": module_name},
+            },
+            status=202,
         )
-        response["Cache-Control"] = "no-cache"
-        return response
 
-    def _create_lab_sse_stream(self, request: HttpRequest, module_name: str, args: dict) -> Generator[str, None, None]:
+
+class LabRunView(APIView):
+    """
+    実行中 (あるいは実行し終わったばかり) の Lab モジュールの run を、 SSE で購読する API エンドポイント。
+    ひとつの run を何人で購読しても、全員に同じフレームが届く。
+    Last-Event-ID ヘッダ (EventSource が再接続のときに自動で送る) か ?lastEventId= を見て、
+    取りこぼしたフレームだけをリプレイバッファから再送し、そのまま続きのライブストリームにつなぐ。
+    run id は POST /api/app/lab/runs のレスポンス、あるいは POST /api/app/lab の開始メッセージの runId 。
+    NOTE: 受け取りが遅すぎるクライアントは settings.LAB_RUNS の slow_subscriber_policy に従って切断される。
+          その場合も Last-Event-ID で再接続すれば追いつける。
+
+    使用例:
+    curl -i --no-buffer -X GET "http://localhost:8001/api/app/lab/runs/run-..." -H "Last-Event-ID: 3"
+
+    urls では:
+    path('lab/runs/<str:run_id>', views.LabRunView.as_view())
+    """
+
+    # NOTE: LabView の POST と同じく、 Accept で NDJSON や MessagePack でも購読できる。
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, *STREAM_RENDERER_CLASSES]
+
+    def get(self, request, run_id: str, *args, **kwargs):
         """
-        Lab モジュール実行の SSE ストリームを作成する。
+        run のストリームを購読する。再接続もこれ。
         """
+        run = get_lab_run_manager().get(run_id)
+        if run is None:
+            raise NotFound(f"Lab run '{run_id}' not found. It may have expired.")
+
+        last_event_id = request.headers.get("Last-Event-ID") or request.GET.get("lastEventId")
+        if last_event_id is not None:
+            try:
+                last_event_id = int(last_event_id)
+            except ValueError:
+                raise ValidationError({"lastEventId": ["This field must be an integer."]})
+
+        if isinstance(run, ActiveLabRun):
+            # NOTE: 一度でも再接続された run は、以降は切断されても再接続を待つ (LabRunManager を参照) 。
+            run.resumable = True
+        _annotate_lab_run_timing(request, run)
+        return _create_stream_response(request, run.astream(last_event_id))
+
+
+class LabRunHistoryView(APIView):
+    """
+    DB に残した Lab モジュールの run の履歴を、新しい順に返す API エンドポイント。
+    ?module=, ?status= で絞り込める。続きは、レスポンスの nextCursor を ?cursor= に渡して取る。
+    NOTE: 履歴はバックグラウンドでまとめて書き込むので、終わったばかりの run は少し遅れて載る。
+
+    使用例:
+    curl -i -X GET "http://localhost:8001/api/app/lab/history?module=foo&status=error&limit=20"
+
+    urls では:
+    path('lab/history', views.LabRunHistoryView.as_view())
+    """
+
+    def get(self, request, *args, **kwargs):
+        status = request.GET.get("status")
+        if status is not None and status not in LabRun.Status.values:
+            raise ValidationError({"status": [f"This field must be one of {LabRun.Status.values}."]})
+        limit = _parse_non_negative_int(request, "limit", default=50, maximum=200)
+
         try:
-            # 開始メッセージ
-            yield SSEFormatter.format_message(
-                request.request_id, f"Starting module: {module_name}", module=module_name, args=args
+            runs, next_cursor = LabRunHistoryService().list_runs(
+                request.GET.get("module"), status, request.GET.get("cursor"), limit
             )
-            logger.info(f"Lab module execution started: {module_name}")
+        except ValueError as e:
+            raise ValidationError({"cursor": [str(e)]})
+
+        return JsonResponse(
+            {
+                "requestId": request.request_id,
+                "message": "Lab run history",
+                "data": {"runs": [_serialize_lab_run(run) for run in runs], "nextCursor": next_cursor},
+            }
+        )
 
-            # LabModuleExecuteSSEService を使用してモジュールを実行
-            sse_service = LabModuleExecuteSSEService()
 
-            for message in sse_service.execute_module_sse(module_name, args):
-                # execute_module_sse から受け取ったメッセージをそのまま SSE 形式でフォーマット
-                yield SSEFormatter.format_message(request.request_id, message, module=module_name)
-                logger.info(f"Lab module message sent: {message}")
+class LabRunHistoryDetailView(APIView):
+    """
+    DB に残した Lab モジュールの run ひとつと、 run が送ったフレームを返す API エンドポイント。
+    フレームは event id 順に limit 件まで。続きは ?afterEventId= に最後の eventId を渡して取る。
 
-            # 完了メッセージ
-            yield SSEFormatter.format_completion(request.request_id, module=module_name)
-            logger.info(f"Lab module execution completed: {module_name}")
+    使用例:
+    curl -i -X GET "http://localhost:8001/api/app/lab/history/run-...?afterEventId=500"
 
-        except (ModuleNotFoundError, AttributeError) as e:
-            # モジュール/関数の存在チェックエラー (設定ミス)
-            logger.error(f"Lab module configuration error: {e}")
-            yield SSEFormatter.format_error(request.request_id, str(e), module=module_name)
+    urls では:
+    path('lab/history/<str:run_id>', views.LabRunHistoryDetailView.as_view())
+    """
 
-        except Exception as e:
-            # その他の予期しないエラー
-            logger.error(f"Lab module execution error: {e}")
-            yield SSEFormatter.format_error(request.request_id, f"Unexpected error: {str(e)}", module=module_name)
+    def get(self, request, run_id: str, *args, **kwargs):
+        service = LabRunHistoryService()
+        run = service.get_run(run_id)
+        if run is None:
+            raise NotFound(f"Lab run '{run_id}' not found in history.")
+        after_event_id = _parse_non_negative_int(request, "afterEventId", default=0, maximum=None)
+        limit = _parse_non_negative_int(request, "limit", default=500, maximum=1000)
+        events = service.list_events(run_id, after_event_id, limit)
+
+        return JsonResponse(
+            {
+                "requestId": request.request_id,
+                "message": "Lab run",
+                "data": {**_serialize_lab_run(run), "events": [_serialize_lab_run_event(event) for event in events]},
+            }
+        )
+
+
+class MetricsView(APIView):
+    """
+    プロセス内で集計したメトリクスを Prometheus のテキスト形式で返す API エンドポイント。
+    - http_*: リクエスト全体・ middleware ・ view の時間 (middlewares.timing_middleware) 。
+    - sse_*: SSE の最初の 1 バイトまでの時間・ストリームの長さ・フレーム数・バイト数。
+    - lab_module_yield_seconds: lab モジュールがメッセージをひとつ yield するまでの時間。
+    NOTE: 値はワーカーのプロセスごと。 gunicorn の複数ワーカーなら、ワーカーごとに別の値が返る。
+
+    使用例:
+    curl -i -X GET "http://localhost:8001/api/app/metrics"
+
+    urls では:
+    path('metrics', views.MetricsView.as_view())
+    """
+
+    # NOTE: Prometheus からスクレイプするので、認証・ CSRF のチェックはしない。
+    authentication_classes = []
+    permission_classes = []
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+class LabProfileView(APIView):
+    """
+    options.profile: true で実行した Lab モジュールのプロファイルをダウンロードする API エンドポイント。
+    リクエストIDは、プロファイルした POST /api/app/lab (あるいは /api/app/lab/runs) のレスポンスの requestId 。
+    type で形式を選ぶ (NOTE: format は DRF が使うクエリパラメータなので避けている):
+    - summary (デフォルト): yield ごとの wall / CPU 時間と、時間のかかった関数の一覧 (JSON) 。
+    - pstats: cProfile の結果。 python -m pstats rq-xxxxxxxx.pstats や snakeviz で開ける。
+    - collapsed: サンプリングしたスタック。 flamegraph.pl や speedscope で flame graph にできる。
+    NOTE: プロファイルを始めるときと同じく、特権のある呼び出し元だけ。
+
+    使用例:
+    curl -o rq-xxxxxxxx.pstats "http://localhost:8001/api/app/lab/profiles/rq-xxxxxxxx?type=pstats" \
+        -H "X-Lab-Profile-Token: ..."
+
+    urls では:
+    path('lab/profiles/<str:request_id>', views.LabProfileView.as_view())
+    """
+
+    def get(self, request, request_id: str, *args, **kwargs):
+        _check_profiling_allowed(request)
+        profile_format = request.GET.get("type", "summary")
+        if profile_format not in PROFILE_FORMATS:
+            raise ValidationError({"type": [f"This field must be one of {list(PROFILE_FORMATS)}."]})
+        try:
+            path = get_lab_profile_store().path(request_id, profile_format)
+        except ValueError:
+            path = None
+        if path is None:
+            raise NotFound(f"Lab profile for '{request_id}' not found. It may have been pruned.")
+
+        if profile_format == "summary":
+            return FileResponse(path.open("rb"), content_type="application/json")
+        return FileResponse(
+            path.open("rb"),
+            as_attachment=True,
+            filename=path.name,
+            content_type="text/plain; charset=utf-8" if profile_format == "collapsed" else "application/octet-stream",
+        )
+
+
+class LabCatalogView(APIView):
+    """
+    Lab モジュールの一覧 (カタログ) を返す API エンドポイント。
+    LabView.get をモジュールの数だけ呼ばなくても、一回で全部の ModuleSpec が取れる。
+
+    - ETag は lab モジュールのファイルの中身から作る。 If-None-Match が一致すれば 304 (本文なし) を返す。
+    - import に失敗しているモジュールは、 {"module": "...", "error": "..."} のエントリとして一覧に入る。
+    - Cache-Control: public をつけるので、 nginx の proxy_cache でもキャッシュできる。
+
+    使用例:
+    curl -i -X GET "http://localhost:8001/api/app/lab/catalog"
+    curl -i -X GET "http://localhost:8001/api/app/lab/catalog?modules=foo,bar"
+    curl -i -X GET "http://localhost:8001/api/app/lab/catalog" -H 'If-None-Match: "..."'
+
+    urls では:
+    path('lab/catalog', views.LabCatalogView.as_view())
+    """
+
+    # NOTE: 誰が呼んでも同じ内容。認証をしなければセッションに触らないので、 Vary: Cookie がつかずキャッシュが効く。
+    authentication_classes: list = []
+    permission_classes: list = []
+
+    def get(self, request, *args, **kwargs):
+        """
+        モジュールの一覧を返す。 ?modules=foo,bar で絞り込める。
+        """
+        modules_param = request.GET.get("modules")
+        module_names = [name.strip() for name in modules_param.split(",") if name.strip()] if modules_param else None
+
+        service = LabModuleSpecService()
+
+        try:
+            etag = service.get_catalog_etag(module_names)
+
+            # NOTE: 圧縮したレスポンスの ETag は弱い ETag (W/"...") になる (middlewares.compression_middleware) 。
+            #       If-None-Match は弱い比較でよいので、 W/ を外して比べる。
+            if_none_match = [tag.removeprefix("W/") for tag in parse_etags(request.headers.get("If-None-Match", ""))]
+            if etag in if_none_match:
+                # 変わっていないので本文は作らない。
+                response = HttpResponseNotModified()
+            else:
+                modules = [_serialize_module_spec(spec) for spec in service.get_module_specs(module_names)]
+                modules += [
+                    {"module": module_name, "error": error}
+                    for module_name, error in service.get_module_import_errors(module_names).items()
+                ]
+                modules.sort(key=lambda module: module["module"])
+                # NOTE: 共有キャッシュに載せるので、リクエストごとに変わる requestId は本文に入れない。
+                response = JsonResponse({"message": "Lab module catalog", "data": {"modules": modules}})
+
+        except ModuleNotFoundError as e:
+            raise ValidationError({"modules": [str(e)]})
+
+        except AttributeError as e:
+            raise ValidationError({"modules": [str(e)]})
+
+        response["ETag"] = etag
+        patch_cache_control(response, public=True, max_age=settings.LAB_CATALOG_CACHE_MAX_AGE)
+        return response
+
+
+def _serialize_module_spec(module_spec: ModuleSpec) -> dict:
+    """
+    ModuleSpec を API のレスポンス用の dict にする。
+    """
+    return {
+        "module": module_spec.module,
+        "description": module_spec.description,
+        "args": module_spec.args,
+    }
+
+
+def _serialize_lab_run(run: LabRun) -> dict:
+    return {
+        "runId": run.run_id,
+        "requestId": run.request_id,
+        "module": run.module,
+        "args": run.args,
+        "status": run.status,
+        "error": run.error,
+        "startedAt": run.started_at.isoformat(),
+        "finishedAt": run.finished_at.isoformat() if run.finished_at else None,
+        "durationMs": run.duration_ms,
+        "frameCount": run.frame_count,
+    }
+
+
+def _serialize_lab_run_event(event: LabRunEvent) -> dict:
+    return {"eventId": event.event_id, "data": event.data, "createdAt": event.created_at.isoformat()}
+
+
+def _parse_non_negative_int(request, name: str, default: int, maximum: int | None) -> int:
+    """
+    クエリパラメータの 0 以上の整数を取り出す。 maximum を超えたら maximum にする。
+    """
+    value = request.GET.get(name)
+    if value is None:
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValidationError({name: ["This field must be an integer."]})
+    if number < 0:
+        raise ValidationError({name: ["This field must be 0 or greater."]})
+    return number if maximum is None else min(number, maximum)
+
+
+def _parse_lab_run_request(request) -> tuple[str, dict, tuple[float, int] | None, bool, bool]:
+    """
+    POST /api/app/lab, POST /api/app/lab/runs のボディから、
+    (モジュール名, args, coalesce, profile, resumable) を取り出す。
+    """
+    # リクエストボディからmoduleとargsを取得
+    module_name = request.data.get("module")
+    args = request.data.get("args", {})
+    options = request.data.get("options", {})
+
+    if not module_name:
+        raise ValidationError({"module": ["This field is required."]})
+
+    if not isinstance(args, dict):
+        raise ValidationError({"args": ["This field must be a dictionary."]})
+
+    if not isinstance(options, dict):
+        raise ValidationError({"options": ["This field must be a dictionary."]})
+
+    # NOTE: ストリームを開いてモジュールを走らせる前に、モジュールがあることを確かめ、
+    #       ModuleSpec.args の宣言で検証・型変換しておく。
+    try:
+        args = LabModuleSpecService().validate_module_args(module_name, args)
+    except ModuleNotFoundError:
+        raise ValidationError({"module": [f"Module '{module_name}' not found in lab directory."]})
+    except LabModuleImportError as e:
+        raise ValidationError({"module": [str(e)]})
+    except LabModuleArgsError as e:
+        raise ValidationError({"args": e.errors})
+
+    coalesce = _parse_coalesce_option(options.get("coalesce", False))
+
+    profile = options.get("profile", False)
+    if not isinstance(profile, bool):
+        raise ValidationError({"options": {"profile": ["This field must be a boolean."]}})
+    if profile:
+        _check_profiling_allowed(request)
+
+    resumable = options.get("resumable", False)
+    if not isinstance(resumable, bool):
+        raise ValidationError({"options": {"resumable": ["This field must be a boolean."]}})
+    return module_name, args, coalesce, profile, resumable
+
+
+class _LabRunsUnavailable(APIException):
+    """
+    同時に実行している run が多すぎて、今は始められない (503) 。
+    NOTE: DRF の exception_handler は wait があれば Retry-After ヘッダをつける。
+    """
+
+    status_code = 503
+    default_detail = "Too many lab runs in progress."
+    default_code = "service_unavailable"
+
+    def __init__(self, detail: str | None = None, wait: float | None = None) -> None:
+        super().__init__(detail)
+        self.wait = None if wait is None else math.ceil(wait)
+
+
+def _start_lab_run(
+    request, module_name: str, args: dict, coalesce: tuple[float, int] | None, profile: bool, resumable: bool
+) -> ActiveLabRun:
+    """
+    アドミッションコントロール (services.lab_run_admission) を通してから run を始める。
+
+    Raises:
+        Throttled: クライアント・モジュールのレート制限を超えた場合 (429)
+        _LabRunsUnavailable: 同時実行数と待ち行列がいっぱいの場合 (503)
+    """
+    try:
+        ticket = get_lab_run_admission().admit(_client_id(request), module_name)
+    except LabRunRejected as e:
+        if e.status_code == 429:
+            raise Throttled(wait=e.retry_after, detail=e.detail)
+        raise _LabRunsUnavailable(e.detail, wait=e.retry_after)
+    try:
+        return get_lab_run_manager().start(
+            request.request_id, module_name, args, coalesce, profile, ticket, resumable=resumable
+        )
+    except BaseException:
+        ticket.release()
+        raise
+
+
+def _client_id(request) -> str:
+    """
+    レート制限のためにクライアントを見分けるキー。ログインしていればユーザー、そうでなければ IP アドレス。
+    NOTE: リバースプロキシの後ろでは REMOTE_ADDR がプロキシになるので、プロキシ側で実 IP を渡すこと。
+    """
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        return f"user:{user.pk}"
+    return f"ip:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def _check_profiling_allowed(request) -> None:
+    """
+    lab モジュールのプロファイルを使ってよい呼び出し元か確認する。
+    staff ユーザーか、 X-Lab-Profile-Token ヘッダが settings.LAB_PROFILE_TOKEN と一致すれば OK 。
+
+    Raises:
+        PermissionDenied: 使ってはいけない場合
+    """
+    if getattr(request.user, "is_staff", False):
+        return
+    token = getattr(settings, "LAB_PROFILE_TOKEN", None)
+    given = request.headers.get("X-Lab-Profile-Token")
+    # NOTE: トークンの比較は、かかる時間から中身を推測されないよう compare_digest で。
+    if token and given and hmac.compare_digest(given.encode(), token.encode()):
+        return
+    raise PermissionDenied("Profiling lab modules is restricted to privileged callers.")
+
+
+def _parse_coalesce_option(value) -> tuple[float, int] | None:
+    """
+    options.coalesce を (最大待ち時間 (秒), 最大件数) にする。まとめない場合は None 。
+    """
+    if value is False or value is None:
+        return None
+    defaults = settings.LAB_SSE_COALESCE
+    if value is True:
+        return defaults["max_latency_ms"] / 1000, defaults["max_batch_size"]
+    if not isinstance(value, dict):
+        raise ValidationError({"options": {"coalesce": ["This field must be a boolean or a dictionary."]}})
+
+    max_latency_ms = value.get("maxLatencyMs", defaults["max_latency_ms"])
+    max_batch_size = value.get("maxBatchSize", defaults["max_batch_size"])
+    # NOTE: bool は int のサブクラスなので弾いておく。
+    errors = {}
+    if isinstance(max_latency_ms, bool) or not isinstance(max_latency_ms, (int, float)) or max_latency_ms <= 0:
+        errors["maxLatencyMs"] = ["This field must be a positive number."]
+    if isinstance(max_batch_size, bool) or not isinstance(max_batch_size, int) or max_batch_size <= 0:
+        errors["maxBatchSize"] = ["This field must be a positive integer."]
+    if errors:
+        raise ValidationError({"options": {"coalesce": errors}})
+    return max_latency_ms / 1000, max_batch_size
+
+
+def _annotate_lab_run_timing(request, run: ActiveLabRun | RemoteLabRun) -> None:
+    """
+    SSE の最後の summary イベントに、モジュール自体にかかった時間を載せる (middlewares.timing_middleware) 。
+    NOTE: ほかのワーカーで実行中の run (RemoteLabRun) の時間はこのワーカーからは分からないので載せない。
+    """
+    timing = getattr(request, "timing", None)
+    if timing is None or not isinstance(run, ActiveLabRun):
+        return
+    # NOTE: ストリームが終わったときの値にしたいので callable で渡す。
+    timing.annotate("moduleMs", lambda: round(run.module_seconds * 1000, 3))
+    timing.annotate("moduleYields", lambda: run.module_yields)
+
+
+def _create_stream_response(request, stream: AsyncIterator[StreamFrame]) -> StreamingHttpResponse:
+    """
+    フレーム (StreamFrame) を流す async イテレータから、ストリーミングのレスポンスを作る。
+    形式は DRF のコンテントネゴシエーションで選ばれたもの (shared.renderers) 。 view が STREAM_RENDERER_CLASSES を
+    持っていなければ SSE 。
+    NOTE: ASGI では async イテレータを渡すと、待機中のストリームがスレッドを握らずイベントループを共有できる。
+          WSGI で async イテレータを渡すと Django が全部バッファしてしまうので、同期イテレータに変換して渡す。
+    """
+    formatter = _accepted_stream_formatter(request)
+    stream = _keepalive_stream(request, formatter.aformat(stream), formatter)
+    if not _is_asgi_request(request):
+        stream = iterate_async_iterator_sync(stream)
+    response = StreamingHttpResponse(stream, content_type=formatter.media_type)
+    response["Cache-Control"] = "no-cache"
+    return response
+
+
+async def _keepalive_stream(
+    request, stream: AsyncIterator[bytes], formatter: StreamFormatter = SSE_STREAM_FORMATTER
+) -> AsyncIterator[bytes]:
+    """
+    ストリームに heartbeat (formatter の形式) をはさみ、上限 (settings.SSE_KEEPALIVE) を超えたら打ち切る。
+    - 何も送らない間 (foo が sleep している間など) も heartbeat_interval 秒ごとに ": ping" を送るので、
+      プロキシにアイドルで切られない。クライアントがいなくなっていれば、その write で気づける。
+    - クライアントの切断・打ち切りのどちらでも元のストリームを閉じるので、モジュールのジェネレータまで止まる。
+    NOTE: 打ち切られたクライアントは、 Last-Event-ID つきで LabRunView に再接続すれば続きから受け取れる。
+    """
+    config = settings.SSE_KEEPALIVE
+    frames = keepalive(
+        stream, formatter.heartbeat, config["heartbeat_interval"], config["max_idle"], config["max_lifetime"]
+    )
+    async with aclosing(frames):
+        try:
+            async for frame in frames:
+                yield frame
+        except StreamLimitExceeded as e:
+            logger.info(f"Closing SSE stream {request.request_id}: {e}")
+            yield formatter.format_comment(f"closed: {e}")
+
+
+def _accepted_stream_formatter(request) -> StreamFormatter:
+    """
+    コンテントネゴシエーションで選ばれたストリームの形式。ストリームのレンダラーが選ばれていなければ SSE 。
+    """
+    return getattr(getattr(request, "accepted_renderer", None), "formatter", SSE_STREAM_FORMATTER)
+
+
+def _is_asgi_request(request) -> bool:
+    """
+    ASGI サーバ (config.asgi) 経由のリクエストかどうか。
+    """
+    # NOTE: DRF の Request は Django の HttpRequest を _request に持っている。
+    return isinstance(getattr(request, "_request", request), ASGIRequest)
@@ -0,0 +1,61 @@
+"""
+JSTFormatter などのマイクロベンチマーク。
+1 秒ごとのキャッシュを入れる前 (レコードごとに datetime を作って strftime する) と比べる。
+
+使用例:
+pipenv run python -m benchmarks.bench_logging_formatters
+"""
+import logging
+import time
+import timeit
+from datetime import datetime, timezone
+
+from shared.logging_formatters import JSTFormatter, JSTJSONFormatter, UTCFormatter
+
+NUMBER = 100_000
+FORMAT = "[%(asctime)s] [%(process)d] [%(levelname)s] [%(name)s] %(message)s"
+
+
+class UncachedJSTFormatter(logging.Formatter):
+    """
+    キャッシュを入れる前の JSTFormatter.formatTime 。
+    """
+
+    def formatTime(self, record: logging.LogRecord, datefmt: str | None = None) -> str:
+        ct = datetime.fromtimestamp(record.created, timezone.utc).astimezone(JSTFormatter.JST)
+        if datefmt:
+            return ct.strftime(datefmt)
+        assert self.default_time_format is not None
+        assert self.default_msec_format is not None
+        return self.default_msec_format % (ct.strftime(self.default_time_format), record.msecs)
+
+
+def _record() -> logging.LogRecord:
+    # NOTE: 本番と同じく、 created は 1 秒の中で少しずつ進む。
+    record = logging.LogRecord("app.views", logging.INFO, "", 0, "sent: %s", ("rq-12345678",), None)
+    record.created = time.time()
+    return record
+
+
+def main() -> None:
+    records = [_record() for _ in range(1000)]
+    results = {}
+    for name, formatter in [
+        ("before (uncached JST)", UncachedJSTFormatter(FORMAT)),
+        ("JSTFormatter", JSTFormatter(FORMAT)),
+        ("UTCFormatter", UTCFormatter(FORMAT)),
+        ("JSTJSONFormatter", JSTJSONFormatter()),
+    ]:
+        def bench(formatter: logging.Formatter = formatter) -> None:
+            for record in records:
+                formatter.format(record)
+
+        seconds = min(timeit.repeat(bench, number=NUMBER // len(records), repeat=5))
+        results[name] = seconds
+        print(f"{name:<24} {NUMBER / seconds:>12,.0f} records/s  ({seconds / NUMBER * 1e6:.2f} us/record)")
+    speedup = results["before (uncached JST)"] / results["JSTFormatter"]
+    print(f"speedup: x{speedup:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+SSEFormatter と SSEFrameEncoder のマイクロベンチマーク。
+
+使用例:
+pipenv run python -m benchmarks.bench_sse_formatters
+"""
+import timeit
+
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(USE_TZ=True)
+
+from shared.sse_formatters import SSEFormatter, SSEFrameEncoder  # noqa: E402
+
+NUMBER = 100_000
+REQUEST_ID = "rq-12345678"
+MESSAGE = "メインの処理を開始するよ! 5秒かかる!"
+
+
+def bench_formatter() -> None:
+    SSEFormatter.format_message(REQUEST_ID, MESSAGE, module="foo").encode()
+
+
+encoder = SSEFrameEncoder(REQUEST_ID, module="foo")
+
+
+def bench_encoder() -> None:
+    encoder.message(MESSAGE)
+
+
+def main() -> None:
+    results = {}
+    for name, func in [("SSEFormatter.format_message", bench_formatter), ("SSEFrameEncoder.message", bench_encoder)]:
+        seconds = min(timeit.repeat(func, number=NUMBER, repeat=5))
+        results[name] = seconds
+        print(f"{name:<30} {NUMBER / seconds:>12,.0f} frames/s  ({seconds / NUMBER * 1e6:.2f} us/frame)")
+    speedup = results["SSEFormatter.format_message"] / results["SSEFrameEncoder.message"]
+    print(f"speedup: x{speedup:.2f}")
+
+
+if __name__ == "__main__":
+    main()
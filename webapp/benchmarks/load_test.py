@@ -0,0 +1,371 @@
+"""
+SSE と lab のエンドポイントの負荷試験・ベンチマーク。
+サーバ (WSGI: gunicorn / ASGI: gunicorn + uvicorn worker) を DB なしの settings (benchmarks.settings) で立てて、
+シナリオごと・同時接続数ごとに叩いて、結果を JSON に書き出す。 JSON を並べれば、変更で遅くなっていないか比べられる。
+
+測るもの:
+- requests/s
+- レイテンシ (レスポンスを最後まで受け取るまで) の p50 / p95 / p99
+- 最初のイベント (SSE の data:) までの時間の p50 / p95 / p99
+- 同時に開いていたストリームの最大数
+- 接続ひとつあたりのメモリ (サーバのプロセスの RSS の増え方 / 同時接続数) 。 /proc を読むので Linux のみ。
+
+使用例:
+pipenv run python -m benchmarks.load_test --servers wsgi,asgi --concurrency 1,10,50
+pipenv run python -m benchmarks.load_test --scenarios lab_post --concurrency 100 --baseline benchmarks/results/前回.json
+# すでに立っているサーバを叩くだけなら (メモリは測らない):
+pipenv run python -m benchmarks.load_test --url http://127.0.0.1:8000
+
+NOTE: 外部のライブラリに頼らないよう、クライアントは asyncio の素の HTTP/1.1 で書いている。
+      サーバ側は gunicorn (Pipfile) と、 ASGI なら uvicorn が要る。
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+from urllib.parse import urlsplit
+
+WEBAPP_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+# サーバの起動コマンド。 {port}, {workers}, {threads} を埋める。
+SERVER_COMMANDS = {
+    "wsgi": [
+        sys.executable, "-m", "gunicorn", "config.wsgi:application",
+        "--bind", "127.0.0.1:{port}", "--workers", "{workers}", "--threads", "{threads}",
+    ],
+    "asgi": [
+        sys.executable, "-m", "gunicorn", "config.asgi:application",
+        "--bind", "127.0.0.1:{port}", "--workers", "{workers}", "--worker-class", "uvicorn.workers.UvicornWorker",
+    ],
+    # gunicorn が無い環境で、とりあえず動かしてみる用 (開発サーバ・ WSGI) 。
+    "runserver": [sys.executable, "manage.py", "runserver", "--noreload", "127.0.0.1:{port}"],
+}  # fmt: skip
+
+
+@dataclass
+class Scenario:
+    """
+    叩くエンドポイントひとつ分。
+    """
+
+    method: str
+    path: str
+    body: dict[str, Any] | None = None
+    # SSE のストリームなら True 。最初のイベントまでの時間と同時ストリーム数を測る。
+    stream: bool = False
+
+
+def build_scenarios(lab_module: str, lab_args: dict[str, Any]) -> dict[str, Scenario]:
+    return {
+        "sse": Scenario("GET", "/api/app/sse", stream=True),
+        "lab_get": Scenario("GET", f"/api/app/lab?module={lab_module}"),
+        "lab_post": Scenario("POST", "/api/app/lab", {"module": lab_module, "args": lab_args}, stream=True),
+        "foo": Scenario("GET", "/api/app/foo"),
+        "baz": Scenario("POST", "/api/app/baz", {}),
+    }
+
+
+@dataclass
+class _Result:
+    latency: float
+    first_event: float | None
+    ok: bool
+
+
+@dataclass
+class _Counters:
+    open_streams: int = 0
+    max_open_streams: int = 0
+    results: list[_Result] = field(default_factory=list)
+
+
+async def _request(host: str, port: int, scenario: Scenario, counters: _Counters) -> None:
+    """
+    リクエストを 1 回送って、レスポンスを最後まで読む。
+    NOTE: Connection: close にして、ボディは接続が閉じるまで読む (chunked のままでよい) 。
+    """
+    body = json.dumps(scenario.body).encode() if scenario.body is not None else b""
+    head = (
+        f"{scenario.method} {scenario.path} HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: close\r\n"
+        f"Accept: */*\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n"
+    )
+    started_at = time.perf_counter()
+    first_event = None
+    ok = False
+    streaming = False
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            writer.write(head.encode() + body)
+            await writer.drain()
+            status_line = await reader.readline()
+            ok = status_line.split(b" ")[1:2] in ([b"200"], [b"202"])
+            await reader.readuntil(b"\r\n\r\n")
+            if scenario.stream:
+                streaming = True
+                counters.open_streams += 1
+                counters.max_open_streams = max(counters.max_open_streams, counters.open_streams)
+            received = b""
+            while chunk := await reader.read(65536):
+                if scenario.stream and first_event is None:
+                    # NOTE: チャンクの境目でまたがっても見つかるよう、見つかるまでは貯めておく。
+                    received += chunk
+                    if b"data:" in received:
+                        first_event = time.perf_counter() - started_at
+                        received = b""
+        finally:
+            writer.close()
+    except (OSError, asyncio.IncompleteReadError, IndexError):
+        ok = False
+    finally:
+        if streaming:
+            counters.open_streams -= 1
+    counters.results.append(_Result(time.perf_counter() - started_at, first_event, ok))
+
+
+async def _run_scenario(
+    host: str, port: int, scenario: Scenario, concurrency: int, duration: float, memory: "_MemorySampler | None"
+) -> dict[str, Any]:
+    """
+    concurrency 本の接続で、 duration 秒のあいだ繰り返し叩く (どの接続も最低 1 回は送る) 。
+    """
+    counters = _Counters()
+    deadline = time.perf_counter() + duration
+
+    async def client() -> None:
+        while True:
+            await _request(host, port, scenario, counters)
+            if time.perf_counter() >= deadline:
+                return
+
+    baseline_rss = memory.sample() if memory else None
+    sampler = asyncio.create_task(memory.run()) if memory else None
+    started_at = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started_at
+    if sampler is not None:
+        sampler.cancel()
+
+    latencies = [result.latency for result in counters.results if result.ok]
+    first_events = [result.first_event for result in counters.results if result.ok and result.first_event is not None]
+    report: dict[str, Any] = {
+        "concurrency": concurrency,
+        "requests": len(counters.results),
+        "errors": sum(1 for result in counters.results if not result.ok),
+        "elapsedSeconds": round(elapsed, 3),
+        "requestsPerSecond": round(len(latencies) / elapsed, 3),
+        "latencyMs": _percentiles(latencies),
+    }
+    if scenario.stream:
+        report["timeToFirstEventMs"] = _percentiles(first_events)
+        report["maxConcurrentStreams"] = counters.max_open_streams
+    if memory is not None and baseline_rss is not None:
+        peak_rss = max(memory.peak, baseline_rss)
+        connections = counters.max_open_streams or concurrency
+        report["serverRssBytes"] = {"baseline": baseline_rss, "peak": peak_rss}
+        report["memoryPerConnectionBytes"] = round((peak_rss - baseline_rss) / connections)
+    return report
+
+
+def _percentiles(values: list[float]) -> dict[str, float | None]:
+    """
+    p50 / p95 / p99 (ミリ秒) 。 nearest-rank 法。
+    """
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    ordered = sorted(values)
+    result = {}
+    for p in (50, 95, 99):
+        index = max(0, -(-p * len(ordered) // 100) - 1)
+        result[f"p{p}"] = round(ordered[index] * 1000, 3)
+    return result
+
+
+class _MemorySampler:
+    """
+    サーバのプロセス (と子プロセス) の RSS の合計を、一定間隔で測って最大値を持っておく。
+    """
+
+    def __init__(self, pid: int, interval: float = 0.1) -> None:
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+
+    def sample(self) -> int | None:
+        total = 0
+        for pid in self._process_tree(self.pid):
+            try:
+                with open(f"/proc/{pid}/status") as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"):
+                            total += int(line.split()[1]) * 1024
+            except OSError:
+                pass
+        if total == 0:
+            return None
+        self.peak = max(self.peak, total)
+        return total
+
+    async def run(self) -> None:
+        self.peak = 0
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    @classmethod
+    def _process_tree(cls, pid: int) -> list[int]:
+        pids = [pid]
+        try:
+            for task in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{task}/children") as f:
+                    for child in f.read().split():
+                        pids.extend(cls._process_tree(int(child)))
+        except OSError:
+            pass
+        return pids
+
+
+class _Server:
+    """
+    ベンチマーク用にサーバを立てて、終わったら止める。
+    """
+
+    def __init__(self, kind: str, port: int, workers: int, threads: int) -> None:
+        values = {"port": port, "workers": workers, "threads": threads}
+        self.command = [part.format(**values) for part in SERVER_COMMANDS[kind]]
+        self.port = port
+        self.process: subprocess.Popen | None = None
+
+    def __enter__(self) -> "_Server":
+        env = {**os.environ, "DJANGO_SETTINGS_MODULE": "benchmarks.settings"}
+        self.process = subprocess.Popen(self.command, cwd=WEBAPP_DIR, env=env, stdout=subprocess.DEVNULL)
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {self.process.returncode}: {' '.join(self.command)}")
+            try:
+                with socket.create_connection(("127.0.0.1", self.port), timeout=0.5):
+                    return self
+            except OSError:
+                time.sleep(0.2)
+        self.__exit__()
+        raise RuntimeError(f"Server did not start listening on port {self.port}")
+
+    def __exit__(self, *exc: object) -> None:
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=WEBAPP_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_report(server: str, name: str, report: dict[str, Any], baseline: dict[str, Any] | None) -> None:
+    line = (
+        f"{server:<9} {name:<9} c={report['concurrency']:<4} {report['requestsPerSecond']:>9.2f} req/s  "
+        f"p50={report['latencyMs']['p50']}ms p95={report['latencyMs']['p95']}ms p99={report['latencyMs']['p99']}ms  "
+        f"errors={report['errors']}"
+    )
+    if "timeToFirstEventMs" in report:
+        line += f"  ttfe.p95={report['timeToFirstEventMs']['p95']}ms streams={report['maxConcurrentStreams']}"
+    if "memoryPerConnectionBytes" in report:
+        line += f"  mem/conn={report['memoryPerConnectionBytes'] / 1024:.0f}KiB"
+    if baseline is not None and baseline["requestsPerSecond"]:
+        change = report["requestsPerSecond"] / baseline["requestsPerSecond"] - 1
+        line += f"  (req/s {change:+.1%} vs baseline)"
+    print(line, flush=True)
+
+
+def _find_baseline(baseline: dict[str, Any] | None, server: str, name: str, concurrency: int) -> dict[str, Any] | None:
+    if baseline is None:
+        return None
+    for report in baseline.get("servers", {}).get(server, {}).get(name, []):
+        if report["concurrency"] == concurrency:
+            return report
+    return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--servers", default="wsgi,asgi", help=f"カンマ区切り。 {', '.join(SERVER_COMMANDS)}")
+    parser.add_argument("--url", help="すでに立っているサーバを叩く場合のベース URL 。 --servers は無視する")
+    parser.add_argument("--scenarios", default="sse,lab_get,lab_post,foo,baz", help="カンマ区切り")
+    parser.add_argument("--concurrency", default="1,10,50", help="同時接続数。カンマ区切りで複数指定できる")
+    parser.add_argument("--duration", type=float, default=10.0, help="シナリオ・同時接続数ごとに叩き続ける秒数")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn のワーカー数")
+    parser.add_argument("--threads", type=int, default=32, help="gunicorn (WSGI) のワーカーあたりのスレッド数")
+    parser.add_argument("--lab-module", default="bar", help="lab_get, lab_post で使うモジュール")
+    parser.add_argument("--lab-args", default='{"count": 3}', help="lab_post で使う args (JSON)")
+    parser.add_argument("--output", help=f"結果の JSON 。デフォルトは {RESULTS_DIR.name}/<日時>.json")
+    parser.add_argument("--baseline", help="比べる前回の結果の JSON")
+    options = parser.parse_args()
+
+    all_scenarios = build_scenarios(options.lab_module, json.loads(options.lab_args))
+    names = options.scenarios.split(",")
+    unknown = set(names) - set(all_scenarios)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    concurrencies = [int(value) for value in options.concurrency.split(",")]
+    baseline = json.loads(Path(options.baseline).read_text()) if options.baseline else None
+
+    results: dict[str, Any] = {
+        "startedAt": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "gitCommit": _git_commit(),
+        "python": sys.version.split()[0],
+        "options": {key: value for key, value in vars(options).items() if key not in ("output", "baseline")},
+        "servers": {},
+    }
+
+    def run_all(server: str, host: str, port: int, memory: _MemorySampler | None) -> None:
+        reports = results["servers"][server] = {}
+        for name in names:
+            reports[name] = []
+            for concurrency in concurrencies:
+                report = asyncio.run(
+                    _run_scenario(host, port, all_scenarios[name], concurrency, options.duration, memory)
+                )
+                reports[name].append(report)
+                _print_report(server, name, report, _find_baseline(baseline, server, name, concurrency))
+
+    if options.url:
+        url = urlsplit(options.url)
+        run_all("external", url.hostname or "127.0.0.1", url.port or 80, None)
+    else:
+        for server in options.servers.split(","):
+            port = _free_port()
+            with _Server(server, port, options.workers, options.threads) as running:
+                assert running.process is not None
+                run_all(server, "127.0.0.1", port, _MemorySampler(running.process.pid))
+
+    output = Path(options.output) if options.output else RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2, ensure_ascii=False))
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""
+ベンチマーク (benchmarks.load_test) でサーバを立てるときの settings 。
+MySQL を用意しなくても動くよう、 DB は一時ディレクトリの SQLite にしている。
+(ベンチマークするエンドポイントは DB を使わない)
+"""
+import os
+import tempfile
+
+# NOTE: config.settings は import するときにこれらの環境変数を読むので、無ければダミーを入れておく。
+os.environ.setdefault("DJANGO_SECRET_KEY", "benchmark-secret-key")
+for _name in ("MYSQL_DATABASE", "MYSQL_USER", "MYSQL_PASSWORD", "MYSQL_HOSTNAME", "MYSQL_PORT"):
+    os.environ.setdefault(_name, "benchmark")
+
+from config.settings import *  # noqa: E402, F401, F403
+from config.settings import LAB_RUN_ADMISSION, LOGGING  # noqa: E402
+
+DEBUG = False
+ALLOWED_HOSTS = ["127.0.0.1", "localhost"]
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.path.join(tempfile.gettempdir(), "py-lab-benchmark.sqlite3"),
+    }
+}
+
+# NOTE: メッセージごとの INFO ログをファイルに書く時間まで測ってしまわないよう、 WARNING 以上だけにする。
+LOGGING = {
+    **LOGGING,
+    "loggers": {
+        name: {**logger, "level": "WARNING"} if "level" in logger else logger
+        for name, logger in LOGGING["loggers"].items()
+    },
+}
+
+# NOTE: 負荷をかけるクライアントはひとつ (127.0.0.1) なので、クライアントごとのレート制限は外す。
+#       同時実行数の上限と待ち行列はそのまま。溢れた分は errors (503) に数えられる。
+LAB_RUN_ADMISSION = {**LAB_RUN_ADMISSION, "client_rate": None}
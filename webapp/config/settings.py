@@ -14,7 +14,7 @@ import logging
 import os
 from pathlib import Path
 
-from shared.logging_formatters import JSTFormatter
+from shared.logging_formatters import JSTFormatter, JSTJSONFormatter
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -42,6 +42,8 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
+    # manage.py run_lab_broker などのコマンドを見つけてもらうために入れている。
+    'app',
     # NOTE: 本リポジトリでは、本番環境では backend, frontend で共通ドメインを使うことを想定している。
     #       だから django-cors-headers は [dev-packages] に入れています。
     #       本番環境を作るときは本番用の settings を作ってください。
@@ -55,13 +57,18 @@ REST_FRAMEWORK = {
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # NOTE: summary イベントや heartbeat も圧縮するので、 RequestTimingMiddleware より外側に置く。
+    'middlewares.compression_middleware.ResponseCompressionMiddleware',
     'middlewares.request_id_middleware.RequestIDMiddleware',
+    'middlewares.timing_middleware.RequestTimingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # NOTE: view の時間を測るので一番最後 (一番内側) に置く。
+    'middlewares.timing_middleware.ViewTimingMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -88,14 +95,34 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# NOTE: 接続プールつきの mysql バックエンド (shared.db_backends.mysql_pool) 。
+#       リクエストの終わりに接続を閉じる代わりにプールへ返すので、 CONN_MAX_AGE は 0 のままにすること。
+#       プールはワーカーのプロセスごと。 MySQL の max_connections は
+#       ワーカー数 x (pool_size + max_overflow) 本より多くしておく。
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        'ENGINE': 'shared.db_backends.mysql_pool',
         'NAME': os.environ['MYSQL_DATABASE'],
         'USER': os.environ['MYSQL_USER'],
         'PASSWORD': os.environ['MYSQL_PASSWORD'],
         'HOST': os.environ['MYSQL_HOSTNAME'],
         'PORT': os.environ['MYSQL_PORT'],
+        'CONN_MAX_AGE': 0,
+        'OPTIONS': {
+            'pool': {
+                # 使い回す接続の数と、足りないときに追加で開いてよい数 (返されたら閉じる) 。
+                'pool_size': 5,
+                'max_overflow': 10,
+                # 全部使われているとき、空くまで待つ秒数。超えたら OperationalError 。
+                'timeout': 10,
+                # 開いてから recycle 秒たった接続・ max_idle 秒使われなかった接続は開き直す。
+                # NOTE: MySQL の wait_timeout (デフォルト 8 時間) より短くしておく。
+                'recycle': 3600,
+                'max_idle': 600,
+                # 貸し出す前に ping して、切れた接続を渡さない。
+                'pre_ping': True,
+            },
+        },
     }
 }
 
@@ -163,18 +190,37 @@ LOGGING = {
             'datefmt': '%Y-%m-%dT%H:%M:%S+09:00',
             # 'datefmt': '%Y-%m-%dT%H:%M:%SZ',
         },
+        # 1 行 1 JSON のフォーマット。ログを集めるサービスに送るときは、ハンドラの formatter をこれにする。
+        'json': {
+            '()': JSTJSONFormatter,
+            'datefmt': '%Y-%m-%dT%H:%M:%S+09:00',
+        },
+    },
+    # ロガーごとにかけるフィルタ。
+    'filters': {
+        # SSE のフレームごとに出るログを、同じ形のメッセージごとに 1 秒あたり 10 件 (瞬間的には 20 件) までに間引く。
+        # NOTE: % 形式 (logger.info("... %s", value)) のログだけが同じ形として数えられる。
+        'per_frame': {
+            '()': 'shared.logging_filters.RateLimitFilter',
+            'rate': 10,
+            'burst': 20,
+        },
     },
     # 出力先ごとの設定。
+    # NOTE: ロガーがつかうのは queue だけ。 queue がバックグラウンドのスレッドで logging_sink の console, file へ流す。
+    #       SSE のストリームなどが、ログの書き込み (ディスク I/O) を待たされないようにするため。
+    # DOC: shared.logging_handlers
     'handlers': {
         # コンソール出力用のハンドラ。 standard format を StreamHandler で使う。
+        # Batching* はバックグラウンドのスレッドがまとめて書いたあとに 1 回だけ flush する。
         'console': {
-            'class': 'logging.StreamHandler',
+            'class': 'shared.logging_handlers.BatchingStreamHandler',
             'formatter': 'standard',
         },
         # ファイル出力用のハンドラ。 standard format を TimedRotatingFileHandler で使う。
         # 1日ごとにログファイルをローテーション。30日まで保存。
         'file': {
-            'class': 'logging.handlers.TimedRotatingFileHandler',
+            'class': 'shared.logging_handlers.BatchingTimedRotatingFileHandler',
             'filename': os.path.join(BASE_DIR, 'logs', 'application.log'),
             'when': 'midnight',
             'interval': 1,
@@ -183,21 +229,202 @@ LOGGING = {
             # NOTE: システムロケールが en-us だと、マルチバイト文字が出力されないことがあった。
             'encoding': 'utf-8',
         },
+        # レコードをキューに入れるだけのハンドラ。書き出しは logging_sink のハンドラが行う。
+        'queue': {
+            '()': 'shared.logging_handlers.BackgroundQueueHandler',
+            'sink': 'logging_sink',
+            # キューに溜められる件数。溢れたら捨てる (捨てた件数はあとで WARNING で出る) 。
+            'queue_size': 10000,
+        },
     },
     'loggers': {
+        # queue から取り出したレコードを、実際に書き出すロガー。
+        'logging_sink': {
+            'handlers': ['console', 'file'],
+            'propagate': False,
+        },
         # 開発サーバで見るようなログを出力しているロガー。
         # こういうログを出力しているもの↓
         # [05/Oct/2023 00:30:20] "POST /ocr/images/analyze HTTP/1.1" 400 82
         # django.server は、 console handler の class, format で出力する、という設定。
         'django.server': {
-            'handlers': ['console', 'file'],
+            'handlers': ['queue'],
             'level': logging.INFO,
         },
+        # SSE のフレームごとにログを出すロガー。
+        'app.views': {
+            'filters': ['per_frame'],
+        },
+        'services.lab_run_manager': {
+            'filters': ['per_frame'],
+        },
         # ルートロガーの設定。
         # root は、 console handler の class, format で出力する、という設定。
         'root': {
-            'handlers': ['console', 'file'],
+            'handlers': ['queue'],
             'level': logging.INFO,
         },
     },
 }
+
+
+# Lab モジュール (lab/*.py) の同期 main をどこで実行するか。 ModuleSpec.isolation ごとに設定する。
+# DOC: services.lab_module_executors
+LAB_MODULE_EXECUTORS = {
+    # ふつうのモジュール。 web ワーカー内のスレッドプールで実行する。
+    'thread': {
+        'BACKEND': 'services.lab_module_executors.ThreadPoolLabModuleExecutor',
+        'OPTIONS': {
+            # 全モジュールで共有するスレッド数。
+            'max_workers': 16,
+            # クライアントに送りきれていないメッセージをいくつまで溜めるか。これを超えると main 側が待たされる。
+            'queue_high_water_mark': 64,
+            # ひとつのモジュールが同時に使えるスレッド数。
+            'module_concurrency_limit': 4,
+        },
+    },
+    # CPU を食うモジュール (ModuleSpec.isolation="process") 。別プロセスのプールで実行する。
+    'process': {
+        'BACKEND': 'services.lab_module_executors.ProcessPoolLabModuleExecutor',
+        'OPTIONS': {
+            # ワーカープロセス数。 None ならコア数。
+            'pool_size': None,
+            # ModuleSpec で指定が無いときの、 1 回の実行あたりの上限。
+            'cpu_time_limit': 60,
+            'memory_limit_mb': 512,
+        },
+    },
+}
+
+# lab モジュールのレジストリ。
+# DOC: services.lab_module_registry
+LAB_MODULE_REGISTRY = {
+    # lab/*.py の変更を確認する間隔 (秒) 。 None にすると起動後の変更は反映されない。
+    'reload_check_interval': 2.0,
+}
+
+# /api/app/lab/catalog の Cache-Control: max-age (秒) 。
+# NOTE: ETag つきなので、期限が切れても If-None-Match で安く再検証できる。
+LAB_CATALOG_CACHE_MAX_AGE = 60
+
+# POST /api/app/lab の options.coalesce: true のときの、メッセージをまとめる条件のデフォルト。
+# 最初のメッセージから max_latency_ms たつか、 max_batch_size 件たまったら 1 フレームで送る。
+LAB_SSE_COALESCE = {
+    'max_latency_ms': 50,
+    'max_batch_size': 100,
+}
+
+# SSE のストリーム (SSEView, LabView, LabRunView) の heartbeat と上限 (秒) 。 None なら無し・無制限。
+# DOC: app.views._keepalive_stream
+SSE_KEEPALIVE = {
+    # 何も送るものが無い間、この間隔でコメント行 (": ping") を送る。
+    # NOTE: nginx の proxy_read_timeout (デフォルト 60 秒) より短くしておく。
+    'heartbeat_interval': 15,
+    # heartbeat 以外に何も送らないまま、この秒数たったらストリームを閉じる。
+    'max_idle': 300,
+    # ひとつのストリームをつないでおける最大の秒数。
+    'max_lifetime': 3600,
+}
+
+# SSE (text/event-stream) と JSON のレスポンスの圧縮。 Accept-Encoding で gzip / brotli を選ぶ。
+# DOC: middlewares.compression_middleware
+RESPONSE_COMPRESSION = {
+    # 使う Content-Encoding 。 Accept-Encoding の q 値が同じなら前にあるものを選ぶ。
+    'encodings': ('br', 'gzip'),
+    # JSON はこのバイト数以上なら圧縮する。 SSE は常に圧縮する (フレームごとに flush する) 。
+    'min_length': 512,
+    'gzip_level': 6,
+    # NOTE: フレームごとに圧縮するので、 CPU を食う高い quality にはしない。
+    'brotli_quality': 4,
+}
+
+# POST /api/app/lab で始めた run の管理。
+# DOC: services.lab_run_manager
+LAB_RUNS = {
+    # 再接続 (Last-Event-ID) 用に run ごとに残しておくフレームの上限。どれかを超えると古いものから捨てる。
+    'replay_buffer_max_frames': 1000,
+    'replay_buffer_max_bytes': 1024 * 1024,
+    'replay_buffer_ttl': 300,
+    # 終わった run を再接続用に残しておく秒数。
+    'finished_run_ttl': 300,
+    # 購読者 (SSE クライアント) ごとに、送りきれていないフレームをいくつまで溜めるか。
+    'subscriber_queue_size': 64,
+    # 溜まりきったときの扱い。
+    # 'block' (run を待たせる) / 'drop_oldest' (古いフレームを捨てる) / 'disconnect' (切断する) 。
+    # NOTE: ひとつの run を大勢で見るので、ひとりの遅いクライアントに全員が引きずられないよう 'disconnect' にしている。
+    #       切断されたクライアントは Last-Event-ID で再接続すれば、リプレイバッファから追いつける。
+    'slow_subscriber_policy': 'disconnect',
+    # gunicorn などで複数ワーカーを立てるときは、ブローカー (python manage.py run_lab_broker) のソケットを指定する。
+    # ほかのワーカーで始まった run も購読できるようになる。 None ならワーカーの中だけで完結する。
+    'broker_socket_path': os.environ.get('LAB_RUN_BROKER_SOCKET') or None,
+    # 実行中の run を止める (モジュールのジェネレータをキャンセルして、スレッド・プロセスを空ける) 条件 (秒) 。
+    # None なら止めない。 reaper_interval 秒ごとに確認する。
+    # - orphan_run_timeout: 購読者がひとりもいないまま、この秒数たった。
+    #   NOTE: Last-Event-ID で再接続してくる分の猶予。ブローカーに流している run はほかのワーカーの購読者が
+    #         見えないので対象外。
+    #         猶予があるのは resumable な run (POST /api/app/lab/runs 、 options.resumable 、再接続された run) だけ。
+    #         それ以外の run は、最後の購読者がいなくなってから abandoned_run_grace_period 秒で止める。
+    # - max_run_idle: モジュールがこの秒数、何もメッセージを出さない。
+    # - max_run_lifetime: run を始めてからこの秒数たった。
+    'orphan_run_timeout': 30,
+    'max_run_idle': 600,
+    'max_run_lifetime': 3600,
+    'reaper_interval': 5,
+    # resumable でない run を、最後の購読者がいなくなってから止めるまでの秒数。
+    # ネットワークが一瞬切れただけのクライアントが、 Last-Event-ID で再接続して続きを受け取れる分。
+    'abandoned_run_grace_period': 5,
+}
+
+# run とフレームを DB (app.models.LabRun, LabRunEvent) に残す。 GET /api/app/lab/history で引ける。
+# DOC: services.lab_run_recorder
+LAB_RUN_HISTORY = {
+    # False なら残さない。
+    'enabled': True,
+    # バックグラウンドのスレッドが、 batch_size 件たまるか flush_interval 秒たつごとにまとめて bulk_create する。
+    'batch_size': 200,
+    'flush_interval': 1.0,
+    # 書き込み待ちの上限。溢れた分は捨てる (ストリームは待たせない) 。
+    'queue_size': 10000,
+}
+
+# POST /api/app/lab, POST /api/app/lab/runs で run を始める前のアドミッションコントロール。
+# DOC: services.lab_run_admission
+# NOTE: 上限はワーカーのプロセスごと。
+LAB_RUN_ADMISSION = {
+    # クライアント (ユーザーか IP アドレス) ごとに、 1 秒あたり client_rate 回 (瞬間的には client_burst 回) まで。
+    # 超えたら 429 。 None ならかけない。
+    'client_rate': 1.0,
+    'client_burst': 10,
+    # モジュールごとの同じ制限。 None ならかけない。
+    'module_rate': None,
+    'module_burst': 20,
+    # 同時に実行できる run の数。超えた分は max_queued_runs 件まで、 queue_timeout 秒まで空きを待つ。
+    # 待ち行列もいっぱいなら、 Retry-After: retry_after をつけて 503 。
+    'max_concurrent_runs': 32,
+    'max_queued_runs': 64,
+    'queue_timeout': 30,
+    'retry_after': 5,
+}
+
+# POST /api/app/lab の options.profile: true で実行したプロファイルの保存先。
+# DOC: services.lab_profile_store
+LAB_PROFILES = {
+    'directory': os.environ.get('LAB_PROFILE_DIR') or os.path.join(BASE_DIR, 'logs', 'lab_profiles'),
+    # 残しておくプロファイルの数。超えたら古いものから消す。
+    'max_profiles': 50,
+    # スタックをサンプリングする間隔 (ミリ秒) 。
+    'sampling_interval_ms': 5,
+}
+# staff ユーザー以外でプロファイルを使うときに X-Lab-Profile-Token ヘッダで送るトークン。 None なら staff だけ。
+LAB_PROFILE_TOKEN = os.environ.get('LAB_PROFILE_TOKEN') or None
+
+# ModuleSpec.cacheable なモジュールの結果のキャッシュ。
+# DOC: services.lab_result_cache
+LAB_RESULT_CACHE = {
+    # キャッシュしておく結果の件数。超えたら最近使われていないものから捨てる。
+    'max_entries': 256,
+    # キャッシュしておくメッセージの合計サイズ (文字数) 。
+    'max_bytes': 16 * 1024 * 1024,
+    # ModuleSpec.cache_ttl が無いときの、結果を使い回す秒数。
+    'ttl': 600,
+}
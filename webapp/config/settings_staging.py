@@ -8,17 +8,23 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
+    # manage.py run_lab_broker などのコマンドを見つけてもらうために入れている。
+    'app',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'middlewares.compression_middleware.ResponseCompressionMiddleware',
     'middlewares.request_id_middleware.RequestIDMiddleware',
+    'middlewares.timing_middleware.RequestTimingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # NOTE: view の時間を測るので一番最後 (一番内側) に置く。
+    'middlewares.timing_middleware.ViewTimingMiddleware',
 ]
 
 DEBUG = True
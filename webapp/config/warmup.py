@@ -0,0 +1,99 @@
+"""
+gunicorn の master で、ワーカーを fork する前に一度だけ行うウォームアップ (gunicorn.conf.py の when_ready から呼ぶ) 。
+ワーカーが最初のリクエストで払っていたコスト (lab モジュールの import 、 URL の解決表づくり、
+DRF の設定の import など) を先に済ませておく。 fork したワーカーはそのページを copy-on-write で共有するので、
+新しいワーカーは import し直さずに、すぐ最初のリクエストに応えられる。
+NOTE: スレッド・プロセス・ DB 接続を fork の前に作ってはいけない (全ワーカーで共有されて壊れる) 。
+      ここでは import とメモリ上のキャッシュづくりだけをして、最後に DB 接続を閉じる。
+"""
+import logging
+import time
+from typing import Callable
+
+from django.db import connections
+from django.urls import get_resolver
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
+
+from services.lab_module_registry import get_lab_module_registry
+from services.lab_module_spec_service import LabModuleSpecService
+
+logger = logging.getLogger(__name__)
+
+# 最初のリクエストまで import されない DRF の設定 (import 文字列で書かれているもの) 。
+_DRF_SETTINGS = (
+    "DEFAULT_RENDERER_CLASSES",
+    "DEFAULT_PARSER_CLASSES",
+    "DEFAULT_AUTHENTICATION_CLASSES",
+    "DEFAULT_PERMISSION_CLASSES",
+    "DEFAULT_THROTTLE_CLASSES",
+    "DEFAULT_CONTENT_NEGOTIATION_CLASS",
+    "DEFAULT_VERSIONING_CLASS",
+    "UNAUTHENTICATED_USER",
+    "EXCEPTION_HANDLER",
+)
+
+
+def warmup() -> list[tuple[str, float]]:
+    """
+    ウォームアップをして、段階ごとにかかった時間 (段階の名前, 秒) のリストを返す。
+    """
+    steps: list[tuple[str, Callable[[], None]]] = [
+        ("lab modules", _warmup_lab_modules),
+        ("url resolver", _warmup_url_resolver),
+        ("drf views", _warmup_drf_views),
+    ]
+    timings = []
+    for name, step in steps:
+        started_at = time.perf_counter()
+        step()
+        timings.append((name, time.perf_counter() - started_at))
+    connections.close_all()
+    return timings
+
+
+def _warmup_lab_modules() -> None:
+    """
+    lab パッケージを走査して、全モジュールの import と get_spec 、 args のバリデータのコンパイルを済ませる。
+    """
+    get_lab_module_registry().scan()
+    # NOTE: カタログの ETag 用に、モジュールのファイルのハッシュも計算しておく。
+    LabModuleSpecService().get_catalog_etag()
+
+
+def _warmup_url_resolver() -> None:
+    """
+    URLconf (と、そこから import される view) を読み込んで、 URL の解決表を作っておく。
+    """
+    resolver = get_resolver()
+    # NOTE: どちらも、読むだけで import ・解決表づくりが走るプロパティ。
+    resolver.url_patterns
+    resolver.reverse_dict
+
+
+def _warmup_drf_views() -> None:
+    """
+    DRF の設定の import 文字列を解決して、 APIView ごとにレンダラー・パーサーなどを一度作っておく。
+    """
+    for name in _DRF_SETTINGS:
+        getattr(api_settings, name)
+    for view_class in _api_view_classes(get_resolver().url_patterns):
+        view = view_class()
+        view.get_renderers()
+        view.get_parsers()
+        view.get_authenticators()
+        view.get_permissions()
+        view.get_content_negotiator()
+
+
+def _api_view_classes(patterns: list) -> set[type[APIView]]:
+    view_classes: set[type[APIView]] = set()
+    for pattern in patterns:
+        if hasattr(pattern, "url_patterns"):
+            view_classes |= _api_view_classes(pattern.url_patterns)
+            continue
+        # NOTE: @api_view の関数ベースの view も、 cls に APIView のサブクラスを持っている。
+        view_class = getattr(pattern.callback, "cls", None) or getattr(pattern.callback, "view_class", None)
+        if isinstance(view_class, type) and issubclass(view_class, APIView):
+            view_classes.add(view_class)
+    return view_classes
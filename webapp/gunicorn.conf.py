@@ -0,0 +1,45 @@
+"""
+gunicorn の設定。 webapp ディレクトリで gunicorn を起動すると自動で読み込まれる。
+DOC: https://docs.gunicorn.org/en/stable/settings.html
+
+- preload_app: アプリ (Django) を master で読み込んでから、ワーカーを fork する。
+- when_ready: fork の前に、 master でウォームアップ (config.warmup) をする。
+  lab モジュールの import などを済ませたページを、ワーカーが copy-on-write で共有する。
+  オートスケールで増えたワーカーも、 import し直さずにすぐ最初のリクエストに応えられる。
+- 起動にかかった時間 (import したモジュールごとの時間と、ウォームアップの段階ごとの時間) をログに出す。
+NOTE: コードを変更したら、ワーカーの再起動 (HUP) ではなく master ごと再起動すること。
+      preload しているので、 HUP では新しいコードが読み込まれない。
+"""
+import gc
+import logging
+import os
+import sys
+import time
+
+# NOTE: gunicorn の起動のしかたによっては、この時点で webapp ディレクトリが sys.path に無い。
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from shared.import_timer import ImportTimer  # noqa: E402
+
+preload_app = True
+
+# NOTE: この設定ファイルはアプリを読み込む前に実行されるので、ここから測ればアプリの import がすべて入る。
+_started_at = time.perf_counter()
+_import_timer = ImportTimer()
+_import_timer.start()
+
+
+def when_ready(server) -> None:
+    from config.warmup import warmup
+
+    timings = warmup()
+    _import_timer.stop()
+
+    logger = logging.getLogger("config.warmup")
+    logger.info(f"Startup import report:\n{_import_timer.report()}")
+    steps = ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in timings)
+    logger.info(f"Warmup finished in {(time.perf_counter() - _started_at) * 1000:.1f} ms since boot ({steps})")
+
+    # NOTE: ここまでに作ったオブジェクトを GC の対象から外す。 GC がオブジェクトの参照カウントや
+    #       ヘッダに書き込まないので、ワーカーとの copy-on-write の共有が崩れない。
+    gc.freeze()
@@ -0,0 +1,40 @@
+from typing import AsyncGenerator
+
+from .module_specs import ModuleSpec
+from .run_context import RunContext
+
+
+def get_spec() -> ModuleSpec:
+    """
+    モジュールの仕様を取得する関数。
+    """
+    return ModuleSpec(
+        module="bar",
+        description="Bar module for demonstration of async main",
+        args={
+            "count": {
+                "description": "メッセージを何回返すか。 1 から 100 まで。デフォルトは 3。",
+                "type": "integer",
+                "default": 3,
+                "min": 1,
+                "max": 100,
+            },
+        },
+    )
+
+
+async def main(ctx: RunContext, **args) -> AsyncGenerator[str, None]:
+    """
+    Main function - async generator version
+    NOTE: async def main にしておくと、待機中はスレッドを握らずにイベントループ上で待てる。
+          time.sleep ではなく await ctx.asleep (あるいは asyncio.sleep) を使うこと。
+    """
+    count = int(args.get("count", 3))
+
+    yield "bar module を開始するよー! async 版だよ。"
+
+    for i in range(1, count + 1):
+        await ctx.asleep(1)
+        yield f"{i} / {count} 回目のメッセージ。"
+
+    yield "bar module をご利用いただきありがとうございましたー。"
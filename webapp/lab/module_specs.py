@@ -1,8 +1,28 @@
 from dataclasses import dataclass, field
+from typing import Any
 
 
 @dataclass
 class ModuleSpec:
     module: str
     description: str
-    args: dict[str, str] = field(default_factory=dict)
+    # 引数名 → {"description": ..., "type": "integer", "required": True, "default": ..., "min": ..., "max": ..., ...} 。
+    # 書けるキーは services.lab_module_args_validator.LabModuleArgsValidator を参照。
+    # 宣言されていない引数を送ると、実行する前に 400 になる。
+    args: dict[str, dict[str, Any]] = field(default_factory=dict)
+    # どこで main を実行するか。
+    # "thread": web ワーカー内のスレッドプール (デフォルト) 。
+    # "process": 別プロセスのプール。 CPU を食うモジュール向け。
+    isolation: str = "thread"
+    # isolation="process" のときだけ有効。 1 回の実行で使える CPU 時間 (秒) と追加メモリ (MB) 。
+    # None なら settings.LAB_MODULE_EXECUTORS のデフォルト。
+    cpu_time_limit: float | None = None
+    memory_limit_mb: int | None = None
+    # 同じ args なら必ず同じメッセージを返す (決定的な) モジュールなら True 。
+    # 結果をキャッシュして、同じ args の実行はキャッシュから即座に返す (services.lab_result_cache) 。
+    cacheable: bool = False
+    # 結果を使い回す秒数。 None なら settings.LAB_RESULT_CACHE のデフォルト。
+    cache_ttl: float | None = None
+    # 1 回の実行の制限時間 (秒) 。 main が ctx を受け取るなら ctx.deadline になる (lab.run_context) 。
+    # None なら settings.LAB_RUNS の max_run_lifetime まで。
+    timeout: float | None = None
@@ -0,0 +1,50 @@
+from typing import Generator
+
+from .module_specs import ModuleSpec
+from .run_context import RunContext
+
+
+def get_spec() -> ModuleSpec:
+    """
+    モジュールの仕様を取得する関数。
+    """
+    return ModuleSpec(
+        module="primes",
+        description="CPU-heavy module for demonstration of process isolation",
+        args={
+            "limit": {
+                "description": "この数までの素数を数える。 2 から 50000000 まで。デフォルトは 2000000。",
+                "type": "integer",
+                "default": 2_000_000,
+                "min": 2,
+                "max": 50_000_000,
+            },
+        },
+        # NOTE: 純 Python の重い計算は GIL を握りっぱなしになるので、別プロセスで実行してもらう。
+        isolation="process",
+        cpu_time_limit=30,
+        memory_limit_mb=256,
+        # 同じ limit なら結果は必ず同じなので、キャッシュして使い回す。
+        cacheable=True,
+    )
+
+
+def main(ctx: RunContext, **args) -> Generator[str, None, None]:
+    """
+    Main function - generator version
+    NOTE: yield の間が長いので、ときどき ctx.checkpoint() で deadline を確認する。
+    """
+    limit = int(args.get("limit", 2_000_000))
+
+    yield f"{limit} までの素数を数えるよー!"
+
+    count = 0
+    for n in range(2, limit + 1):
+        if all(n % d for d in range(2, int(n**0.5) + 1)):
+            count += 1
+        if n % 10000 == 0:
+            ctx.checkpoint()
+        if n % (limit // 10 or 1) == 0:
+            yield f"{n} まで調べた。今のところ {count} 個。"
+
+    yield f"{limit} までの素数は {count} 個でした!"
@@ -0,0 +1,124 @@
+"""
+lab モジュールの main に渡す、実行ごとのコンテキスト。
+main が ctx という名前の引数を受け取るように書いておくと、実行するときに RunContext が渡される。
+- deadline: この時刻 (time.monotonic) までに終わってほしい。 ModuleSpec.timeout や run の上限から決まる。
+- キャンセル: クライアントがいなくなったり、 reaper に止められたりすると cancelled になる。
+
+time.sleep の代わりに ctx.sleep (async な main なら await ctx.asleep) を使い、重いループの中で ctx.checkpoint()
+を呼んでおくと、キャンセルや deadline にすぐ気づいて LabRunCancelled で抜けられる。
+スレッドやプロセスが、誰も見ていない run のために握られ続けなくなる。
+
+使用例 (lab.foo を参照):
+def main(ctx: RunContext, **args):
+    yield "start"
+    ctx.sleep(3)
+    yield "done"
+
+NOTE: ワーカープロセス (services.lab_process_pool) でも使うので、 Django に依存させないこと。
+test: services.tests.test_lab_module_executors
+"""
+import asyncio
+import inspect
+import threading
+import time
+from typing import Any, Callable
+
+
+class LabRunCancelled(Exception):
+    """
+    RunContext がキャンセルされた。 main はこれを握りつぶさずに抜けること。
+    """
+
+
+class LabRunDeadlineExceeded(LabRunCancelled):
+    """
+    RunContext の deadline を過ぎた。
+    """
+
+
+class RunContext:
+    """
+    deadline とキャンセルのトークンを持つ、実行ごとのコンテキスト。
+    cancel はどのスレッドから呼んでもよい。
+    """
+
+    def __init__(self, timeout: float | None = None) -> None:
+        """
+        Args:
+            timeout (float | None): 今から何秒以内に終わってほしいか。 None なら deadline 無し。
+        """
+        self.deadline = None if timeout is None else time.monotonic() + timeout
+        self.cancel_reason: str | None = None
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def remaining(self) -> float | None:
+        """
+        deadline までの残り秒数 (過ぎていれば 0) 。 deadline が無いなら None 。
+        """
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        """
+        キャンセルする。 sleep で待っている main もすぐに起きて LabRunCancelled になる。
+        """
+        if self.cancel_reason is None:
+            self.cancel_reason = reason
+        self._cancelled.set()
+
+    def checkpoint(self) -> None:
+        """
+        キャンセルされているか deadline を過ぎていれば例外を投げる。重いループの中でときどき呼ぶ。
+
+        Raises:
+            LabRunCancelled: キャンセルされている場合
+            LabRunDeadlineExceeded: deadline を過ぎている場合
+        """
+        if self.cancelled:
+            raise LabRunCancelled(f"Run cancelled: {self.cancel_reason}")
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise LabRunDeadlineExceeded("Run exceeded its deadline")
+
+    def sleep(self, seconds: float) -> None:
+        """
+        キャンセルされたらすぐに起きる time.sleep 。 deadline を越えて眠ることもしない。
+
+        Raises:
+            LabRunCancelled: キャンセルされた場合
+            LabRunDeadlineExceeded: 眠っている間に deadline を過ぎる場合
+        """
+        self.checkpoint()
+        remaining = self.remaining()
+        self._cancelled.wait(seconds if remaining is None else min(seconds, remaining))
+        self.checkpoint()
+
+    async def asleep(self, seconds: float) -> None:
+        """
+        async な main 向けの sleep 。
+        NOTE: async な main はイベントループ上で回るので、キャンセルは asyncio.CancelledError でも届く。
+              ここでは deadline を越えて眠らないことと、 cancel を見ることだけをする。
+
+        Raises:
+            LabRunCancelled: キャンセルされた場合
+            LabRunDeadlineExceeded: 眠っている間に deadline を過ぎる場合
+        """
+        self.checkpoint()
+        remaining = self.remaining()
+        await asyncio.sleep(seconds if remaining is None else min(seconds, remaining))
+        self.checkpoint()
+
+
+def accepts_run_context(main_func: Callable[..., Any]) -> bool:
+    """
+    main が ctx 引数 (RunContext) を受け取るか。
+    NOTE: ctx を宣言していない (**args だけの) main には渡さない。 args に混ざってしまうので。
+    """
+    try:
+        return "ctx" in inspect.signature(main_func).parameters
+    except (TypeError, ValueError):
+        return False
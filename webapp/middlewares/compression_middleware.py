@@ -0,0 +1,128 @@
+"""
+Accept-Encoding に応じて、 SSE と JSON のレスポンスを gzip / brotli で圧縮する middleware 。
+- SSE (text/event-stream) などのストリーム (shared.stream_formatters) : ストリームごとにひとつのコンプレッサーで、
+  フレーム (チャンク) ごとに sync flush して送る (shared.stream_compression) 。
+  繰り返し出てくるキーが圧縮の辞書に載るので、フレームが進むほど小さくなり、かつフレームを溜めずにすぐ届く。
+- JSON のレスポンス: min_length バイト以上なら、まとめて圧縮する。
+MIDDLEWARE の前のほう (RequestTimingMiddleware より外側) に置く。 summary イベントや heartbeat も圧縮される。
+settings.RESPONSE_COMPRESSION で設定する。
+NOTE: django.middleware.gzip.GZipMiddleware と同じく、強い ETag は弱い ETag (W/"...") にする。
+"""
+from typing import AsyncIterator, Callable, Iterator
+
+from django.conf import settings
+from django.http import HttpRequest, HttpResponseBase, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+
+from shared.metrics import registry
+from shared.stream_compression import (
+    AVAILABLE_ENCODINGS,
+    BrotliStreamCompressor,
+    GzipStreamCompressor,
+    compress,
+    create_stream_compressor,
+    negotiate_encoding,
+)
+from shared.stream_formatters import get_stream_formatter
+
+COMPRESSION_BYTES = registry.counter(
+    "http_compression_bytes_total", "Response bytes before (in) and after (out) compression.", ("encoding", "stage")
+)
+
+
+class ResponseCompressionMiddleware:
+    """
+    SSE のストリームと JSON のレスポンスを圧縮する middleware 。
+    """
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponseBase]):
+        self.get_response = get_response
+        config = getattr(settings, "RESPONSE_COMPRESSION", {})
+        self.encodings = tuple(
+            encoding for encoding in config.get("encodings", AVAILABLE_ENCODINGS) if encoding in AVAILABLE_ENCODINGS
+        )
+        self.min_length = config.get("min_length", 512)
+        self.gzip_level = config.get("gzip_level", 6)
+        self.brotli_quality = config.get("brotli_quality", 4)
+
+    def __call__(self, request: HttpRequest) -> HttpResponseBase:
+        response = self.get_response(request)
+        content_type = response.get("Content-Type", "")
+        if isinstance(response, StreamingHttpResponse):
+            if get_stream_formatter(content_type) is None:
+                return response
+        elif not content_type.startswith("application/json") or len(response.content) < self.min_length:
+            return response
+        # NOTE: Accept-Encoding によって中身が変わるので、圧縮しなかった場合もキャッシュには Vary で知らせる。
+        patch_vary_headers(response, ("Accept-Encoding",))
+        if response.has_header("Content-Encoding"):
+            return response
+        encoding = negotiate_encoding(request.headers.get("Accept-Encoding", ""), self.encodings)
+        if encoding is None:
+            return response
+
+        if isinstance(response, StreamingHttpResponse):
+            compressor = create_stream_compressor(encoding, self.gzip_level, self.brotli_quality)
+            # NOTE: 中身を差し替えても、 is_async (ASGI で async イテレータ) かどうかは元のまま引き継がれる。
+            if response.is_async:
+                response.streaming_content = _acompress_stream(response.streaming_content, compressor, encoding)
+            else:
+                response.streaming_content = _compress_stream(response.streaming_content, compressor, encoding)
+            del response["Content-Length"]
+        else:
+            compressed = compress(response.content, encoding, self.gzip_level, self.brotli_quality)
+            if len(compressed) >= len(response.content):
+                return response
+            COMPRESSION_BYTES.inc(len(response.content), encoding=encoding, stage="in")
+            COMPRESSION_BYTES.inc(len(compressed), encoding=encoding, stage="out")
+            response.content = compressed
+            response["Content-Length"] = str(len(compressed))
+
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
+        response["Content-Encoding"] = encoding
+        return response
+
+
+def _compress_stream(
+    stream: Iterator[bytes], compressor: GzipStreamCompressor | BrotliStreamCompressor, encoding: str
+) -> Iterator[bytes]:
+    total_in = total_out = 0
+    try:
+        for chunk in stream:
+            if not chunk:
+                continue
+            compressed = compressor.compress(chunk)
+            total_in += len(chunk)
+            total_out += len(compressed)
+            yield compressed
+        compressed = compressor.finish()
+        total_out += len(compressed)
+        yield compressed
+    finally:
+        _count(encoding, total_in, total_out)
+
+
+async def _acompress_stream(
+    stream: AsyncIterator[bytes], compressor: GzipStreamCompressor | BrotliStreamCompressor, encoding: str
+) -> AsyncIterator[bytes]:
+    total_in = total_out = 0
+    try:
+        async for chunk in stream:
+            if not chunk:
+                continue
+            compressed = compressor.compress(chunk)
+            total_in += len(chunk)
+            total_out += len(compressed)
+            yield compressed
+        compressed = compressor.finish()
+        total_out += len(compressed)
+        yield compressed
+    finally:
+        _count(encoding, total_in, total_out)
+
+
+def _count(encoding: str, total_in: int, total_out: int) -> None:
+    COMPRESSION_BYTES.inc(total_in, encoding=encoding, stage="in")
+    COMPRESSION_BYTES.inc(total_out, encoding=encoding, stage="out")
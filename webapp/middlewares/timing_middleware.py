@@ -0,0 +1,211 @@
+"""
+リクエストごとにどこで時間を使っているかを測る middleware 。
+- RequestTimingMiddleware: RequestIDMiddleware のすぐ後ろに置く。リクエスト全体を測る。
+- ViewTimingMiddleware: MIDDLEWARE の一番最後 (一番内側) に置く。 view の時間を測る。
+  middleware の時間は、全体から view の時間を引いたもの。
+
+通常のレスポンスには Server-Timing ヘッダをつける (ブラウザの開発者ツールの Timing タブで見られる) 。
+SSE のレスポンスには、最初の 1 バイトまでの時間・ストリームの長さ・フレーム数・バイト数も測って、
+ストリームの最後に summary イベント (SSEFormatter.format_summary) を送る。
+NDJSON や MessagePack のストリーム (shared.stream_formatters) も同じく、その形式で summary を送る。
+どちらも shared.metrics のヒストグラムに集計して、 GET /api/app/metrics で Prometheus 形式で取れる。
+"""
+import logging
+import time
+from typing import Any, AsyncIterator, Callable, Iterator
+
+from django.http import HttpRequest, HttpResponseBase, StreamingHttpResponse
+
+from shared.metrics import registry
+from shared.stream_formatters import StreamFormatter, get_stream_formatter
+
+logger = logging.getLogger(__name__)
+
+_LABELS = ("method", "route")
+
+REQUEST_DURATION = registry.histogram(
+    "http_request_duration_seconds", "Time spent in Django until the response object is returned.", _LABELS
+)
+MIDDLEWARE_DURATION = registry.histogram(
+    "http_middleware_duration_seconds", "Time spent in middleware (request duration minus view duration).", _LABELS
+)
+VIEW_DURATION = registry.histogram("http_view_duration_seconds", "Time spent in the view.", _LABELS)
+STREAM_TIME_TO_FIRST_BYTE = registry.histogram(
+    "sse_time_to_first_byte_seconds", "Time from the start of the request to the first SSE byte.", _LABELS
+)
+STREAM_DURATION = registry.histogram(
+    "sse_stream_duration_seconds", "Time from the start of the request to the end of the SSE stream.", _LABELS
+)
+STREAM_FRAMES = registry.counter("sse_frames_sent_total", "SSE frames sent.", _LABELS)
+STREAM_BYTES = registry.counter("sse_bytes_sent_total", "SSE bytes sent.", _LABELS)
+
+
+class RequestTiming:
+    """
+    リクエストひとつ分の計測結果。 request.timing でどこからでも触れる。
+    """
+
+    def __init__(self, request_id: str) -> None:
+        self.request_id = request_id
+        self.started_at = time.perf_counter()
+        self.view_seconds = 0.0
+        self.response_seconds = 0.0
+        self._annotations: dict[str, Any] = {}
+
+    @property
+    def middleware_seconds(self) -> float:
+        return max(0.0, self.response_seconds - self.view_seconds)
+
+    def annotate(self, key: str, value: Any) -> None:
+        """
+        SSE の summary イベントに入れる値を追加する。 callable ならストリームが終わったときに呼んで値にする。
+        """
+        self._annotations[key] = value
+
+    def annotations(self) -> dict[str, Any]:
+        return {key: value() if callable(value) else value for key, value in self._annotations.items()}
+
+
+def _route(request: HttpRequest) -> str:
+    # NOTE: パスそのものだとラベルの種類が際限なく増えるので、 URL パターンを使う。
+    resolver_match = getattr(request, "resolver_match", None)
+    return resolver_match.route if resolver_match is not None else "unmatched"
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 3)
+
+
+class RequestTimingMiddleware:
+    """
+    リクエスト全体を測って、 Server-Timing ヘッダをつける middleware 。
+    SSE のレスポンスはストリームを包んで、最後に summary イベントを足す。
+    """
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponseBase]):
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponseBase:
+        timing = RequestTiming(getattr(request, "request_id", "unknown"))
+        request.timing = timing  # type: ignore[attr-defined]
+
+        response = self.get_response(request)
+
+        timing.response_seconds = time.perf_counter() - timing.started_at
+        labels = {"method": request.method or "", "route": _route(request)}
+        REQUEST_DURATION.observe(timing.response_seconds, **labels)
+        MIDDLEWARE_DURATION.observe(timing.middleware_seconds, **labels)
+        VIEW_DURATION.observe(timing.view_seconds, **labels)
+
+        response["Server-Timing"] = (
+            f"mw;dur={_ms(timing.middleware_seconds)}, view;dur={_ms(timing.view_seconds)}, "
+            f"total;dur={_ms(timing.response_seconds)}"
+        )
+        formatter = get_stream_formatter(response.get("Content-Type", ""))
+        if isinstance(response, StreamingHttpResponse) and formatter is not None:
+            # NOTE: 中身を差し替えても、 is_async (ASGI で async イテレータ) かどうかは元のまま引き継がれる。
+            if response.is_async:
+                response.streaming_content = self._ameasure_stream(
+                    response.streaming_content, timing, labels, formatter
+                )
+            else:
+                response.streaming_content = self._measure_stream(
+                    response.streaming_content, timing, labels, formatter
+                )
+        return response
+
+    @classmethod
+    def _measure_stream(
+        cls, stream: Iterator[bytes], timing: RequestTiming, labels: dict[str, str], formatter: StreamFormatter
+    ) -> Iterator[bytes]:
+        stats = _StreamStats(formatter)
+        try:
+            for chunk in stream:
+                stats.add(chunk, timing)
+                yield chunk
+            yield cls._finish(stats, timing, labels, completed=True)
+        finally:
+            if not stats.finished:
+                # クライアントが途中で切断した。
+                cls._finish(stats, timing, labels, completed=False)
+
+    @classmethod
+    async def _ameasure_stream(
+        cls,
+        stream: AsyncIterator[bytes],
+        timing: RequestTiming,
+        labels: dict[str, str],
+        formatter: StreamFormatter,
+    ) -> AsyncIterator[bytes]:
+        stats = _StreamStats(formatter)
+        try:
+            async for chunk in stream:
+                stats.add(chunk, timing)
+                yield chunk
+            yield cls._finish(stats, timing, labels, completed=True)
+        finally:
+            if not stats.finished:
+                cls._finish(stats, timing, labels, completed=False)
+
+    @staticmethod
+    def _finish(stats: "_StreamStats", timing: RequestTiming, labels: dict[str, str], completed: bool) -> bytes:
+        """
+        ストリームの計測結果を集計して、 summary イベントを返す。
+        """
+        stats.finished = True
+        stream_seconds = time.perf_counter() - timing.started_at
+        if stats.first_byte_seconds is not None:
+            STREAM_TIME_TO_FIRST_BYTE.observe(stats.first_byte_seconds, **labels)
+        STREAM_DURATION.observe(stream_seconds, **labels)
+        STREAM_FRAMES.inc(stats.frames, **labels)
+        STREAM_BYTES.inc(stats.bytes, **labels)
+        if not completed:
+            logger.info(f"SSE stream closed by client: {timing.request_id} ({stats.frames} frames)")
+            return b""
+
+        summary = {
+            "middlewareMs": _ms(timing.middleware_seconds),
+            "viewMs": _ms(timing.view_seconds),
+            "timeToFirstByteMs": _ms(stats.first_byte_seconds) if stats.first_byte_seconds is not None else None,
+            "streamMs": _ms(stream_seconds),
+            "frames": stats.frames,
+            "bytes": stats.bytes,
+            **timing.annotations(),
+        }
+        return stats.formatter.format_summary(timing.request_id, **summary)
+
+
+class _StreamStats:
+    def __init__(self, formatter: StreamFormatter) -> None:
+        self.formatter = formatter
+        self.first_byte_seconds: float | None = None
+        self.frames = 0
+        self.bytes = 0
+        self.finished = False
+
+    def add(self, chunk: bytes, timing: RequestTiming) -> None:
+        if self.first_byte_seconds is None:
+            self.first_byte_seconds = time.perf_counter() - timing.started_at
+        # NOTE: heartbeat などのコメント (SSE なら ": ...") はフレームとして数えない。バイト数には入れる。
+        if not self.formatter.is_comment(chunk):
+            self.frames += 1
+        self.bytes += len(chunk)
+
+
+class ViewTimingMiddleware:
+    """
+    view の時間を測る middleware 。 MIDDLEWARE の一番最後に置くこと。
+    一番内側の middleware の get_response は、 URL の解決 + view の呼び出しそのもの。
+    """
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponseBase]):
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponseBase:
+        started_at = time.perf_counter()
+        try:
+            return self.get_response(request)
+        finally:
+            timing = getattr(request, "timing", None)
+            if timing is not None:
+                timing.view_seconds = time.perf_counter() - started_at
@@ -0,0 +1,167 @@
+"""
+ModuleSpec.args の型の宣言から、 main に渡す args を検証・型変換するバリデータ。
+ストリームを開く前に弾くので、間違った引数でモジュールが何秒も走ってから失敗する、ということが無くなる。
+test: services.tests.test_lab_module_args_validator
+"""
+import re
+from typing import Any, Callable
+
+# ModuleSpec.args[name]["type"] に書ける型。
+ARG_TYPES = ("string", "integer", "number", "boolean")
+
+_TRUE_STRINGS = {"true", "1", "yes", "on"}
+_FALSE_STRINGS = {"false", "0", "no", "off"}
+
+
+class LabModuleArgsError(Exception):
+    """
+    args が ModuleSpec の宣言に合わないときの例外。 errors は {引数名: [エラーメッセージ, ...]} 。
+    """
+
+    def __init__(self, errors: dict[str, list[str]]) -> None:
+        super().__init__(f"Invalid lab module args: {errors}")
+        self.errors = errors
+
+
+def _to_string(value: Any) -> str:
+    if isinstance(value, str):
+        return value
+    # NOTE: "arg1": 12345 のように数字で送ってくるクライアントもいるので、数値は文字列にしてあげる。
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    raise ValueError("This field must be a string.")
+
+
+def _to_integer(value: Any) -> int:
+    # NOTE: bool は int のサブクラスなので弾いておく。
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str):
+        try:
+            return int(value.strip())
+        except ValueError:
+            pass
+    raise ValueError("This field must be an integer.")
+
+
+def _to_number(value: Any) -> float:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        try:
+            return float(value.strip())
+        except ValueError:
+            pass
+    raise ValueError("This field must be a number.")
+
+
+def _to_boolean(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in _TRUE_STRINGS | _FALSE_STRINGS:
+        return value.strip().lower() in _TRUE_STRINGS
+    raise ValueError("This field must be a boolean.")
+
+
+_CONVERTERS: dict[str, Callable[[Any], Any]] = {
+    "string": _to_string,
+    "integer": _to_integer,
+    "number": _to_number,
+    "boolean": _to_boolean,
+}
+
+
+class _CompiledArg:
+    """
+    引数ひとつ分の宣言を、検証しやすい形にしたもの。
+    """
+
+    def __init__(self, name: str, declaration: dict[str, Any]) -> None:
+        arg_type = declaration.get("type")
+        if arg_type is not None and arg_type not in ARG_TYPES:
+            raise ValueError(f"Unknown type '{arg_type}' for lab module arg '{name}'")
+        self.name = name
+        self.convert = _CONVERTERS.get(arg_type) if arg_type else None
+        self.required = bool(declaration.get("required", False))
+        self.has_default = "default" in declaration
+        self.default = declaration.get("default")
+        self.min = declaration.get("min")
+        self.max = declaration.get("max")
+        self.min_length = declaration.get("minLength")
+        self.max_length = declaration.get("maxLength")
+        # NOTE: 正規表現のコンパイルはここで一度だけ。
+        self.pattern = re.compile(declaration["pattern"]) if "pattern" in declaration else None
+        self.choices = declaration.get("choices")
+
+    def validate(self, value: Any) -> Any:
+        """
+        Raises:
+            ValueError: 宣言に合わない場合
+        """
+        if self.convert is not None:
+            value = self.convert(value)
+        if self.min is not None and value < self.min:
+            raise ValueError(f"Ensure this value is greater than or equal to {self.min}.")
+        if self.max is not None and value > self.max:
+            raise ValueError(f"Ensure this value is less than or equal to {self.max}.")
+        if self.min_length is not None and len(value) < self.min_length:
+            raise ValueError(f"Ensure this field has at least {self.min_length} characters.")
+        if self.max_length is not None and len(value) > self.max_length:
+            raise ValueError(f"Ensure this field has no more than {self.max_length} characters.")
+        if self.pattern is not None and not self.pattern.fullmatch(value):
+            raise ValueError(f"This value does not match the required pattern: {self.pattern.pattern}")
+        if self.choices is not None and value not in self.choices:
+            raise ValueError(f"This value must be one of {self.choices}.")
+        return value
+
+
+class LabModuleArgsValidator:
+    """
+    ModuleSpec.args をコンパイルしたバリデータクラス。 LabModuleRegistry がモジュールごとにひとつ作って持っている。
+
+    ModuleSpec.args[name] に書けるキー ("description" 以外は全部省略可):
+    - type: "string" / "integer" / "number" / "boolean" 。文字列で来た数値・真偽値は型変換する。
+    - required: True なら必須。
+    - default: 省略されたときの値。
+    - min, max: 数値の範囲。
+    - minLength, maxLength: 文字列の長さ。
+    - pattern: 文字列全体がマッチすべき正規表現。
+    - choices: 取りうる値のリスト。
+    宣言されていない引数は受け付けない。
+    """
+
+    def __init__(self, declarations: dict[str, dict[str, Any]]) -> None:
+        """
+        Raises:
+            ValueError: 宣言そのものがおかしい場合 (知らない type など)
+        """
+        self._args = [_CompiledArg(name, declaration) for name, declaration in declarations.items()]
+        self._names = {arg.name for arg in self._args}
+
+    def validate(self, args: dict[str, Any]) -> dict[str, Any]:
+        """
+        args を検証して、型変換・デフォルト値の補完をした新しい dict を返す。
+
+        Raises:
+            LabModuleArgsError: 宣言に合わない場合
+        """
+        errors: dict[str, list[str]] = {}
+        validated: dict[str, Any] = {}
+        for name in args.keys() - self._names:
+            errors[name] = ["This module does not accept this argument."]
+        for arg in self._args:
+            if arg.name not in args:
+                if arg.required:
+                    errors[arg.name] = ["This field is required."]
+                elif arg.has_default:
+                    validated[arg.name] = arg.default
+                continue
+            try:
+                validated[arg.name] = arg.validate(args[arg.name])
+            except (ValueError, TypeError) as e:
+                errors[arg.name] = [str(e)]
+        if errors:
+            raise LabModuleArgsError(errors)
+        return validated
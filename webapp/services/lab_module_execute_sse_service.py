@@ -1,6 +1,15 @@
-import importlib
+import inspect
 import logging
-from typing import Any, Generator
+from functools import partial
+from typing import Any, AsyncGenerator, Callable
+
+from lab.module_specs import ModuleSpec
+from lab.run_context import LabRunDeadlineExceeded, RunContext, accepts_run_context
+from services.lab_module_executors import get_lab_module_executor
+from services.lab_module_profiler import LabModuleProfiler
+from services.lab_module_registry import get_lab_module_registry
+from services.lab_process_pool import LabModuleResourceLimitExceeded
+from services.lab_result_cache import get_lab_result_cache
 
 logger = logging.getLogger(__name__)
 
@@ -8,16 +17,29 @@ logger = logging.getLogger(__name__)
 class LabModuleExecuteSSEService:
     """
     Lab モジュールをSSE形式で実行するサービスクラス。
+    main は普通の関数、ジェネレータ、 async ジェネレータ (async def main + yield) のどれでも OK。
+    main が ctx 引数を受け取るなら RunContext (lab.run_context) を渡す。ストリームが途中で閉じられたら
+    (クライアントの切断・ run のキャンセル) ctx をキャンセルするので、 ctx.sleep で待っている main もすぐ抜ける。
     """
 
-    def execute_module_sse(self, module_name: str, args: dict[str, Any]) -> Generator[str, None, None]:
+    async def aexecute_module_sse(
+        self,
+        module_name: str,
+        args: dict[str, Any],
+        profiler: LabModuleProfiler | None = None,
+        timeout: float | None = None,
+    ) -> AsyncGenerator[str, None]:
         """
-        指定されたモジュールをSSE形式で実行する。
-        webapp.lab.{module_name} をインポートし、main 関数を実行してその結果をyieldする。
+        指定されたモジュールを実行して、 main が yield したメッセージを 1 件ずつ yield する。
+        async な main はイベントループ上でそのまま回し、同期の main は executor のスレッドプールで回す。
+        ストリームが待機している間はスレッドを握らないので、たくさんのストリームがひとつのイベントループを共有できる。
+        ModuleSpec.cacheable なモジュールは、同じ args の結果をキャッシュから返す (services.lab_result_cache) 。
 
         Args:
             module_name (str): モジュール名
             args (dict[str, Any]): モジュールに渡す引数
+            profiler (LabModuleProfiler | None): 渡すと main をプロファイルしながら実行する。キャッシュは使わない。
+            timeout (float | None): ctx.deadline までの秒数。 ModuleSpec.timeout のほうが短ければそちら。
 
         Yields:
             str: SSE形式のメッセージ
@@ -25,45 +47,126 @@ class LabModuleExecuteSSEService:
         Raises:
             ModuleNotFoundError: 指定されたモジュールが見つからない場合
             AttributeError: モジュールに main 関数が定義されていない場合
+            LabModuleResourceLimitExceeded: isolation="process" のモジュールが CPU 時間・メモリの上限を超えた場合
+            LabRunDeadlineExceeded: ctx を受け取る main が ctx.deadline を過ぎた場合
         """
-        logger.info(f"LabModuleExecuteSSEService.execute_module_sse called with module_name={module_name}, args={args}")
+        logger.info(
+            f"LabModuleExecuteSSEService.aexecute_module_sse called with module_name={module_name}, args={args}"
+        )
 
-        try:
-            # webapp.lab.{module_name} をインポート
-            module_path = f"lab.{module_name}"
-            module = importlib.import_module(module_path)
-            logger.info(f"Successfully imported module: {module_path}")
+        main_func, spec = self._get_main_func_and_spec(module_name)
 
-        except ModuleNotFoundError as e:
-            logger.error(f"Module not found: {module_name}")
-            raise ModuleNotFoundError(f"Module '{module_name}' not found in lab directory") from e
+        produce = partial(self._aexecute_main, module_name, main_func, args, spec, profiler, timeout)
+        # NOTE: プロファイルしたいのは実際の実行なので、キャッシュからは返さない。
+        if spec is not None and spec.cacheable and profiler is None:
+            cache = get_lab_result_cache()
+            key = cache.make_key(module_name, get_lab_module_registry().get(module_name).version, args)
+            messages = cache.astream(key, produce, ttl=spec.cache_ttl)
+        else:
+            messages = produce()
 
-        try:
-            # main 関数を取得
-            main_func = getattr(module, "main")
-            logger.info(f"Successfully found main function in module: {module_name}")
-
-        except AttributeError as e:
-            logger.error(f"main function not found in module: {module_name}")
-            raise AttributeError(f"Module '{module_name}' does not have a 'main' function") from e
+        async for message in messages:
+            yield message
 
+    async def _aexecute_main(
+        self,
+        module_name: str,
+        main_func: Callable[..., Any],
+        args: dict[str, Any],
+        spec: ModuleSpec | None,
+        profiler: LabModuleProfiler | None = None,
+        timeout: float | None = None,
+    ) -> AsyncGenerator[str, None]:
+        """
+        main 関数の種類に応じて実行し、メッセージを yield する。
+        """
+        ctx = self._create_run_context(main_func, spec, timeout)
+        is_async = inspect.isasyncgenfunction(main_func) or inspect.iscoroutinefunction(main_func)
+        if ctx is not None and is_async:
+            # NOTE: 同期の main には executor が渡す (isolation="process" ならワーカープロセス側で作り直す) 。
+            main_func = partial(main_func, ctx=ctx)
+        if profiler is not None and is_async:
+            # NOTE: 同期の main は executor の中 (実際に実行するスレッド・プロセス) でプロファイルする。
+            main_func = profiler.wrap(main_func)
         try:
-            # main関数を実行してyield
-            result = main_func(**args)
-
-            # main関数がジェネレーターを返す場合
-            if hasattr(result, "__iter__") and hasattr(result, "__next__"):
+            if inspect.isasyncgenfunction(main_func):
+                # async def main + yield の場合
                 try:
-                    yield from result
+                    async for message in main_func(**args):
+                        yield message
+                except LabRunDeadlineExceeded:
+                    raise
                 except Exception as e:
-                    logger.error(f"Error during generator execution in module {module_name}: {e}")
+                    logger.error(f"Error during async generator execution in module {module_name}: {e}")
                     yield f"ERROR: {str(e)}"
+            elif inspect.iscoroutinefunction(main_func):
+                # async def main で単一の値を返す場合
+                yield str(await main_func(**args))
             else:
-                # main関数が単一の値を返す場合
-                yield str(result)
+                # 同期の main は、 ModuleSpec.isolation に対応する executor (settings.LAB_MODULE_EXECUTORS) で回す。
+                # NOTE: isolation="process" が効くのは同期の main だけ。 async な main は常にイベントループ上で回る。
+                executor = get_lab_module_executor(spec.isolation if spec else "thread")
+                try:
+                    async for message in executor.astream(module_name, main_func, args, spec, profiler, ctx):
+                        yield message
+                except (LabModuleResourceLimitExceeded, LabRunDeadlineExceeded):
+                    # NOTE: ふつうのメッセージではなく、エラーとしてクライアントに返してもらう。
+                    raise
+                except Exception as e:
+                    logger.error(f"Error during generator execution in module {module_name}: {e}")
+                    yield f"ERROR: {str(e)}"
 
             logger.info(f"Successfully executed main function for module: {module_name}")
 
+        except LabModuleResourceLimitExceeded as e:
+            logger.error(f"Resource limit exceeded in module {module_name}: {e}")
+            raise
+
+        except LabRunDeadlineExceeded as e:
+            logger.error(f"Deadline exceeded in module {module_name}: {e}")
+            raise
+
         except Exception as e:
             logger.error(f"Error executing main function in module {module_name}: {e}")
             yield f"ERROR: {str(e)}"
+
+        finally:
+            # NOTE: 途中で閉じられた (クライアントの切断・キャンセル) ときに、スレッドで待っている main を起こす。
+            if ctx is not None:
+                ctx.cancel("stream closed")
+
+    @staticmethod
+    def _create_run_context(
+        main_func: Callable[..., Any], spec: ModuleSpec | None, timeout: float | None = None
+    ) -> RunContext | None:
+        """
+        main が ctx を受け取るなら RunContext を作る。 deadline は timeout と ModuleSpec.timeout の短いほう。
+        """
+        if not accepts_run_context(main_func):
+            return None
+        timeouts = [t for t in (timeout, spec.timeout if spec else None) if t is not None]
+        return RunContext(min(timeouts) if timeouts else None)
+
+    def _get_main_func_and_spec(self, module_name: str) -> tuple[Callable[..., Any], ModuleSpec | None]:
+        """
+        webapp.lab.{module_name} の main 関数と ModuleSpec (get_spec があれば) を LabModuleRegistry から取得する。
+
+        Raises:
+            ModuleNotFoundError: 指定されたモジュールが見つからない場合
+            AttributeError: モジュールに main 関数が定義されていない場合
+        """
+        registry = get_lab_module_registry()
+
+        try:
+            main_func = registry.get_main(module_name)
+
+        except ModuleNotFoundError:
+            logger.error(f"Module not found: {module_name}")
+            raise
+
+        except AttributeError:
+            logger.error(f"main function not found in module: {module_name}")
+            raise
+
+        # NOTE: get_spec は必須ではない。無ければデフォルト (isolation="thread") で実行する。
+        return main_func, registry.get(module_name).spec
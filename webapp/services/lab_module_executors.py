@@ -0,0 +1,241 @@
+"""
+同期の lab モジュール (main がジェネレータ or 普通の関数) をどこで実行するかを切り替える executor 群。
+settings.LAB_MODULE_EXECUTORS で、 ModuleSpec.isolation ごとに BACKEND を差し替えられる。
+"""
+import asyncio
+import logging
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from typing import Any, AsyncIterator, Callable
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from lab.module_specs import ModuleSpec
+from lab.run_context import LabRunCancelled, RunContext
+from services.lab_module_profiler import LabModuleProfiler
+from services.lab_process_pool import LabProcessPool
+from shared.async_streams import aiterate_sync_iterator
+from shared.channels import BoundedChannel, ChannelClosed
+
+logger = logging.getLogger(__name__)
+
+
+class LabModuleExecutor(ABC):
+    """
+    同期の main を実行して、 yield されたメッセージを async イテレータとして返す executor の基底クラス。
+    """
+
+    @abstractmethod
+    def astream(
+        self,
+        module_name: str,
+        main_func: Callable[..., Any],
+        args: dict[str, Any],
+        spec: ModuleSpec | None = None,
+        profiler: LabModuleProfiler | None = None,
+        ctx: RunContext | None = None,
+    ) -> AsyncIterator[str]:
+        """
+        main_func(**args) を実行して、メッセージを 1 件ずつ yield する。
+
+        Args:
+            module_name (str): モジュール名
+            main_func (Callable[..., Any]): モジュールの main 関数 (同期)
+            args (dict[str, Any]): main に渡す引数
+            spec (ModuleSpec | None): モジュールの仕様。実行時の上限などを読む。
+            profiler (LabModuleProfiler | None): 渡された場合は、 main を実行する場所でプロファイルする。
+            ctx (RunContext | None): 渡された場合は、 main の ctx 引数に渡す。
+
+        Yields:
+            str: main が yield したメッセージ。 main が単一の値を返した場合はそれを str にしたもの。
+        NOTE: サブクラスでは async ジェネレータ (async def + yield) として実装する。
+        """
+
+
+class InlineLabModuleExecutor(LabModuleExecutor):
+    """
+    next() のたびに asgiref のスレッドプールへ逃がすだけの executor 。
+    数の上限も backpressure も無いので、開発用・比較用。
+    """
+
+    async def astream(
+        self,
+        module_name: str,
+        main_func: Callable[..., Any],
+        args: dict[str, Any],
+        spec: ModuleSpec | None = None,
+        profiler: LabModuleProfiler | None = None,
+        ctx: RunContext | None = None,
+    ) -> AsyncIterator[str]:
+        if ctx is not None:
+            main_func = partial(main_func, ctx=ctx)
+        if profiler is not None:
+            main_func = profiler.wrap(main_func)
+        result = main_func(**args)
+        if hasattr(result, "__iter__") and hasattr(result, "__next__"):
+            async for message in aiterate_sync_iterator(result):
+                yield message
+        else:
+            yield str(result)
+
+
+class ThreadPoolLabModuleExecutor(LabModuleExecutor):
+    """
+    上限つきのスレッドプールで main を回す executor 。
+    - main が yield したメッセージは BoundedChannel (上限 queue_high_water_mark) 経由で SSE レスポンスへ渡す。
+      クライアントが遅くてチャンネルがいっぱいになると、 main 側が次の yield で待たされる (backpressure) 。
+    - ひとつのモジュールが同時に使えるスレッドは module_concurrency_limit 本まで。空くまで順番待ちになる。
+    - クライアントが切断したらチャンネルを閉じるので、 main は次の yield で止まる。
+      ctx を受け取る main なら、 ctx.sleep で待っている途中でも止まる (ctx は呼び出し元がキャンセルする) 。
+    """
+
+    def __init__(self, max_workers: int = 16, queue_high_water_mark: int = 64, module_concurrency_limit: int = 4):
+        self.queue_high_water_mark = queue_high_water_mark
+        self.module_concurrency_limit = module_concurrency_limit
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="lab-module")
+        # モジュールごとの実行枠。トークンが入ったチャンネルをセマフォ代わりにしている。
+        # NOTE: WSGI ではリクエストごとに別のイベントループで回るので、 asyncio.Semaphore は使えない。
+        self._module_slots: dict[str, BoundedChannel[object]] = {}
+        self._module_slots_lock = threading.Lock()
+
+    async def astream(
+        self,
+        module_name: str,
+        main_func: Callable[..., Any],
+        args: dict[str, Any],
+        spec: ModuleSpec | None = None,
+        profiler: LabModuleProfiler | None = None,
+        ctx: RunContext | None = None,
+    ) -> AsyncIterator[str]:
+        if ctx is not None:
+            main_func = partial(main_func, ctx=ctx)
+        if profiler is not None:
+            # NOTE: ラップした main はプールのスレッドで呼ばれるので、そのスレッドで測れる。
+            main_func = profiler.wrap(main_func)
+        slots = self._get_module_slots(module_name)
+        slot = await slots.aget()
+
+        channel: BoundedChannel[str] = BoundedChannel(self.queue_high_water_mark)
+        try:
+            future = self._pool.submit(self._produce, module_name, main_func, args, channel, slots, slot)
+        except BaseException:
+            slots.put_nowait(slot)
+            raise
+
+        try:
+            while True:
+                try:
+                    message = await channel.aget()
+                except ChannelClosed:
+                    break
+                yield message
+            # main 内で発生した例外はここで再送出される。
+            await asyncio.wrap_future(future)
+        finally:
+            # NOTE: 途中でクライアントが切断した場合、 producer は次の put で ChannelClosed になって止まる。
+            channel.close()
+
+    @staticmethod
+    def _produce(
+        module_name: str,
+        main_func: Callable[..., Any],
+        args: dict[str, Any],
+        channel: BoundedChannel[str],
+        slots: BoundedChannel[object],
+        slot: object,
+    ) -> None:
+        """
+        プールのスレッド上で main を実行して、メッセージをチャンネルへ送る。
+        """
+        result = None
+        try:
+            if channel.closed:
+                # 順番待ちの間にクライアントがいなくなった。
+                return
+            result = main_func(**args)
+            if hasattr(result, "__iter__") and hasattr(result, "__next__"):
+                for message in result:
+                    channel.put(message)
+            else:
+                channel.put(str(result))
+        except ChannelClosed:
+            logger.info(f"Lab module consumer went away, stopping producer: {module_name}")
+        except LabRunCancelled:
+            # NOTE: deadline を過ぎた場合など、まだ受け取り手がいるなら例外として返す。
+            if not channel.closed:
+                raise
+            logger.info(f"Lab module consumer went away, stopping producer: {module_name}")
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+            channel.close()
+            slots.put_nowait(slot)
+
+    def _get_module_slots(self, module_name: str) -> BoundedChannel[object]:
+        with self._module_slots_lock:
+            slots = self._module_slots.get(module_name)
+            if slots is None:
+                slots = BoundedChannel(self.module_concurrency_limit)
+                for _ in range(self.module_concurrency_limit):
+                    slots.put_nowait(object())
+                self._module_slots[module_name] = slots
+            return slots
+
+
+class ProcessPoolLabModuleExecutor(LabModuleExecutor):
+    """
+    ウォームなワーカープロセスのプール (services.lab_process_pool) で main を回す executor 。
+    CPU を食うモジュールが GIL を握って、同じ web ワーカーの他のリクエストを止めてしまうのを防ぐ。
+    ModuleSpec に cpu_time_limit / memory_limit_mb があればそれを、無ければ OPTIONS のデフォルトを上限にする。
+    上限を超えたら LabModuleResourceLimitExceeded 。
+    """
+
+    def __init__(
+        self,
+        pool_size: int | None = None,
+        start_method: str | None = None,
+        cpu_time_limit: float | None = None,
+        memory_limit_mb: int | None = None,
+    ):
+        self.cpu_time_limit = cpu_time_limit
+        self.memory_limit_mb = memory_limit_mb
+        self._pool = LabProcessPool(size=pool_size, start_method=start_method)
+
+    async def astream(
+        self,
+        module_name: str,
+        main_func: Callable[..., Any],
+        args: dict[str, Any],
+        spec: ModuleSpec | None = None,
+        profiler: LabModuleProfiler | None = None,
+        ctx: RunContext | None = None,
+    ) -> AsyncIterator[str]:
+        # NOTE: main_func はワーカープロセス側で import し直すので使わない。
+        cpu_time_limit = spec.cpu_time_limit if spec and spec.cpu_time_limit is not None else self.cpu_time_limit
+        memory_limit_mb = spec.memory_limit_mb if spec and spec.memory_limit_mb is not None else self.memory_limit_mb
+        # NOTE: ctx はプロセスをまたげないので、ワーカーで作り直す。キャンセルはワーカーを殺すことで伝わる。
+        timeout = ctx.remaining() if ctx is not None else None
+        async for message in self._pool.astream(
+            module_name, args, cpu_time_limit, memory_limit_mb, profiler, ctx is not None, timeout
+        ):
+            yield message
+
+
+@lru_cache(maxsize=None)
+def get_lab_module_executor(isolation: str = "thread") -> LabModuleExecutor:
+    """
+    settings.LAB_MODULE_EXECUTORS[isolation] で指定された executor を返す。
+    プロセスごとに、 isolation ひとつにつきひとつだけ作る。
+
+    Args:
+        isolation (str): ModuleSpec.isolation 。 "thread" か "process" 。
+    """
+    executors = getattr(settings, "LAB_MODULE_EXECUTORS", {})
+    if isolation not in executors:
+        raise ValueError(f"Unknown lab module isolation: '{isolation}'")
+    config = executors[isolation]
+    executor_class = import_string(config["BACKEND"])
+    return executor_class(**config.get("OPTIONS", {}))
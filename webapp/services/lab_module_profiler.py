@@ -0,0 +1,271 @@
+"""
+lab モジュールの実行をその場でプロファイルするためのプロファイラ。
+POST /api/app/lab の options.profile: true (特権のある呼び出し元だけ) で使う。
+
+- main の呼び出しと、メッセージをひとつ yield するまでの 1 ステップずつを cProfile で測る (.pstats) 。
+- 同時にサンプリングでスタックを集めて、 flamegraph.pl / speedscope に渡せる collapsed 形式にする。
+- yield ごとの経過時間 (wall) と CPU 時間 (そのスレッドの thread_time) も記録する。
+
+プロファイルしない実行にはこのクラスが一切関わらないので、オーバーヘッドは無い。
+NOTE: ワーカープロセス (services.lab_process_pool) でも使うので、 Django に依存させないこと。
+test: services.tests.test_lab_module_profiler
+"""
+import cProfile
+import inspect
+import logging
+import marshal
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from functools import wraps
+from types import FrameType
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator
+
+logger = logging.getLogger(__name__)
+
+
+class _Holder:
+    """
+    pstats.Stats に生の stats (dict) を読ませるための入れ物。
+    """
+
+    def __init__(self, stats: dict) -> None:
+        self.stats = stats
+
+    def create_stats(self) -> None:
+        pass
+
+
+class LabModuleProfiler:
+    """
+    1 回の実行ぶんのプロファイラクラス。 wrap した main を実行して、終わったら finish を呼ぶ。
+    NOTE: cProfile を有効にするのは main のステップを実行している間だけ。
+          async な main の場合、 await の間に同じイベントループで動いた別のタスクも測ってしまう。
+    """
+
+    def __init__(self, sampling_interval: float = 0.005) -> None:
+        self.sampling_interval = sampling_interval
+        # yield ごとの {"wallMs": ..., "cpuMs": ...} 。
+        self.yields: list[dict[str, float]] = []
+        self._profile = cProfile.Profile()
+        self._stats: dict = {}
+        self._samples: Counter[str] = Counter()
+        # サンプリング中のスレッド。ステップを実行していない間は None 。
+        self._target_thread: int | None = None
+        self._sampler: threading.Thread | None = None
+        self._stopped = threading.Event()
+        self._finished = False
+
+    def wrap(self, main_func: Callable[..., Any]) -> Callable[..., Any]:
+        """
+        main_func をプロファイルつきで実行する関数を返す。
+        同期・ジェネレータ・ async のどれでも、元と同じ種類の関数になる。
+        """
+        if inspect.isasyncgenfunction(main_func):
+
+            @wraps(main_func)
+            async def profiled_async_gen_main(**args: Any) -> AsyncIterator[Any]:
+                agen = main_func(**args)
+                try:
+                    while True:
+                        try:
+                            yield await self._astep(agen.__anext__)
+                        except StopAsyncIteration:
+                            return
+                finally:
+                    await agen.aclose()
+
+            return profiled_async_gen_main
+
+        if inspect.iscoroutinefunction(main_func):
+
+            @wraps(main_func)
+            async def profiled_async_main(**args: Any) -> Any:
+                return await self._astep(lambda: main_func(**args), record_yield=False)
+
+            return profiled_async_main
+
+        @wraps(main_func)
+        def profiled_main(**args: Any) -> Any:
+            result = self._step(lambda: main_func(**args), record_yield=False)
+            if hasattr(result, "__iter__") and hasattr(result, "__next__"):
+                return self._iterate(result)
+            return result
+
+        return profiled_main
+
+    def finish(self) -> None:
+        """
+        計測を終えて、結果を取り出せる状態にする。何回呼んでもよい。
+        """
+        if self._finished:
+            return
+        self._finished = True
+        self._stopped.set()
+        self._profile.create_stats()
+        self._merge_stats(self._profile.stats)
+
+    def export(self) -> dict[str, Any]:
+        """
+        ワーカープロセスから親へ送るための、 pickle できる形の結果。
+        """
+        self.finish()
+        return {"stats": self._stats, "samples": dict(self._samples), "yields": self.yields}
+
+    def merge(self, exported: dict[str, Any]) -> None:
+        """
+        export した結果 (ワーカープロセスで測ったもの) を取り込む。
+        """
+        self._merge_stats(exported["stats"])
+        self._samples.update(exported["samples"])
+        self.yields.extend(exported["yields"])
+
+    def pstats_bytes(self) -> bytes:
+        """
+        cProfile.Profile.dump_stats と同じ形式のバイト列。 python -m pstats や snakeviz で開ける。
+        """
+        self.finish()
+        return marshal.dumps(self._stats)
+
+    def collapsed_stacks(self) -> str:
+        """
+        サンプリングで集めたスタックを、 "呼び出し元;...;呼び出し先 サンプル数" の行にしたもの。
+        """
+        self.finish()
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self._samples.items()))
+
+    def summary(self, top: int = 20) -> dict[str, Any]:
+        """
+        yield ごとの時間と、累積時間の長い関数の一覧。
+        """
+        self.finish()
+        functions = []
+        if self._stats:
+            stats = pstats.Stats(_Holder(self._stats))  # type: ignore[arg-type]
+            entries = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)  # type: ignore[attr-defined]
+            for (filename, line, name), (_, calls, total_time, cumulative_time, _) in entries[:top]:
+                functions.append(
+                    {
+                        "function": f"{filename}:{line}({name})",
+                        "calls": calls,
+                        "totalTimeMs": round(total_time * 1000, 3),
+                        "cumulativeTimeMs": round(cumulative_time * 1000, 3),
+                    }
+                )
+        return {
+            "yields": self.yields,
+            "wallMs": round(sum(y["wallMs"] for y in self.yields), 3),
+            "cpuMs": round(sum(y["cpuMs"] for y in self.yields), 3),
+            "samples": sum(self._samples.values()),
+            "topFunctions": functions,
+        }
+
+    def _iterate(self, iterator: Iterator[Any]) -> Iterator[Any]:
+        try:
+            while True:
+                try:
+                    message = self._step(next, iterator)
+                except StopIteration:
+                    return
+                yield message
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()
+
+    def _step(self, func: Callable[..., Any], *args: Any, record_yield: bool = True) -> Any:
+        """
+        main のステップをひとつ、プロファイルしながら実行する。
+        NOTE: サンプラはこのフレームより上 (main 側) だけをスタックとして数える。
+        """
+        started_at = self._begin()
+        try:
+            result = func(*args)
+        finally:
+            elapsed = self._end(started_at)
+        # NOTE: StopIteration や例外で終わったステップは yield ではないので記録しない。
+        if record_yield:
+            self._record_yield(elapsed)
+        return result
+
+    async def _astep(self, func: Callable[[], Awaitable[Any]], record_yield: bool = True) -> Any:
+        started_at = self._begin()
+        try:
+            result = await func()
+        finally:
+            elapsed = self._end(started_at)
+        if record_yield:
+            self._record_yield(elapsed)
+        return result
+
+    def _begin(self) -> tuple[float, float]:
+        self._start_sampler()
+        self._target_thread = threading.get_ident()
+        try:
+            self._profile.enable()
+        except ValueError as e:
+            # NOTE: Python 3.12 以降は、プロセスの中で同時に有効にできる cProfile がひとつだけ。
+            #       ほかの実行をプロファイル中なら、このステップはサンプリングだけにする。
+            logger.warning(f"cProfile is not available for this step: {e}")
+        return time.perf_counter(), time.thread_time()
+
+    def _end(self, started_at: tuple[float, float]) -> tuple[float, float]:
+        """
+        Returns:
+            tuple[float, float]: このステップの (wall 時間, CPU 時間) (秒)
+        """
+        elapsed = (time.perf_counter() - started_at[0], time.thread_time() - started_at[1])
+        self._profile.disable()
+        self._target_thread = None
+        return elapsed
+
+    def _record_yield(self, elapsed: tuple[float, float]) -> None:
+        self.yields.append({"wallMs": round(elapsed[0] * 1000, 3), "cpuMs": round(elapsed[1] * 1000, 3)})
+
+    def _start_sampler(self) -> None:
+        if self._sampler is None:
+            self._sampler = threading.Thread(target=self._sample_loop, name="lab-profiler", daemon=True)
+            self._sampler.start()
+
+    def _sample_loop(self) -> None:
+        while not self._stopped.wait(self.sampling_interval):
+            thread_id = self._target_thread
+            if thread_id is None:
+                continue
+            frame = sys._current_frames().get(thread_id)
+            stack = self._collapse(frame)
+            if stack:
+                self._samples[stack] += 1
+
+    @classmethod
+    def _collapse(cls, frame: FrameType | None) -> str | None:
+        """
+        ステップのフレーム (_step / _astep) より上のフレームを、外側から ; でつなぐ。
+        ステップのフレームがスタックに無い (async でほかのタスクが動いている) ときは None 。
+        """
+        names: list[str] = []
+        while frame is not None:
+            if frame.f_code in _STEP_CODES:
+                return ";".join(reversed(names)) or None
+            module = frame.f_globals.get("__name__", "?")
+            # このプロファイラ自身のフレーム (main を呼ぶ lambda など) は除く。
+            if module != __name__:
+                code = frame.f_code
+                names.append(f"{module}.{getattr(code, 'co_qualname', code.co_name)}")
+            frame = frame.f_back
+        return None
+
+    def _merge_stats(self, stats: dict) -> None:
+        # NOTE: pstats.Stats は空の stats を読めないので、どちらかが空なら足さない。
+        if not stats:
+            return
+        if not self._stats:
+            self._stats = dict(stats)
+            return
+        merged = pstats.Stats(_Holder(self._stats))  # type: ignore[arg-type]
+        merged.add(_Holder(stats))
+        self._stats = merged.stats  # type: ignore[attr-defined]
+
+
+_STEP_CODES = {LabModuleProfiler._step.__code__, LabModuleProfiler._astep.__code__}
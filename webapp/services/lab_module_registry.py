@@ -0,0 +1,276 @@
+"""
+lab パッケージのモジュールを一度だけ走査して、 main / get_spec / ModuleSpec をキャッシュしておくレジストリ。
+test: services.tests.test_lab_module_registry
+"""
+import hashlib
+import importlib
+import logging
+import os
+import pkgutil
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from types import ModuleType
+from typing import Any, Callable
+
+from django.conf import settings
+
+from lab.module_specs import ModuleSpec
+from services.lab_module_args_validator import LabModuleArgsValidator
+
+logger = logging.getLogger(__name__)
+
+# lab パッケージにあるけど、 lab モジュールではないもの。
+_NON_MODULE_NAMES = {"module_specs", "run_context"}
+
+
+class LabModuleImportError(Exception):
+    """
+    lab モジュールの import (あるいは get_spec) に失敗していたときの例外。元の例外は __cause__ に入っている。
+    NOTE: ImportError のサブクラスにはしない。 import の中の ModuleNotFoundError と、
+          「そんなモジュールは無い」の ModuleNotFoundError を取り違えないように。
+    """
+
+
+@dataclass
+class LabModuleEntry:
+    """
+    レジストリに載っている lab モジュールひとつ分。
+    """
+
+    name: str
+    module: ModuleType | None
+    main: Callable[..., Any] | None
+    get_spec: Callable[[], ModuleSpec] | None
+    spec: ModuleSpec | None
+    # 変更検知用。モジュールファイルの mtime (ns) 。
+    mtime_ns: int
+    # モジュールファイルの中身の sha256 。 ETag などに使う。
+    version: str = ""
+    # import に失敗した場合はその例外。 get のたびに LabModuleImportError で包んで投げ直す。
+    import_error: Exception | None = None
+    # spec.args をコンパイルしたバリデータ。 spec が無ければ None 。
+    args_validator: LabModuleArgsValidator | None = None
+
+
+class LabModuleRegistry:
+    """
+    lab モジュールのレジストリクラス。
+    - 最初に使われたときに lab パッケージをまとめて import して、 main / get_spec / ModuleSpec をキャッシュする。
+    - 以降の lookup は dict を引くだけ。存在しないモジュール名も dict に無いだけなので、 import は走らない。
+    - reload_check_interval 秒ごとにファイルの mtime を確認して、変更されたモジュールだけ reload する。
+      モジュールが追加・削除されたときのために、パッケージディレクトリの mtime も見ている。
+    """
+
+    def __init__(self, package: str = "lab", reload_check_interval: float | None = 2.0) -> None:
+        """
+        Args:
+            package (str): 走査するパッケージ
+            reload_check_interval (float | None): mtime を確認する間隔 (秒) 。 None なら reload しない。
+        """
+        self.package = package
+        self.reload_check_interval = reload_check_interval
+        self._entries: dict[str, LabModuleEntry] = {}
+        self._package_dir: str | None = None
+        self._package_dir_mtime_ns = 0
+        self._scanned = False
+        self._last_checked_at = 0.0
+        self._lock = threading.RLock()
+
+    def get(self, module_name: str) -> LabModuleEntry:
+        """
+        モジュールのエントリを取得する。
+
+        Raises:
+            ModuleNotFoundError: 指定されたモジュールが見つからない場合
+            LabModuleImportError: モジュールの import に失敗していた場合
+        """
+        entry = self.lookup(module_name)
+        if entry.import_error is not None:
+            raise LabModuleImportError(
+                f"Module '{module_name}' failed to import: {entry.import_error}"
+            ) from entry.import_error
+        return entry
+
+    def get_main(self, module_name: str) -> Callable[..., Any]:
+        """
+        モジュールの main 関数を取得する。
+
+        Raises:
+            ModuleNotFoundError: 指定されたモジュールが見つからない場合
+            LabModuleImportError: モジュールの import に失敗していた場合
+            AttributeError: モジュールに main 関数が定義されていない場合
+        """
+        entry = self.get(module_name)
+        if entry.main is None:
+            raise AttributeError(f"Module '{module_name}' does not have a 'main' function")
+        return entry.main
+
+    def get_spec(self, module_name: str) -> ModuleSpec:
+        """
+        モジュールの ModuleSpec を取得する。 get_spec() は import 時に一度だけ呼ばれる。
+
+        Raises:
+            ModuleNotFoundError: 指定されたモジュールが見つからない場合
+            LabModuleImportError: モジュールの import に失敗していた場合
+            AttributeError: モジュールに get_spec 関数が定義されていない場合
+        """
+        entry = self.get(module_name)
+        if entry.spec is None:
+            raise AttributeError(f"Module '{module_name}' does not have a 'get_spec' function")
+        return entry.spec
+
+    def entries(self, include_failed: bool = False) -> list[LabModuleEntry]:
+        """
+        全モジュールのエントリを、名前順で返す。
+
+        Args:
+            include_failed (bool): True なら import に失敗したモジュールのエントリ (import_error つき) も含める。
+        """
+        self._ensure_fresh()
+        # NOTE: ほかのスレッドの scan が dict を書き換えている途中に回さないように、ロックの中でコピーする。
+        with self._lock:
+            entries = sorted(self._entries.values(), key=lambda entry: entry.name)
+        return [entry for entry in entries if include_failed or entry.import_error is None]
+
+    def catalog_version(self, module_names: list[str] | None = None) -> str:
+        """
+        モジュール群の中身から作ったバージョン文字列。どれかのファイルが変わると変わる。
+
+        Args:
+            module_names (list[str] | None): 対象のモジュール名。 None なら全モジュール。
+
+        Raises:
+            ModuleNotFoundError: 指定されたモジュールが見つからない場合
+        """
+        # NOTE: import に失敗しているモジュールも入れる。直ったらバージョンが変わるように。
+        if module_names is None:
+            entries = self.entries(include_failed=True)
+        else:
+            entries = [self.lookup(name) for name in sorted(set(module_names))]
+        digest = hashlib.sha256()
+        for entry in entries:
+            digest.update(f"{entry.name}:{entry.version}\n".encode())
+        return digest.hexdigest()
+
+    def scan(self) -> None:
+        """
+        パッケージを走査して、エントリを作り直す (変更が無いモジュールはそのまま) 。
+        起動時に呼んでおくと、最初のリクエストで import のコストを払わずに済む。
+        """
+        with self._lock:
+            package = importlib.import_module(self.package)
+            self._package_dir = os.path.dirname(package.__file__ or "")
+            self._package_dir_mtime_ns = self._stat_mtime_ns(self._package_dir)
+
+            names = {
+                module_info.name
+                for module_info in pkgutil.iter_modules(package.__path__)
+                # NOTE: _ で始まるモジュールと、 lab モジュールから import するもの (module_specs など) は除く。
+                if not module_info.name.startswith("_") and module_info.name not in _NON_MODULE_NAMES
+            }
+            for removed in set(self._entries) - names:
+                logger.info(f"Lab module removed from registry: {removed}")
+                del self._entries[removed]
+            for name in sorted(names):
+                entry = self._entries.get(name)
+                if entry is None or entry.mtime_ns != self._stat_mtime_ns(self._module_path(name)):
+                    self._entries[name] = self._load(name, reload=entry is not None)
+
+            self._scanned = True
+            self._last_checked_at = time.monotonic()
+
+    def lookup(self, module_name: str) -> LabModuleEntry:
+        """
+        import に失敗したものも含めて、モジュールのエントリを取得する。
+
+        Raises:
+            ModuleNotFoundError: 指定されたモジュールが見つからない場合
+        """
+        self._ensure_fresh()
+        entry = self._entries.get(module_name)
+        if entry is None:
+            raise ModuleNotFoundError(f"Module '{module_name}' not found in lab directory")
+        return entry
+
+    def _ensure_fresh(self) -> None:
+        if not self._scanned:
+            self.scan()
+            return
+        if self.reload_check_interval is None:
+            return
+        if time.monotonic() - self._last_checked_at < self.reload_check_interval:
+            return
+        with self._lock:
+            if time.monotonic() - self._last_checked_at < self.reload_check_interval:
+                return
+            if self._has_changes():
+                self.scan()
+            self._last_checked_at = time.monotonic()
+
+    def _has_changes(self) -> bool:
+        assert self._package_dir is not None
+        if self._stat_mtime_ns(self._package_dir) != self._package_dir_mtime_ns:
+            return True
+        return any(
+            entry.mtime_ns != self._stat_mtime_ns(self._module_path(name)) for name, entry in self._entries.items()
+        )
+
+    def _load(self, name: str, reload: bool) -> LabModuleEntry:
+        module_path = f"{self.package}.{name}"
+        mtime_ns = self._stat_mtime_ns(self._module_path(name))
+        version = ""
+        try:
+            with open(self._module_path(name), "rb") as f:
+                version = hashlib.sha256(f.read()).hexdigest()
+            module = importlib.import_module(module_path)
+            if reload:
+                module = importlib.reload(module)
+            get_spec = getattr(module, "get_spec", None)
+            spec = get_spec() if get_spec else None
+            entry = LabModuleEntry(
+                name=name,
+                module=module,
+                main=getattr(module, "main", None),
+                get_spec=get_spec,
+                spec=spec,
+                mtime_ns=mtime_ns,
+                version=version,
+                # NOTE: args の宣言は読み込んだときに一度だけコンパイルする。宣言がおかしければ import エラー扱い。
+                args_validator=LabModuleArgsValidator(spec.args) if spec else None,
+            )
+            logger.info(f"Lab module {'reloaded' if reload else 'loaded'}: {module_path}")
+            return entry
+        except Exception as e:
+            logger.error(f"Failed to load lab module {module_path}: {e}")
+            return LabModuleEntry(
+                name=name,
+                module=None,
+                main=None,
+                get_spec=None,
+                spec=None,
+                mtime_ns=mtime_ns,
+                version=version,
+                import_error=e,
+            )
+
+    def _module_path(self, name: str) -> str:
+        assert self._package_dir is not None
+        return os.path.join(self._package_dir, f"{name}.py")
+
+    @staticmethod
+    def _stat_mtime_ns(path: str) -> int:
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return 0
+
+
+@lru_cache(maxsize=None)
+def get_lab_module_registry() -> LabModuleRegistry:
+    """
+    プロセスで共有する LabModuleRegistry を返す。設定は settings.LAB_MODULE_REGISTRY 。
+    """
+    config = getattr(settings, "LAB_MODULE_REGISTRY", {})
+    return LabModuleRegistry(**config)
@@ -1,7 +1,8 @@
-import importlib
 import logging
+from typing import Any
 
 from lab.module_specs import ModuleSpec
+from services.lab_module_registry import LabModuleImportError, get_lab_module_registry
 
 logger = logging.getLogger(__name__)
 
@@ -14,7 +15,7 @@ class LabModuleSpecService:
     def get_module_spec(self, module_name: str) -> ModuleSpec:
         """
         指定されたモジュール名の ModuleSpec を取得する。
-        webapp.lab ディレクトリのモジュールを探して、その中の get_spec をコールして返却する。
+        webapp.lab ディレクトリのモジュールの get_spec の結果を、 LabModuleRegistry のキャッシュから返却する。
 
         Args:
             module_name (str): モジュール名
@@ -24,25 +25,97 @@ class LabModuleSpecService:
 
         Raises:
             ModuleNotFoundError: 指定されたモジュールが見つからない場合
+            LabModuleImportError: モジュールの import に失敗していた場合
             AttributeError: モジュールに get_spec 関数が定義されていない場合
         """
         try:
-            # webapp.lab.{module_name} をインポート
-            module_path = f"lab.{module_name}"
-            module = importlib.import_module(module_path)
-            logger.info(f"Successfully imported module: {module_path}")
+            return get_lab_module_registry().get_spec(module_name)
 
-        except ModuleNotFoundError as e:
+        except ModuleNotFoundError:
             logger.error(f"Module not found: {module_name}")
-            raise ModuleNotFoundError(f"Module '{module_name}' not found in lab directory") from e
+            raise
 
-        try:
-            # get_spec 関数を取得して実行
-            get_spec_func = getattr(module, "get_spec")
-            module_spec = get_spec_func()
-            logger.info(f"Successfully retrieved spec for module: {module_name}")
-            return module_spec
+        except LabModuleImportError as e:
+            logger.error(str(e))
+            raise
 
-        except AttributeError as e:
+        except AttributeError:
             logger.error(f"get_spec function not found in module: {module_name}")
-            raise AttributeError(f"Module '{module_name}' does not have a 'get_spec' function") from e
+            raise
+
+    def get_module_specs(self, module_names: list[str] | None = None) -> list[ModuleSpec]:
+        """
+        複数モジュールの ModuleSpec をまとめて取得する。 get_spec が無いモジュールは含めない。
+        import に失敗しているモジュールも含めない (get_module_import_errors で取れる) 。
+
+        Args:
+            module_names (list[str] | None): モジュール名のリスト。 None なら lab ディレクトリの全モジュール。
+
+        Returns:
+            list[ModuleSpec]: モジュール名順の ModuleSpec のリスト
+
+        Raises:
+            ModuleNotFoundError: 指定されたモジュールが見つからない場合
+            AttributeError: 指定されたモジュールに get_spec 関数が定義されていない場合
+        """
+        registry = get_lab_module_registry()
+        if module_names is None:
+            return [entry.spec for entry in registry.entries() if entry.spec is not None]
+        failed = self.get_module_import_errors(module_names)
+        return [self.get_module_spec(module_name) for module_name in sorted(set(module_names) - set(failed))]
+
+    def get_module_import_errors(self, module_names: list[str] | None = None) -> dict[str, str]:
+        """
+        import に失敗しているモジュールと、そのエラーメッセージ。
+
+        Args:
+            module_names (list[str] | None): モジュール名のリスト。 None なら lab ディレクトリの全モジュール。
+
+        Raises:
+            ModuleNotFoundError: 指定されたモジュールが見つからない場合
+        """
+        registry = get_lab_module_registry()
+        if module_names is None:
+            entries = registry.entries(include_failed=True)
+        else:
+            entries = [registry.lookup(module_name) for module_name in sorted(set(module_names))]
+        return {
+            entry.name: f"Module '{entry.name}' failed to import: {entry.import_error}"
+            for entry in entries
+            if entry.import_error is not None
+        }
+
+    def validate_module_args(self, module_name: str, args: dict[str, Any]) -> dict[str, Any]:
+        """
+        args を ModuleSpec.args の宣言で検証して、型変換・デフォルト値の補完をした args を返す。
+        get_spec が無いモジュールは検証せずにそのまま返す。
+
+        Args:
+            module_name (str): モジュール名
+            args (dict[str, Any]): モジュールに渡す引数
+
+        Returns:
+            dict[str, Any]: main に渡す引数
+
+        Raises:
+            ModuleNotFoundError: 指定されたモジュールが見つからない場合
+            LabModuleImportError: モジュールの import に失敗していた場合
+            LabModuleArgsError: args が宣言に合わない場合
+        """
+        entry = get_lab_module_registry().get(module_name)
+        if entry.args_validator is None:
+            return args
+        return entry.args_validator.validate(args)
+
+    def get_catalog_etag(self, module_names: list[str] | None = None) -> str:
+        """
+        get_module_specs の結果に対応する ETag (強い ETag 、ダブルクォートつき) を返す。
+        lab モジュールのファイルの中身から作るので、どれかが変わるまで同じ値になる。
+
+        Args:
+            module_names (list[str] | None): モジュール名のリスト。 None なら lab ディレクトリの全モジュール。
+
+        Raises:
+            ModuleNotFoundError: 指定されたモジュールが見つからない場合
+        """
+        return f'"{get_lab_module_registry().catalog_version(module_names)}"'
@@ -0,0 +1,370 @@
+"""
+CPU を食う lab モジュールを、 web ワーカーとは別のプロセスで実行するためのプール。
+- ワーカープロセスは最初に使うときにまとめて起動して、使い回す (ウォームプール) 。
+- main が yield したメッセージはパイプで 1 件ずつ親へ返す。
+- 1 回の実行ごとに CPU 時間とメモリの上限をかけられる。超えたワーカーは殺して、新しいものに入れ替える。
+- プロセスの起動・ join は時間がかかることがあるので、イベントループ (lab-runs) の上ではやらない。
+  入れ替えはヘルパースレッドで行い、新しいワーカーができたらプールに戻す。
+
+NOTE: _worker_main 以下はワーカープロセス側で動くので、 Django に依存させないこと。
+"""
+import asyncio
+import importlib
+import logging
+import math
+import multiprocessing
+import os
+import pkgutil
+import resource
+import signal
+import threading
+from functools import partial
+from multiprocessing.connection import Connection
+from multiprocessing.process import BaseProcess
+from typing import Any, AsyncIterator
+
+from lab.run_context import LabRunDeadlineExceeded, RunContext
+from services.lab_module_profiler import LabModuleProfiler
+from shared.channels import BoundedChannel
+
+logger = logging.getLogger(__name__)
+
+# ワーカー → 親 へ送るメッセージの種類。
+_MESSAGE = "message"
+_DONE = "done"
+_ERROR = "error"
+_MEMORY_LIMIT = "memory_limit"
+_PROFILE = "profile"
+_DEADLINE = "deadline"
+
+
+class LabModuleResourceLimitExceeded(Exception):
+    """
+    プロセス分離で実行した lab モジュールが CPU 時間・メモリの上限を超えた (あるいはワーカーが落ちた) ときの例外。
+    """
+
+
+class _LabProcessWorker:
+    """
+    ワーカープロセスひとつと、そこにつながるパイプ。
+    """
+
+    def __init__(self, process: BaseProcess, conn: Connection) -> None:
+        self.process = process
+        self.conn = conn
+
+    def is_alive(self) -> bool:
+        return self.process.is_alive()
+
+    def kill(self) -> None:
+        """
+        プロセスに SIGKILL を送って、終わるのを待つ。
+        NOTE: join で最大 5 秒ブロックするので、イベントループの上では呼ばないこと。
+        """
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+
+class LabProcessPool:
+    """
+    lab モジュールの main を別プロセスで実行するワーカープールクラス。
+    """
+
+    def __init__(self, size: int | None = None, start_method: str | None = None) -> None:
+        self.size = size or os.cpu_count() or 1
+        # NOTE: web ワーカーはスレッドを持っているので、 fork よりも forkserver のほうが安全。
+        if start_method is None:
+            start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self._context = multiprocessing.get_context(start_method)
+        self._idle: BoundedChannel[_LabProcessWorker] | None = None
+        self._start_lock = threading.Lock()
+
+    def start(self) -> None:
+        """
+        ワーカープロセスを起動する。 astream が最初に呼ばれたときにも自動で呼ばれる。
+        NOTE: gunicorn の master で呼ぶと fork 後の全ワーカーで共有されてしまうので、各ワーカーの中で呼ぶこと。
+        """
+        with self._start_lock:
+            if self._idle is not None:
+                return
+            idle: BoundedChannel[_LabProcessWorker] = BoundedChannel(self.size)
+            for _ in range(self.size):
+                idle.put_nowait(self._spawn())
+            self._idle = idle
+            logger.info(f"LabProcessPool started with {self.size} workers")
+
+    async def astream(
+        self,
+        module_name: str,
+        args: dict[str, Any],
+        cpu_time_limit: float | None = None,
+        memory_limit_mb: int | None = None,
+        profiler: LabModuleProfiler | None = None,
+        run_context: bool = False,
+        timeout: float | None = None,
+    ) -> AsyncIterator[str]:
+        """
+        空いているワーカーで lab.{module_name}.main(**args) を実行して、メッセージを 1 件ずつ yield する。
+        パイプがいっぱいになるとワーカーの send が待たされるので、遅いクライアントに対して backpressure がかかる。
+
+        Args:
+            module_name (str): モジュール名
+            args (dict[str, Any]): main に渡す引数
+            cpu_time_limit (float | None): この実行で使える CPU 時間 (秒) 。 None なら無制限。
+            memory_limit_mb (int | None): この実行で追加で確保できるメモリ (MB) 。 None なら無制限。
+            profiler (LabModuleProfiler | None): 渡すとワーカープロセス側でプロファイルして、結果をこれに取り込む。
+            run_context (bool): True ならワーカープロセス側で RunContext を作って、 main の ctx 引数に渡す。
+            timeout (float | None): その RunContext の deadline までの秒数。
+
+        Yields:
+            str: main が yield したメッセージ
+
+        Raises:
+            LabModuleResourceLimitExceeded: 上限を超えた、あるいはワーカーが落ちた場合
+            LabRunDeadlineExceeded: main が ctx.deadline を過ぎた場合
+            RuntimeError: main の中で例外が発生した場合
+        """
+        loop = asyncio.get_running_loop()
+        if self._idle is None:
+            await loop.run_in_executor(None, self.start)
+        assert self._idle is not None
+        worker = await self._idle.aget()
+        while not worker.is_alive():
+            # 前の実行の後で落ちていたワーカー。入れ替えはヘルパースレッドに任せて、別のワーカーを待つ。
+            self._replace_in_background(worker)
+            worker = await self._idle.aget()
+        reusable = False
+        try:
+            worker.conn.send(
+                (module_name, args, cpu_time_limit, memory_limit_mb, profiler is not None, run_context, timeout)
+            )
+
+            while True:
+                await self._wait_readable(worker.conn)
+                try:
+                    kind, payload = worker.conn.recv()
+                except EOFError:
+                    await loop.run_in_executor(None, worker.process.join, 5)
+                    raise self._describe_death(worker, module_name, cpu_time_limit) from None
+
+                if kind == _MESSAGE:
+                    yield payload
+                elif kind == _PROFILE:
+                    assert profiler is not None
+                    profiler.merge(payload)
+                elif kind == _DONE:
+                    reusable = True
+                    return
+                elif kind == _ERROR:
+                    reusable = True
+                    raise RuntimeError(payload)
+                elif kind == _DEADLINE:
+                    reusable = True
+                    raise LabRunDeadlineExceeded(payload)
+                elif kind == _MEMORY_LIMIT:
+                    raise LabModuleResourceLimitExceeded(
+                        f"Module '{module_name}' exceeded the memory limit of {memory_limit_mb} MB and was killed"
+                    )
+        finally:
+            # NOTE: 途中でクライアントが切断した場合もここに来る。
+            #       実行途中のワーカーは止めようがないので殺して入れ替える (ctx.sleep で待っている main も) 。
+            #       ほかの run を止めないように、ここでは待たない。
+            if reusable:
+                self._idle.put_nowait(worker)
+            else:
+                self._replace_in_background(worker)
+
+    def _replace_in_background(self, worker: _LabProcessWorker) -> None:
+        """
+        ワーカーを殺して、新しいワーカーを起動してプールに戻す。ヘルパースレッドで行うので、すぐに返る。
+        """
+        if worker.process.is_alive():
+            # NOTE: SIGKILL を送るだけならブロックしない。すぐに CPU を手放させる。
+            worker.process.kill()
+        threading.Thread(target=self._replace, args=(worker,), name="lab-process-replacer", daemon=True).start()
+
+    def _replace(self, worker: _LabProcessWorker) -> None:
+        assert self._idle is not None
+        worker.kill()
+        try:
+            replacement = self._spawn()
+        except Exception:
+            # NOTE: 起動に失敗しても枠は減らさない。死んだワーカーを戻しておけば、次に使うときにまた入れ替える。
+            logger.exception("Failed to spawn a lab process worker")
+            replacement = worker
+        self._idle.put_nowait(replacement)
+
+    def _spawn(self) -> _LabProcessWorker:
+        parent_conn, child_conn = self._context.Pipe(duplex=True)
+        process = self._context.Process(target=_worker_main, args=(child_conn,), daemon=True, name="lab-process")
+        process.start()
+        child_conn.close()
+        return _LabProcessWorker(process, parent_conn)
+
+    @staticmethod
+    async def _wait_readable(conn: Connection) -> None:
+        """
+        パイプが読めるようになるまで、スレッドを握らずに待つ。
+        """
+        if conn.poll():
+            return
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        loop.add_reader(conn.fileno(), lambda: future.done() or future.set_result(None))
+        try:
+            await future
+        finally:
+            loop.remove_reader(conn.fileno())
+
+    @staticmethod
+    def _describe_death(
+        worker: _LabProcessWorker, module_name: str, cpu_time_limit: float | None
+    ) -> LabModuleResourceLimitExceeded:
+        """
+        落ちたワーカーの終了コードから、例外を作る。 join し終わってから呼ぶこと。
+        """
+        exitcode = worker.process.exitcode
+        if exitcode == -signal.SIGXCPU:
+            return LabModuleResourceLimitExceeded(
+                f"Module '{module_name}' exceeded the CPU time limit of {cpu_time_limit} seconds and was killed"
+            )
+        return LabModuleResourceLimitExceeded(
+            f"Module '{module_name}' worker process died unexpectedly (exitcode={exitcode})"
+        )
+
+
+def _worker_main(conn: Connection) -> None:
+    """
+    ワーカープロセスのエントリポイント。親からジョブを受け取っては実行する、を繰り返す。
+    """
+    # NOTE: Ctrl-C は親プロセスに任せる。
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _preload_lab_modules()
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if not _run_job(conn, *job):
+            return
+
+
+def _preload_lab_modules() -> None:
+    """
+    lab パッケージのモジュールを先に import しておく (ウォームアップ) 。
+    """
+    lab = importlib.import_module("lab")
+    for module_info in pkgutil.iter_modules(lab.__path__):
+        try:
+            importlib.import_module(f"lab.{module_info.name}")
+        except Exception:
+            # 壊れたモジュールは実行時にエラーを返せばよい。
+            pass
+
+
+def _run_job(
+    conn: Connection,
+    module_name: str,
+    args: dict[str, Any],
+    cpu_time_limit: float | None,
+    memory_limit_mb: int | None,
+    profile: bool = False,
+    run_context: bool = False,
+    timeout: float | None = None,
+) -> bool:
+    """
+    ジョブをひとつ実行する。 profile なら、終わったときに (_PROFILE, LabModuleProfiler.export()) も送る。
+    run_context なら、 timeout 秒後が deadline の RunContext を main の ctx 引数に渡す。
+
+    Returns:
+        bool: このワーカーを使い続けてよいなら True
+    """
+    profiler = LabModuleProfiler() if profile else None
+    original_limits = _apply_limits(cpu_time_limit, memory_limit_mb)
+    try:
+        module = importlib.import_module(f"lab.{module_name}")
+        main_func = partial(module.main, ctx=RunContext(timeout)) if run_context else module.main
+        if profiler is not None:
+            main_func = profiler.wrap(main_func)
+        result = main_func(**args)
+        if hasattr(result, "__iter__") and hasattr(result, "__next__"):
+            for message in result:
+                conn.send((_MESSAGE, message))
+        else:
+            conn.send((_MESSAGE, str(result)))
+        _send_profile(conn, profiler)
+        conn.send((_DONE, None))
+        return True
+    except MemoryError:
+        # NOTE: メモリ上限に当たったプロセスは状態が怪しいので、使い捨てる。
+        _restore_limits(original_limits)
+        conn.send((_MEMORY_LIMIT, None))
+        return False
+    except LabRunDeadlineExceeded as e:
+        _send_profile(conn, profiler)
+        conn.send((_DEADLINE, str(e)))
+        return True
+    except Exception as e:
+        _send_profile(conn, profiler)
+        conn.send((_ERROR, str(e)))
+        return True
+    finally:
+        _restore_limits(original_limits)
+
+
+def _send_profile(conn: Connection, profiler: LabModuleProfiler | None) -> None:
+    if profiler is not None:
+        conn.send((_PROFILE, profiler.export()))
+
+
+def _apply_limits(cpu_time_limit: float | None, memory_limit_mb: int | None) -> dict[int, tuple[int, int]]:
+    """
+    この実行の分だけ RLIMIT_CPU / RLIMIT_AS を絞る。
+
+    RLIMIT_CPU はプロセスの累積 CPU 時間にかかるので、今までの使用量 + 上限 を設定する。
+    超えるとカーネルから SIGXCPU が飛んできてプロセスが終了する。
+    RLIMIT_AS も同様に、今のアドレス空間 + 上限 を設定する。超えると MemoryError になる。
+
+    Returns:
+        dict[int, tuple[int, int]]: 元に戻すための、変更前の limit
+    """
+    original_limits: dict[int, tuple[int, int]] = {}
+    if cpu_time_limit is not None:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        soft, hard = resource.getrlimit(resource.RLIMIT_CPU)
+        original_limits[resource.RLIMIT_CPU] = (soft, hard)
+        new_soft = math.ceil(usage.ru_utime + usage.ru_stime + cpu_time_limit)
+        if hard != resource.RLIM_INFINITY:
+            new_soft = min(new_soft, hard)
+        resource.setrlimit(resource.RLIMIT_CPU, (new_soft, hard))
+    if memory_limit_mb is not None:
+        current = _current_address_space_bytes()
+        if current is not None:
+            soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+            original_limits[resource.RLIMIT_AS] = (soft, hard)
+            new_soft = current + memory_limit_mb * 1024 * 1024
+            if hard != resource.RLIM_INFINITY:
+                new_soft = min(new_soft, hard)
+            resource.setrlimit(resource.RLIMIT_AS, (new_soft, hard))
+    return original_limits
+
+
+def _restore_limits(original_limits: dict[int, tuple[int, int]]) -> None:
+    for limit, value in original_limits.items():
+        resource.setrlimit(limit, value)
+    original_limits.clear()
+
+
+def _current_address_space_bytes() -> int | None:
+    """
+    今のプロセスの仮想メモリサイズ。 /proc が無い環境では None 。
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE")
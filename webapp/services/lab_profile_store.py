@@ -0,0 +1,95 @@
+"""
+プロファイルした lab モジュールの実行結果 (services.lab_module_profiler) を、リクエストIDごとのファイルに残すストア。
+GET /api/app/lab/profiles/<requestId> でダウンロードできる。
+ファイルに置くので、 gunicorn の別のワーカーで実行した run のプロファイルも取れる。
+"""
+import json
+import logging
+import os
+import re
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+
+from services.lab_module_profiler import LabModuleProfiler
+
+logger = logging.getLogger(__name__)
+
+# 保存するファイルの種類 → 拡張子。
+PROFILE_FORMATS = {
+    # python -m pstats, snakeviz で開ける cProfile の結果。
+    "pstats": ".pstats",
+    # flamegraph.pl, speedscope に渡せる collapsed 形式のスタック。
+    "collapsed": ".collapsed",
+    # yield ごとの wall / CPU 時間と、時間のかかった関数の一覧。
+    "summary": ".json",
+}
+
+# NOTE: リクエストIDはファイル名になるので、パスとして危ない文字は受け付けない。
+_REQUEST_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+class LabProfileStore:
+    """
+    リクエストIDごとに、プロファイルのファイルを directory へ保存するクラス。
+    max_profiles を超えたら古いものから消す。
+    """
+
+    def __init__(self, directory: str | os.PathLike, max_profiles: int = 50, sampling_interval_ms: float = 5) -> None:
+        self.directory = Path(directory)
+        self.max_profiles = max_profiles
+        self.sampling_interval_ms = sampling_interval_ms
+
+    def create_profiler(self) -> LabModuleProfiler:
+        return LabModuleProfiler(sampling_interval=self.sampling_interval_ms / 1000)
+
+    def save(self, request_id: str, module_name: str, profiler: LabModuleProfiler) -> None:
+        """
+        Raises:
+            ValueError: リクエストIDがファイル名として使えない場合
+        """
+        self._check_request_id(request_id)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        summary = {"requestId": request_id, "module": module_name, **profiler.summary()}
+        self._path(request_id, "pstats").write_bytes(profiler.pstats_bytes())
+        self._path(request_id, "collapsed").write_text(profiler.collapsed_stacks())
+        self._path(request_id, "summary").write_text(json.dumps(summary))
+        logger.info(f"Lab module profile saved: {request_id} ({module_name})")
+        self._prune()
+
+    def path(self, request_id: str, profile_format: str) -> Path | None:
+        """
+        保存済みのファイルのパス。無ければ None 。
+
+        Raises:
+            ValueError: リクエストIDがファイル名として使えない、あるいは知らない形式の場合
+        """
+        self._check_request_id(request_id)
+        if profile_format not in PROFILE_FORMATS:
+            raise ValueError(f"Unknown profile format: '{profile_format}'")
+        path = self._path(request_id, profile_format)
+        return path if path.exists() else None
+
+    def _path(self, request_id: str, profile_format: str) -> Path:
+        return self.directory / f"{request_id}{PROFILE_FORMATS[profile_format]}"
+
+    @staticmethod
+    def _check_request_id(request_id: str) -> None:
+        if not _REQUEST_ID_PATTERN.fullmatch(request_id):
+            raise ValueError(f"Invalid request id: '{request_id}'")
+
+    def _prune(self) -> None:
+        summaries = sorted(self.directory.glob("*.json"), key=lambda path: path.stat().st_mtime)
+        for summary in summaries[: max(0, len(summaries) - self.max_profiles)]:
+            for extension in PROFILE_FORMATS.values():
+                summary.with_suffix(extension).unlink(missing_ok=True)
+
+
+@lru_cache(maxsize=None)
+def get_lab_profile_store() -> LabProfileStore:
+    """
+    プロセスで共有する LabProfileStore を返す。設定は settings.LAB_PROFILES 。
+    """
+    config = getattr(settings, "LAB_PROFILES", {})
+    return LabProfileStore(**config)
@@ -0,0 +1,270 @@
+"""
+決定的な (同じ引数なら同じメッセージを返す) lab モジュールの結果をメモ化するキャッシュ。
+- キーはモジュール名・モジュールファイルのバージョン (sha256) ・ args を正規化した JSON のハッシュ。
+  モジュールを書き換えればバージョンが変わるので、古い結果は使われない。
+- 件数 (LRU) ・合計サイズ・ TTL の上限つき。
+- 同じキーの実行が同時に来たら、最初のひとつだけ実行して、残りはその実行に相乗りする (single-flight) 。
+  実行は呼び出し元とは別のタスクで回るので、最初に呼んだストリームが閉じられても、相乗りしたストリームは最後まで受け取れる。
+  読み手が全員いなくなったときだけ、実行をキャンセルする。
+test: services.tests.test_lab_result_cache
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import aclosing
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, AsyncGenerator, AsyncIterator, Callable
+
+from django.conf import settings
+
+from shared.channels import BoundedChannel, ChannelClosed
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _CachedResult:
+    messages: list[str]
+    size: int
+    # time.monotonic() 。
+    expires_at: float
+
+
+class _Flight:
+    """
+    実行中のキーひとつ分。
+    実行しているタスク (task) が受け取ったメッセージを、読み手 (最初に呼んだストリームも含む) 全員へ配る。
+    """
+
+    def __init__(self, max_bytes: int, queue_size: int) -> None:
+        self.max_bytes = max_bytes
+        self.queue_size = queue_size
+        self.messages: list[str] = []
+        self.size = 0
+        # max_bytes を超えたら記録をやめる。キャッシュにも載せないし、途中から相乗りもさせない。
+        self.recording = True
+        self.error: BaseException | None = None
+        # produce() を回しているタスク。
+        self.task: asyncio.Task | None = None
+        self._finished = False
+        # 読み手が全員いなくなって、実行をキャンセルしたかどうか。
+        self._abandoned = False
+        self._followers: set[BoundedChannel[str]] = set()
+        self._lock = threading.Lock()
+
+    def follow(self) -> tuple[list[str], BoundedChannel[str]] | None:
+        """
+        ここまでのメッセージと、以降のメッセージが届くチャンネルを返す。相乗りできなければ None 。
+        """
+        with self._lock:
+            if not self.recording or self._finished or self._abandoned:
+                return None
+            channel: BoundedChannel[str] = BoundedChannel(self.queue_size)
+            self._followers.add(channel)
+            return list(self.messages), channel
+
+    def unfollow(self, channel: BoundedChannel[str]) -> None:
+        """
+        読み手が抜ける。最後の読み手なら、実行をキャンセルする。
+        """
+        with self._lock:
+            self._followers.discard(channel)
+            if self._followers or self._finished:
+                return
+            self._abandoned = True
+            task = self.task
+        if task is not None:
+            # NOTE: 読み手はほかのスレッドのイベントループにいることもあるので、タスクのループに頼む。
+            task.get_loop().call_soon_threadsafe(task.cancel)
+
+    async def publish(self, message: str) -> None:
+        with self._lock:
+            if self.recording:
+                self.size += len(str(message))
+                if self.size > self.max_bytes:
+                    self.recording = False
+                    self.messages.clear()
+                else:
+                    self.messages.append(message)
+            followers = list(self._followers)
+        for channel in followers:
+            try:
+                # NOTE: 読み手が遅ければ、実行のほうを待たせる (backpressure) 。
+                await channel.aput(message)
+            except ChannelClosed:
+                with self._lock:
+                    self._followers.discard(channel)
+
+    def finish(self, error: BaseException | None = None) -> None:
+        with self._lock:
+            self._finished = True
+            self.error = error
+            followers, self._followers = self._followers, set()
+        for channel in followers:
+            channel.close()
+
+
+class LabResultCache:
+    """
+    lab モジュールの結果 (yield されたメッセージの列) のキャッシュクラス。
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        max_bytes: int = 16 * 1024 * 1024,
+        ttl: float = 600.0,
+        follower_queue_size: int = 64,
+    ) -> None:
+        """
+        Args:
+            max_entries (int): キャッシュしておく結果の最大件数。超えたら最近使われていないものから捨てる。
+            max_bytes (int): キャッシュしておくメッセージの合計サイズ (文字数) の上限。
+            ttl (float): ModuleSpec.cache_ttl が無いときの、結果を使い回す秒数。
+            follower_queue_size (int): 相乗りしたストリームに、送りきれていないメッセージをいくつまで溜めるか。
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.follower_queue_size = follower_queue_size
+        self._results: OrderedDict[str, _CachedResult] = OrderedDict()
+        self._size = 0
+        self._flights: dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(module_name: str, version: str, args: dict[str, Any]) -> str:
+        """
+        モジュール名・バージョン・ args からキーを作る。 args のキーの順番や空白の違いは同じキーになる。
+        """
+        canonical = json.dumps([module_name, version, args], sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def get(self, key: str) -> list[str] | None:
+        """
+        キャッシュされた結果を返す。無い (あるいは期限切れ) なら None 。
+        """
+        with self._lock:
+            result = self._results.get(key)
+            if result is None:
+                return None
+            if result.expires_at <= time.monotonic():
+                self._remove_locked(key)
+                return None
+            self._results.move_to_end(key)
+            return result.messages
+
+    def set(self, key: str, messages: list[str], ttl: float | None = None) -> None:
+        """
+        結果をキャッシュする。ひとつで max_bytes を超える結果はキャッシュしない。
+        """
+        size = sum(len(str(message)) for message in messages)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._results:
+                self._remove_locked(key)
+            self._results[key] = _CachedResult(
+                list(messages), size, time.monotonic() + (self.ttl if ttl is None else ttl)
+            )
+            self._size += size
+            while len(self._results) > self.max_entries or self._size > self.max_bytes:
+                self._remove_locked(next(iter(self._results)))
+
+    async def astream(
+        self, key: str, produce: Callable[[], AsyncGenerator[str, None]], ttl: float | None = None
+    ) -> AsyncIterator[str]:
+        """
+        キャッシュがあればそれを、無ければ produce() を実行してメッセージを yield する。
+        同じキーを実行中なら、新しく実行せずにその実行のメッセージを受け取る。
+        NOTE: produce() は別のタスクで回る。このストリームが閉じられても、ほかの読み手がいれば実行は止まらない。
+
+        Args:
+            key (str): make_key で作ったキー
+            produce (Callable[[], AsyncGenerator[str, None]]): 実際にモジュールを実行する関数
+            ttl (float | None): 結果を使い回す秒数。 None ならデフォルト。
+        """
+        messages = self.get(key)
+        if messages is not None:
+            logger.info(f"Lab result cache hit: {key}")
+            for message in messages:
+                yield message
+            return
+
+        with self._lock:
+            flight = self._flights.get(key)
+            followed = flight.follow() if flight is not None else None
+            started = followed is None
+            if started:
+                flight = self._flights[key] = _Flight(self.max_bytes, self.follower_queue_size)
+                # NOTE: タスクより先に読み手になっておくので、最初のメッセージから受け取れる。
+                followed = flight.follow()
+
+        assert flight is not None and followed is not None
+        if started:
+            logger.info(f"Lab result cache miss: {key}")
+            flight.task = asyncio.ensure_future(self._fly(key, flight, produce, ttl))
+        else:
+            logger.info(f"Lab result cache joined an in-flight execution: {key}")
+        async for message in self._afollow(flight, *followed):
+            yield message
+
+    async def _fly(
+        self, key: str, flight: _Flight, produce: Callable[[], AsyncGenerator[str, None]], ttl: float | None
+    ) -> None:
+        """
+        produce() を最後まで回して、メッセージを flight の読み手に配る。読み手が全員いなくなったらキャンセルされる。
+        """
+        error: BaseException | None = None
+        try:
+            async with aclosing(produce()) as messages:
+                async for message in messages:
+                    await flight.publish(message)
+            # NOTE: LabModuleExecuteSSEService はモジュール内の例外を "ERROR: ..." メッセージにして返す。
+            #       失敗した結果を使い回さないよう、それが混ざっていたらキャッシュしない。
+            if flight.recording and not any(str(message).startswith("ERROR: ") for message in flight.messages):
+                self.set(key, flight.messages, ttl)
+        except asyncio.CancelledError:
+            error = RuntimeError("The shared lab module execution was aborted")
+            raise
+        except Exception as e:
+            # NOTE: 例外は読み手がそれぞれ raise する (_afollow) 。
+            error = e
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.finish(error)
+
+    @staticmethod
+    async def _afollow(flight: _Flight, messages: list[str], channel: BoundedChannel[str]) -> AsyncIterator[str]:
+        try:
+            for message in messages:
+                yield message
+            while True:
+                try:
+                    yield await channel.aget()
+                except ChannelClosed:
+                    break
+        finally:
+            channel.close()
+            flight.unfollow(channel)
+        if flight.error is not None:
+            raise flight.error
+
+    def _remove_locked(self, key: str) -> None:
+        self._size -= self._results.pop(key).size
+
+
+@lru_cache(maxsize=None)
+def get_lab_result_cache() -> LabResultCache:
+    """
+    プロセスで共有する LabResultCache を返す。設定は settings.LAB_RESULT_CACHE 。
+    """
+    config = getattr(settings, "LAB_RESULT_CACHE", {})
+    return LabResultCache(**config)
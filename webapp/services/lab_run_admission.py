@@ -0,0 +1,255 @@
+"""
+lab モジュールの run を始めてよいかを決める、アドミッションコントロール。
+ひとつのスクリプトが run を始めまくって、全ワーカーを埋めてしまうのを防ぐ。
+- クライアントごと・モジュールごとのトークンバケット。超えたら 429 (Retry-After は次のトークンまでの秒数) 。
+- 同時に実行できる run の数の上限と、空きを待つ run の上限つきの待ち行列。待ち行列もいっぱいなら 503 。
+  待ち行列に入った run は、 SSE のストリームを開いたまま、 run のイベントループの上で順番を待つ (スレッドを握らない) 。
+どちらも run を始める前に、速く・安く断る。止まったストリームが溜まっていくよりずっといい。
+
+settings.LAB_RUN_ADMISSION で設定する。
+test: services.tests.test_lab_run_admission
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import CancelledError, Future, InvalidStateError
+from functools import lru_cache
+
+from django.conf import settings
+
+from shared.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# 覚えておくクライアント・モジュールの数の上限。超えたら、トークンが満タンに戻っているものを忘れる。
+_MAX_BUCKETS = 10000
+
+REJECTED = registry.counter("lab_run_admission_rejected_total", "Lab runs rejected by admission control.", ("reason",))
+QUEUE_WAIT = registry.histogram("lab_run_queue_wait_seconds", "Time lab runs wait for a free slot.")
+
+
+class LabRunRejected(Exception):
+    """
+    run を始められなかった。 status_code は 429 (レート制限) か 503 (混雑) 。
+    """
+
+    def __init__(self, status_code: int, reason: str, detail: str, retry_after: float) -> None:
+        super().__init__(detail)
+        self.status_code = status_code
+        self.reason = reason
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class _TokenBuckets:
+    """
+    キーごとのトークンバケット。 1 秒あたり rate 個ずつ、 burst 個まで貯まる。
+    NOTE: shared.logging_filters.RateLimitFilter と同じ作り。
+    """
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        # キー → (トークン数, 最後に補充した時刻)
+        self._buckets: dict[str, tuple[float, float]] = {}
+
+    def take(self, key: str, now: float) -> float:
+        """
+        トークンをひとつ取る。取れたら 0 、取れなければ次のトークンが貯まるまでの秒数を返す。
+        NOTE: 呼び出し元のロックの中で呼ぶこと。
+        """
+        tokens, updated_at = self._buckets.get(key, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - updated_at) * self.rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / self.rate
+        self._buckets[key] = (tokens - 1, now)
+        if len(self._buckets) > _MAX_BUCKETS:
+            full = float(self.burst) - 1
+            self._buckets = {
+                k: bucket for k, bucket in self._buckets.items() if bucket[0] + (now - bucket[1]) * self.rate < full
+            }
+        return 0.0
+
+    def give_back(self, key: str) -> None:
+        """
+        take したトークンを返す (ほかの理由で断ったときに、レート制限のほうは消費させないため) 。
+        """
+        tokens, updated_at = self._buckets.get(key, (float(self.burst), 0.0))
+        self._buckets[key] = (min(float(self.burst), tokens + 1), updated_at)
+
+
+class LabRunTicket:
+    """
+    admit で受け取る、 run ひとつ分の実行枠 (あるいは待ち行列の順番) 。
+    run のイベントループで wait してから実行して、終わったら必ず release する。
+    """
+
+    def __init__(self, admission: "LabRunAdmission") -> None:
+        self._admission = admission
+        # 実行枠がもらえたら結果が入る。
+        # NOTE: admit はリクエストのスレッド、 wait は run のイベントループなので、 concurrent.futures の Future 。
+        self._granted: Future[None] = Future()
+        self._released = False
+
+    @property
+    def granted(self) -> bool:
+        return self._granted.done() and not self._granted.cancelled()
+
+    async def wait(self) -> None:
+        """
+        実行枠が空くまで待つ。
+
+        Raises:
+            LabRunRejected: queue_timeout 秒待っても空かなかった場合 (503)
+        """
+        if self.granted:
+            return
+        started_at = time.monotonic()
+        timeout = self._admission.queue_timeout
+        try:
+            await asyncio.wait_for(asyncio.wrap_future(self._granted), timeout)
+        except asyncio.TimeoutError:
+            # NOTE: ちょうど同時に枠が渡されていたら、それを使う。
+            if not self._admission._forget(self):
+                return
+            REJECTED.inc(reason="queue_timeout")
+            logger.warning(f"Lab run gave up waiting for a free slot after {timeout} seconds")
+            raise LabRunRejected(
+                503, "queue_timeout", f"No free lab run slot within {timeout} seconds.", self._admission.retry_after
+            ) from None
+        finally:
+            QUEUE_WAIT.observe(time.monotonic() - started_at)
+
+    def release(self) -> None:
+        """
+        実行枠を返す (待ち行列にいるなら抜ける) 。何回呼んでもよい。
+        """
+        if self._released:
+            return
+        self._released = True
+        self._admission._release(self)
+
+
+class LabRunAdmission:
+    """
+    クライアントごと・モジュールごとのレート制限と、同時実行数の上限・待ち行列で run の開始を絞るクラス。
+    None を渡した制限はかけない。
+    """
+
+    def __init__(
+        self,
+        client_rate: float | None = 1.0,
+        client_burst: int = 10,
+        module_rate: float | None = None,
+        module_burst: int = 20,
+        max_concurrent_runs: int | None = 32,
+        max_queued_runs: int = 64,
+        queue_timeout: float = 30.0,
+        retry_after: float = 5.0,
+    ) -> None:
+        self.max_concurrent_runs = max_concurrent_runs
+        self.max_queued_runs = max_queued_runs
+        self.queue_timeout = queue_timeout
+        # 混雑で断ったときに返す Retry-After (秒) 。
+        self.retry_after = retry_after
+        self._client_buckets = _TokenBuckets(client_rate, client_burst) if client_rate else None
+        self._module_buckets = _TokenBuckets(module_rate, module_burst) if module_rate else None
+        self._running = 0
+        self._queue: deque[LabRunTicket] = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    def admit(self, client_id: str, module_name: str) -> LabRunTicket:
+        """
+        run を始めてよいか判定して、実行枠 (空いていなければ待ち行列の順番) を返す。
+
+        Args:
+            client_id (str): クライアントを見分けるキー。ユーザー ID や IP アドレス。
+            module_name (str): モジュール名
+
+        Raises:
+            LabRunRejected: レート制限を超えた (429) か、待ち行列もいっぱい (503) の場合
+        """
+        now = time.monotonic()
+        with self._lock:
+            # NOTE: 混雑で断るときは、レート制限のトークンは消費させない。
+            taken: list[tuple[_TokenBuckets, str]] = []
+            for buckets, key, reason in (
+                (self._client_buckets, client_id, "client_rate"),
+                (self._module_buckets, module_name, "module_rate"),
+            ):
+                if buckets is None:
+                    continue
+                wait = buckets.take(key, now)
+                if wait:
+                    for taken_buckets, taken_key in taken:
+                        taken_buckets.give_back(taken_key)
+                    REJECTED.inc(reason=reason)
+                    raise LabRunRejected(429, reason, "Too many lab runs, slow down.", wait)
+                taken.append((buckets, key))
+
+            ticket = LabRunTicket(self)
+            if self.max_concurrent_runs is None or (self._running < self.max_concurrent_runs and not self._queue):
+                self._running += 1
+                ticket._granted.set_result(None)
+            elif len(self._queue) < self.max_queued_runs:
+                self._queue.append(ticket)
+            else:
+                for taken_buckets, taken_key in taken:
+                    taken_buckets.give_back(taken_key)
+                REJECTED.inc(reason="queue_full")
+                raise LabRunRejected(503, "queue_full", "Too many lab runs in progress.", self.retry_after)
+        return ticket
+
+    def _release(self, ticket: LabRunTicket) -> None:
+        with self._lock:
+            if not ticket.granted:
+                self._forget_locked(ticket)
+                return
+            self._running -= 1
+            # 空いた枠を、待ち行列の先頭から (待つのをやめたものは飛ばして) 渡す。
+            while self._queue:
+                waiting = self._queue.popleft()
+                try:
+                    waiting._granted.set_result(None)
+                except (InvalidStateError, CancelledError):
+                    continue
+                self._running += 1
+                break
+
+    def _forget(self, ticket: LabRunTicket) -> bool:
+        """
+        待ち行列から抜ける。もう枠をもらっていたら何もせずに False 。
+        """
+        with self._lock:
+            if ticket.granted:
+                return False
+            self._forget_locked(ticket)
+            return True
+
+    def _forget_locked(self, ticket: LabRunTicket) -> None:
+        try:
+            self._queue.remove(ticket)
+        except ValueError:
+            pass
+        ticket._granted.cancel()
+
+
+@lru_cache(maxsize=None)
+def get_lab_run_admission() -> LabRunAdmission:
+    """
+    プロセスで共有する LabRunAdmission を返す。設定は settings.LAB_RUN_ADMISSION 。
+    NOTE: 上限はワーカーのプロセスごと。 gunicorn の複数ワーカーなら、全体ではワーカー数倍になる。
+    """
+    config = getattr(settings, "LAB_RUN_ADMISSION", {})
+    return LabRunAdmission(**config)
@@ -0,0 +1,284 @@
+"""
+同じホストの web ワーカー (gunicorn の複数ワーカーなど) で lab の run を共有するための、
+Unix ドメインソケットのブローカー。
+Redis などの外部サービスは要らない。 python manage.py run_lab_broker で起動する。
+
+- run を実行しているワーカーは、フレームをブローカーへ publish する (実行は 1 run につき 1 回のまま) 。
+- ほかのワーカーに来た GET /api/app/lab/runs/<runId> は、ブローカーから subscribe して流す。
+- ブローカーも run ごとにリプレイバッファを持つので、 Last-Event-ID での再接続はどのワーカーに来ても OK 。
+
+プロトコル:
+- クライアントは最初に 1 行の JSON (リクエスト) を送る。 op は "publish" / "subscribe" / "lookup" 。
+- ブローカーは 1 行の JSON ({"ok": true} など) で答える。
+- フレームは (event_id: uint64, length: uint32) のヘッダ + StreamFrame の data (JSON) 。 event_id = 0 は run の終わり。
+test: services.tests.test_lab_run_broker
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import struct
+import time
+from typing import Any, AsyncIterator
+
+from services.lab_run_replay_buffer import LabRunFrame, LabRunReplayBuffer
+from shared.channels import BoundedChannel, ChannelClosed, ChannelFull
+from shared.stream_formatters import StreamFrame
+
+logger = logging.getLogger(__name__)
+
+_FRAME_HEADER = struct.Struct(">QI")
+# run の終わりを表すフレーム。 event id は 1 から始まるので 0 は使われない。
+_END_OF_RUN = 0
+
+
+async def _write_frame(writer: asyncio.StreamWriter, event_id: int, data: bytes) -> None:
+    writer.write(_FRAME_HEADER.pack(event_id, len(data)) + data)
+    await writer.drain()
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> tuple[int, bytes] | None:
+    """
+    フレームをひとつ読む。 run の終わり、あるいは接続が切れたら None 。
+    """
+    try:
+        event_id, length = _FRAME_HEADER.unpack(await reader.readexactly(_FRAME_HEADER.size))
+        data = await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        return None
+    if event_id == _END_OF_RUN:
+        return None
+    return event_id, data
+
+
+def _encode_line(payload: dict[str, Any]) -> bytes:
+    return json.dumps(payload).encode() + b"\n"
+
+
+class _BrokerRun:
+    """
+    ブローカーが持っている run ひとつ分。
+    NOTE: ブローカーはひとつのイベントループで動くので、ロックは要らない。
+    """
+
+    def __init__(self, replay_buffer: LabRunReplayBuffer, subscriber_queue_size: int) -> None:
+        self.replay_buffer = replay_buffer
+        self.subscriber_queue_size = subscriber_queue_size
+        self.finished_at: float | None = None
+        self._subscribers: set[BoundedChannel[LabRunFrame]] = set()
+
+    def publish(self, frame: LabRunFrame) -> None:
+        self.replay_buffer.append(frame)
+        for channel in list(self._subscribers):
+            try:
+                channel.put_nowait(frame)
+            except ChannelFull:
+                # NOTE: 遅い購読者は切断する。 Last-Event-ID で再接続すれば追いつける。
+                logger.warning("Slow subscriber of lab run broker, disconnecting it")
+                channel.close()
+                self._subscribers.discard(channel)
+            except ChannelClosed:
+                self._subscribers.discard(channel)
+
+    def finish(self) -> None:
+        self.finished_at = time.monotonic()
+        for channel in self._subscribers:
+            channel.close()
+        self._subscribers.clear()
+
+    def subscribe(self, last_event_id: int | None) -> tuple[list[LabRunFrame], BoundedChannel[LabRunFrame]]:
+        channel: BoundedChannel[LabRunFrame] = BoundedChannel(self.subscriber_queue_size)
+        frames = self.replay_buffer.frames_after(last_event_id)
+        if self.finished_at is None:
+            self._subscribers.add(channel)
+        else:
+            channel.close()
+        return frames, channel
+
+    def unsubscribe(self, channel: BoundedChannel[LabRunFrame]) -> None:
+        self._subscribers.discard(channel)
+
+
+class LabRunBroker:
+    """
+    ブローカー本体。 Unix ドメインソケットで publish / subscribe を受け付ける。
+    """
+
+    def __init__(
+        self,
+        socket_path: str,
+        replay_buffer_max_frames: int = 1000,
+        replay_buffer_max_bytes: int = 1024 * 1024,
+        replay_buffer_ttl: float | None = 300.0,
+        finished_run_ttl: float = 300.0,
+        subscriber_queue_size: int = 64,
+    ) -> None:
+        self.socket_path = socket_path
+        self.replay_buffer_max_frames = replay_buffer_max_frames
+        self.replay_buffer_max_bytes = replay_buffer_max_bytes
+        self.replay_buffer_ttl = replay_buffer_ttl
+        self.finished_run_ttl = finished_run_ttl
+        self.subscriber_queue_size = subscriber_queue_size
+        self._runs: dict[str, _BrokerRun] = {}
+
+    async def serve_forever(self) -> None:
+        """
+        ソケットを開いて、止められるまで受け付ける。
+        """
+        server = await self.start()
+        async with server:
+            await server.serve_forever()
+
+    async def start(self) -> asyncio.AbstractServer:
+        # NOTE: 前回の起動で残ったソケットファイルがあると bind できない。
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        # 同じユーザー・グループのワーカーだけがつなげるようにしておく。
+        os.chmod(self.socket_path, 0o660)
+        logger.info(f"Lab run broker listening on {self.socket_path}")
+        return server
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request = json.loads(await reader.readline() or b"{}")
+            op = request.get("op")
+            self._sweep()
+            if op == "publish":
+                await self._handle_publish(request["run_id"], reader, writer)
+            elif op == "subscribe":
+                await self._handle_subscribe(request["run_id"], request.get("last_event_id"), writer)
+            elif op == "lookup":
+                writer.write(_encode_line({"ok": request["run_id"] in self._runs}))
+                await writer.drain()
+            else:
+                writer.write(_encode_line({"ok": False, "error": f"Unknown op: {op}"}))
+                await writer.drain()
+        except (ConnectionError, ValueError, KeyError) as e:
+            logger.warning(f"Lab run broker connection error: {e}")
+        finally:
+            writer.close()
+
+    async def _handle_publish(self, run_id: str, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        run = self._runs[run_id] = _BrokerRun(
+            LabRunReplayBuffer(self.replay_buffer_max_frames, self.replay_buffer_max_bytes, self.replay_buffer_ttl),
+            self.subscriber_queue_size,
+        )
+        logger.info(f"Lab run published to broker: {run_id}")
+        try:
+            writer.write(_encode_line({"ok": True}))
+            await writer.drain()
+            while (frame := await _read_frame(reader)) is not None:
+                event_id, data = frame
+                run.publish(LabRunFrame(event_id, StreamFrame(data, event_id=event_id), time.monotonic()))
+        finally:
+            # NOTE: publish していたワーカーが落ちた場合もここに来る。購読者のストリームは終わる。
+            run.finish()
+
+    async def _handle_subscribe(self, run_id: str, last_event_id: int | None, writer: asyncio.StreamWriter) -> None:
+        run = self._runs.get(run_id)
+        writer.write(_encode_line({"ok": run is not None}))
+        await writer.drain()
+        if run is None:
+            return
+
+        frames, channel = run.subscribe(last_event_id)
+        try:
+            for frame in frames:
+                await _write_frame(writer, frame.event_id, frame.stream_frame.data)
+            while True:
+                try:
+                    frame = await channel.aget()
+                except ChannelClosed:
+                    break
+                # NOTE: run がまだ last_event_id まで進んでいないうちに再接続されたら、そこまではライブでも送らない。
+                if last_event_id is None or frame.event_id > last_event_id:
+                    await _write_frame(writer, frame.event_id, frame.stream_frame.data)
+            await _write_frame(writer, _END_OF_RUN, b"")
+        finally:
+            run.unsubscribe(channel)
+            channel.close()
+
+    def _sweep(self) -> None:
+        now = time.monotonic()
+        for run_id, run in list(self._runs.items()):
+            if run.finished_at is not None and now - run.finished_at > self.finished_run_ttl:
+                del self._runs[run_id]
+
+
+class LabRunBrokerPublisher:
+    """
+    run を実行しているワーカーから、ブローカーへフレームを送るクライアント。
+    """
+
+    def __init__(self, writer: asyncio.StreamWriter) -> None:
+        self._writer = writer
+
+    @classmethod
+    async def open(cls, socket_path: str, run_id: str) -> "LabRunBrokerPublisher":
+        """
+        Raises:
+            OSError: ブローカーにつなげなかった場合
+        """
+        reader, writer = await asyncio.open_unix_connection(socket_path)
+        writer.write(_encode_line({"op": "publish", "run_id": run_id}))
+        await writer.drain()
+        # ブローカーが run を登録し終わるのを待つ。
+        if not json.loads(await reader.readline() or b"{}").get("ok"):
+            writer.close()
+            raise ConnectionError(f"Lab run broker refused to publish run {run_id}")
+        return cls(writer)
+
+    async def send(self, event_id: int, data: bytes) -> None:
+        await _write_frame(self._writer, event_id, data)
+
+    async def aclose(self) -> None:
+        try:
+            await _write_frame(self._writer, _END_OF_RUN, b"")
+        finally:
+            self._writer.close()
+
+
+class RemoteLabRun:
+    """
+    ほかのワーカーで実行中の run 。 ActiveLabRun と同じように astream で購読できる。
+    """
+
+    def __init__(self, socket_path: str, run_id: str) -> None:
+        self.socket_path = socket_path
+        self.run_id = run_id
+
+    @classmethod
+    def lookup(cls, socket_path: str, run_id: str, timeout: float = 1.0) -> "RemoteLabRun | None":
+        """
+        ブローカーに run があるか聞く。無い、あるいはブローカーにつなげなければ None 。
+        NOTE: view から同期で呼ぶので、 asyncio ではなく普通のソケットを使う。
+        """
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(timeout)
+                sock.connect(socket_path)
+                sock.sendall(_encode_line({"op": "lookup", "run_id": run_id}))
+                response = json.loads(sock.makefile("rb").readline() or b"{}")
+        except (OSError, ValueError) as e:
+            logger.warning(f"Lab run broker lookup failed: {e}")
+            return None
+        return cls(socket_path, run_id) if response.get("ok") else None
+
+    async def astream(self, last_event_id: int | None = None) -> AsyncIterator[StreamFrame]:
+        """
+        last_event_id の続きから、 run が終わるまでフレームを yield する。
+        NOTE: ブローカーは data (JSON) しか運ばないので、 payload は無い (MessagePack で送るときはデコードする) 。
+        """
+        reader, writer = await asyncio.open_unix_connection(self.socket_path)
+        try:
+            writer.write(_encode_line({"op": "subscribe", "run_id": self.run_id, "last_event_id": last_event_id}))
+            await writer.drain()
+            if not json.loads(await reader.readline() or b"{}").get("ok"):
+                return
+            while (frame := await _read_frame(reader)) is not None:
+                event_id, data = frame
+                yield StreamFrame(data, event_id=event_id)
+        finally:
+            writer.close()
@@ -0,0 +1,84 @@
+"""
+DB に残した lab モジュールの run の履歴 (app.models.LabRun, LabRunEvent) を引くサービス。
+書き込みは services.lab_run_recorder 。
+test: services.tests.test_lab_run_recorder
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.db.models import Q
+
+from app.models import LabRun, LabRunEvent
+
+
+class LabRunHistoryService:
+    """
+    run の履歴を、新しい順に keyset ページングで返すサービスクラス。
+    NOTE: OFFSET を使わず、前のページの最後の (started_at, id) より後ろだけを引く。
+          何ページ目でもインデックス (LabRun.Meta.indexes) を先頭から limit 件なめるだけで済み、
+          途中で run が増えてもページがずれない。
+    """
+
+    def list_runs(
+        self,
+        module_name: str | None = None,
+        status: str | None = None,
+        cursor: str | None = None,
+        limit: int = 50,
+    ) -> tuple[list[LabRun], str | None]:
+        """
+        run を新しい順に limit 件返す。
+
+        Args:
+            module_name (str | None): モジュール名で絞り込む。
+            status (str | None): LabRun.Status の値で絞り込む。
+            cursor (str | None): 前のページで返した next_cursor 。 None なら最初のページ。
+            limit (int): 1 ページの件数
+
+        Returns:
+            tuple[list[LabRun], str | None]: run のリストと、次のページの cursor (最後のページなら None)
+
+        Raises:
+            ValueError: cursor が壊れている場合
+        """
+        runs = LabRun.objects.order_by("-started_at", "-id")
+        if module_name is not None:
+            runs = runs.filter(module=module_name)
+        if status is not None:
+            runs = runs.filter(status=status)
+        if cursor is not None:
+            started_at, run_pk = _decode_cursor(cursor)
+            runs = runs.filter(Q(started_at__lt=started_at) | Q(started_at=started_at, id__lt=run_pk))
+
+        # NOTE: 1 件多く引いて、次のページがあるかを COUNT 無しで判定する。
+        page = list(runs[: limit + 1])
+        if len(page) <= limit:
+            return page, None
+        page = page[:limit]
+        return page, _encode_cursor(page[-1])
+
+    def get_run(self, run_id: str) -> LabRun | None:
+        return LabRun.objects.filter(run_id=run_id).first()
+
+    def list_events(self, run_id: str, after_event_id: int = 0, limit: int = 500) -> list[LabRunEvent]:
+        """
+        run のフレームを event id 順に、 after_event_id より後ろから limit 件返す。
+        """
+        return list(
+            LabRunEvent.objects.filter(run_id=run_id, event_id__gt=after_event_id).order_by("event_id")[:limit]
+        )
+
+
+def _encode_cursor(run: LabRun) -> str:
+    payload = json.dumps([run.started_at.isoformat(), run.pk], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        started_at, run_pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(started_at), int(run_pk)
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: '{cursor}'") from e
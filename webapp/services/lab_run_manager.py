@@ -0,0 +1,611 @@
+"""
+lab モジュールの実行 (run) を HTTP 接続から切り離して管理するマネージャ。
+- run はバックグラウンドのイベントループで回り、フレーム (StreamFrame) に連番の event id (SSE の id フィールド) を
+  つけて配信する。
+  フレームは形式に依らないまま持っておき、 view が購読者ごとに選んだ形式 (SSE, NDJSON など) で一度だけエンコードする。
+- 送ったフレームは run ごとのリングバッファ (LabRunReplayBuffer) に件数・バイト数・経過時間の上限つきで残しておく。
+- クライアントが途中で切断しても、 Last-Event-ID を送って再接続すれば取りこぼした分だけ再送して、続きから流せる。
+  モジュールを最初から実行し直さなくて済む。
+- ひとつの run に何人でも購読者をつなげられる (fan-out) 。モジュールの実行は 1 回だけ。
+  購読者ごとのキューは上限つきで、溢れたときの扱いは slow_subscriber_policy で選ぶ。
+- broker_socket_path を設定すると、フレームをブローカー (services.lab_run_broker) にも流す。
+  ほかのワーカーで始まった run も、ブローカー経由で購読できる。
+- reaper が、購読者のいなくなった run ・何も出さなくなった run ・長すぎる run をキャンセルする。
+  モジュールのジェネレータまでキャンセルが伝わるので、スレッドやプロセスがすぐに空く。
+- resumable でない run (POST /api/app/lab で始めたもの) は、最後の購読者がいなくなってから
+  abandoned_run_grace_period 秒 (ネットワークが一瞬切れただけのクライアントが再接続する分) でキャンセルする。
+  もっと長い猶予 (orphan_run_timeout) があるのは resumable な run と、一度でも再接続 (resume) された run だけ。
+- recorder (services.lab_run_recorder) を渡すと、 run とフレームを DB にも残す。書き込みはバックグラウンド。
+test: services.tests.test_lab_run_manager
+"""
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from functools import lru_cache, partial
+from typing import Any, AsyncIterator, Callable
+
+from django.conf import settings
+
+from lab.run_context import LabRunDeadlineExceeded
+from services.lab_module_execute_sse_service import LabModuleExecuteSSEService
+from services.lab_module_profiler import LabModuleProfiler
+from services.lab_module_registry import LabModuleImportError
+from services.lab_process_pool import LabModuleResourceLimitExceeded
+from services.lab_profile_store import PROFILE_FORMATS, get_lab_profile_store
+from services.lab_run_admission import LabRunRejected, LabRunTicket
+from services.lab_run_broker import LabRunBrokerPublisher, RemoteLabRun
+from services.lab_run_recorder import LabRunRecorder, get_lab_run_recorder
+from services.lab_run_replay_buffer import LabRunFrame, LabRunReplayBuffer
+from shared.async_streams import coalesce as coalesce_stream
+from shared.channels import BoundedChannel, ChannelClosed, ChannelFull
+from shared.metrics import registry
+from shared.stream_formatters import StreamFrame, StreamFrameEncoder
+
+logger = logging.getLogger(__name__)
+
+# 購読者のキューが溢れたときの扱い。
+# - block: 空くまで run を待たせる (backpressure) 。購読者がひとりなら一番素直。
+# - drop_oldest: 購読者のキューの一番古いフレームを捨てる。クライアントからは id が飛んで見える。
+# - disconnect: 購読者を切断する。 EventSource なら Last-Event-ID つきで再接続して、リプレイバッファから追いつける。
+SLOW_SUBSCRIBER_POLICIES = ("block", "drop_oldest", "disconnect")
+
+MODULE_YIELD_DURATION = registry.histogram(
+    "lab_module_yield_seconds", "Time a lab module takes to yield each message.", ("module",)
+)
+RUNS_REAPED = registry.counter("lab_runs_reaped_total", "Lab runs cancelled by the reaper.", ("reason",))
+
+
+class ActiveLabRun:
+    """
+    実行中 (あるいは実行し終わったばかり) の run ひとつ分。
+    フレームをリプレイバッファに積みつつ、購読中のチャンネルへ配る。
+    NOTE: DB に残す run の履歴 (app.models.LabRun) とは別。プロセスのメモリの中にだけある。
+    """
+
+    def __init__(
+        self,
+        run_id: str,
+        request_id: str,
+        module_name: str,
+        args: dict[str, Any],
+        replay_buffer: LabRunReplayBuffer,
+        subscriber_queue_size: int = 64,
+        slow_subscriber_policy: str = "disconnect",
+        resumable: bool = True,
+        abandoned_run_grace_period: float = 5.0,
+    ) -> None:
+        if slow_subscriber_policy not in SLOW_SUBSCRIBER_POLICIES:
+            raise ValueError(f"Unknown slow subscriber policy: '{slow_subscriber_policy}'")
+        self.run_id = run_id
+        self.request_id = request_id
+        self.module_name = module_name
+        self.args = args
+        # NOTE: requestId, module は毎フレーム同じなので、 run ごとに一度だけ JSON にしておく。
+        self.encoder = StreamFrameEncoder(request_id, module=module_name)
+        self.replay_buffer = replay_buffer
+        self.subscriber_queue_size = subscriber_queue_size
+        self.slow_subscriber_policy = slow_subscriber_policy
+        self.started_at = time.monotonic()
+        self.finished_at: float | None = None
+        # 最後にフレームを publish した時刻と、購読者がひとりもいなくなった時刻 (いるなら None) 。 reaper が見る。
+        self.last_published_at = self.started_at
+        self.orphaned_at: float | None = self.started_at
+        # 購読者がいなくなったあとも、再接続 (Last-Event-ID) を待つかどうか。 False なら最後の購読者が抜けたら止める。
+        self.resumable = resumable
+        # resumable でない run から、最後の購読者が抜けた時刻。
+        # abandoned_run_grace_period 秒のうちに誰も購読し直さなければ止める。
+        self.abandoned_at: float | None = None
+        self.abandoned_run_grace_period = abandoned_run_grace_period
+        # reaper などにキャンセルされた理由。
+        self.cancel_reason: str | None = None
+        # run を回している _drive のタスク。
+        self.task: asyncio.Task | None = None
+        # モジュールが次のメッセージを yield するまでにかかった時間の合計と回数。 summary イベントに載せる。
+        self.module_seconds = 0.0
+        self.module_yields = 0
+        # ブローカーへの publish 。ブローカーを使わないなら None 。
+        self.broker_publisher: LabRunBrokerPublisher | None = None
+        # 履歴を DB に残すレコーダー。残さないなら None 。
+        self.recorder: LabRunRecorder | None = None
+        self._next_event_id = 1
+        self._subscribers: set[BoundedChannel[StreamFrame]] = set()
+        # NOTE: publish はバックグラウンドのループ、 subscribe はリクエストのスレッドから呼ばれる。
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    @property
+    def frame_count(self) -> int:
+        return self._next_event_id - 1
+
+    @property
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+    async def publish(self, encode: Callable[..., StreamFrame]) -> None:
+        """
+        次の event id でフレームを作って、リプレイバッファに積み、全購読者へ送る。
+        購読者のキューがいっぱいのときは slow_subscriber_policy に従う。
+
+        Args:
+            encode (Callable[..., StreamFrame]): event_id を受け取ってフレームを返す関数。
+                                                 partial(encoder.message, "...") など。
+        """
+        with self._lock:
+            event_id = self._next_event_id
+            self._next_event_id += 1
+            frame = encode(event_id=event_id)
+            self.last_published_at = time.monotonic()
+            self.replay_buffer.append(LabRunFrame(event_id, frame, self.last_published_at))
+            subscribers = list(self._subscribers)
+        if self.recorder is not None:
+            self.recorder.record_frame(self.run_id, event_id, frame)
+        for channel in subscribers:
+            try:
+                if self.slow_subscriber_policy == "block":
+                    await channel.aput(frame)
+                else:
+                    self._offer(channel, frame)
+            except ChannelClosed:
+                # 購読者が切断した。
+                self._unsubscribe(channel)
+        if self.broker_publisher is not None:
+            try:
+                await self.broker_publisher.send(event_id, frame.data)
+            except OSError as e:
+                # NOTE: ブローカーが落ちても run は止めない。このワーカーの購読者には届き続ける。
+                logger.warning(f"Lost connection to lab run broker, run {self.run_id} is local only from now: {e}")
+                self.broker_publisher = None
+
+    def _offer(self, channel: BoundedChannel[StreamFrame], frame: StreamFrame) -> None:
+        """
+        待たずにフレームを入れる。いっぱいなら slow_subscriber_policy に従って古いフレームを捨てるか、切断する。
+
+        Raises:
+            ChannelClosed: 購読者が切断済み、あるいはこちらから切断した場合
+        """
+        try:
+            channel.put_nowait(frame)
+            return
+        except ChannelFull:
+            pass
+        if self.slow_subscriber_policy == "drop_oldest":
+            # NOTE: put するのはこの run だけなので、ひとつ取り出せば必ず空きができる。
+            channel.get_nowait()
+            channel.put_nowait(frame)
+            logger.warning(f"Slow subscriber of lab run {self.run_id}, dropped the oldest frame")
+        else:
+            logger.warning(f"Slow subscriber of lab run {self.run_id}, disconnecting it")
+            channel.close()
+            raise ChannelClosed()
+
+    def finish(self) -> None:
+        """
+        run の終了。購読中のチャンネルを閉じる (残っているフレームを取り出しきったらストリームが終わる) 。
+        """
+        with self._lock:
+            self.finished_at = time.monotonic()
+            subscribers, self._subscribers = self._subscribers, set()
+        for channel in subscribers:
+            channel.close()
+
+    def cancel(self, reason: str) -> None:
+        """
+        run をキャンセルする。 _drive がキャンセルされた旨のエラーを publish してから終わる。
+        NOTE: run を回しているイベントループのスレッドから呼ぶこと。
+        """
+        if self.finished or self.task is None:
+            return
+        self.cancel_reason = reason
+        self.task.cancel()
+
+    def subscribe(self, last_event_id: int | None = None) -> tuple[list[LabRunFrame], BoundedChannel[StreamFrame]]:
+        """
+        取りこぼした分のフレームと、以降のフレームが届くチャンネルを返す。
+        ロックの中で両方を取るので、抜けも重複も無い。
+
+        Args:
+            last_event_id (int | None): クライアントが最後に受け取った event id 。 None ならバッファに残っている全部。
+        """
+        channel: BoundedChannel[StreamFrame] = BoundedChannel(self.subscriber_queue_size)
+        with self._lock:
+            frames = self.replay_buffer.frames_after(last_event_id)
+            if self.finished:
+                channel.close()
+            else:
+                self._subscribers.add(channel)
+                self.orphaned_at = None
+                self.abandoned_at = None
+        return frames, channel
+
+    async def astream(self, last_event_id: int | None = None) -> AsyncIterator[StreamFrame]:
+        """
+        last_event_id の続きから、 run が終わるまでフレームを yield する。
+        """
+        frames, channel = self.subscribe(last_event_id)
+        try:
+            for frame in frames:
+                yield frame.stream_frame
+            while True:
+                try:
+                    stream_frame = await channel.aget()
+                except ChannelClosed:
+                    return
+                # NOTE: run がまだ last_event_id まで進んでいないうちに再接続されたら、そこまではライブでも送らない。
+                if last_event_id is None or stream_frame.event_id > last_event_id:
+                    yield stream_frame
+        finally:
+            # NOTE: resumable な run は、途中でクライアントが切断してもすぐには止めない。
+            #       Last-Event-ID で続きから見られる。
+            #       購読者のいないまま orphan_run_timeout 秒たったら、 reaper が止める。
+            #       resumable でない run は、最後の購読者なら _unsubscribe が abandoned_run_grace_period 秒後に止める。
+            self._unsubscribe(channel)
+            channel.close()
+
+    def _unsubscribe(self, channel: BoundedChannel[StreamFrame]) -> None:
+        abandoned_at = None
+        with self._lock:
+            self._subscribers.discard(channel)
+            if not self._subscribers and self.orphaned_at is None:
+                self.orphaned_at = time.monotonic()
+                if not self.resumable and not self.finished:
+                    self.abandoned_at = abandoned_at = self.orphaned_at
+        if abandoned_at is not None:
+            # NOTE: 誰も続きを受け取らないので、 reaper を待たずに止めて、スレッドやプロセスを空ける。
+            #       ただし、ネットワークが一瞬切れただけのクライアントが Last-Event-ID で再接続できるよう、
+            #       abandoned_run_grace_period 秒は待つ。
+            #       ここはリクエストのスレッドからも呼ばれるので、 run を回しているループに頼む。
+            task = self.task
+            if task is not None:
+                loop = task.get_loop()
+                loop.call_soon_threadsafe(
+                    loop.call_later, self.abandoned_run_grace_period, self._cancel_if_abandoned, abandoned_at
+                )
+
+    def _cancel_if_abandoned(self, abandoned_at: float) -> None:
+        # NOTE: 猶予のうちに誰かが購読し直していたら止めない。
+        #       購読し直してまた抜けた場合は、そのとき頼んだ分 (abandoned_at が新しい方) が止める。
+        if self.abandoned_at == abandoned_at:
+            self.cancel("client went away")
+
+
+class LabRunManager:
+    """
+    ActiveLabRun を run id で持っておいて、バックグラウンドのイベントループで実行するマネージャクラス。
+    - run はリクエストのイベントループ (WSGI ならリクエストごとの専用ループ) ではなく、
+      専用スレッドのイベントループで回すので、最初の接続が切れても run は続く。
+    - run を始めたリクエストと購読者は独立している。誰も購読していなくても run は最後まで回る。
+    - 終わった run は finished_run_ttl 秒たったら、次に start / get が呼ばれたときに捨てる。
+    - 実行中の run は reaper_interval 秒ごとに確認して、次のどれかに当てはまればキャンセルする。
+      購読者のいないまま orphan_run_timeout 秒たった・ max_run_idle 秒フレームを出していない・
+      始めてから max_run_lifetime 秒たった・ resumable でないのに購読者がいなくなって
+      abandoned_run_grace_period 秒たった (ActiveLabRun が止め損ねた場合) 。
+    """
+
+    def __init__(
+        self,
+        replay_buffer_max_frames: int = 1000,
+        replay_buffer_max_bytes: int = 1024 * 1024,
+        replay_buffer_ttl: float | None = 300.0,
+        finished_run_ttl: float = 300.0,
+        subscriber_queue_size: int = 64,
+        slow_subscriber_policy: str = "disconnect",
+        broker_socket_path: str | None = None,
+        orphan_run_timeout: float | None = 30.0,
+        max_run_idle: float | None = 600.0,
+        max_run_lifetime: float | None = 3600.0,
+        reaper_interval: float = 5.0,
+        abandoned_run_grace_period: float = 5.0,
+        recorder: LabRunRecorder | None = None,
+    ) -> None:
+        if slow_subscriber_policy not in SLOW_SUBSCRIBER_POLICIES:
+            raise ValueError(f"Unknown slow subscriber policy: '{slow_subscriber_policy}'")
+        self.replay_buffer_max_frames = replay_buffer_max_frames
+        self.replay_buffer_max_bytes = replay_buffer_max_bytes
+        self.replay_buffer_ttl = replay_buffer_ttl
+        self.finished_run_ttl = finished_run_ttl
+        self.subscriber_queue_size = subscriber_queue_size
+        self.slow_subscriber_policy = slow_subscriber_policy
+        self.broker_socket_path = broker_socket_path
+        self.orphan_run_timeout = orphan_run_timeout
+        self.max_run_idle = max_run_idle
+        self.max_run_lifetime = max_run_lifetime
+        self.reaper_interval = reaper_interval
+        self.abandoned_run_grace_period = abandoned_run_grace_period
+        self.recorder = recorder
+        self._runs: dict[str, ActiveLabRun] = {}
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def start(
+        self,
+        request_id: str,
+        module_name: str,
+        args: dict[str, Any],
+        coalesce: tuple[float, int] | None = None,
+        profile: bool = False,
+        ticket: LabRunTicket | None = None,
+        resumable: bool = True,
+    ) -> ActiveLabRun:
+        """
+        run を作ってバックグラウンドで実行を始める。
+
+        Args:
+            request_id (str): run を始めたリクエストの requestId 。フレームの requestId になる。
+            module_name (str): モジュール名
+            args (dict[str, Any]): モジュールに渡す引数
+            coalesce (tuple[float, int] | None): メッセージを (最大待ち時間 (秒), 最大件数) ごとにまとめて送る。
+            profile (bool): True ならモジュールの実行をプロファイルして、 request_id で保存する
+                            (services.lab_profile_store) 。
+            ticket (LabRunTicket | None): services.lab_run_admission で受け取った実行枠。
+                                          空くのを待ってからモジュールを実行して、終わったら返す。
+            resumable (bool): False なら、最後の購読者がいなくなってから abandoned_run_grace_period 秒で run を止める
+                              (ActiveLabRun を参照) 。
+        """
+        run = ActiveLabRun(
+            run_id="run-" + uuid.uuid4().hex,
+            request_id=request_id,
+            module_name=module_name,
+            args=args,
+            replay_buffer=LabRunReplayBuffer(
+                self.replay_buffer_max_frames, self.replay_buffer_max_bytes, self.replay_buffer_ttl
+            ),
+            subscriber_queue_size=self.subscriber_queue_size,
+            slow_subscriber_policy=self.slow_subscriber_policy,
+            resumable=resumable,
+            abandoned_run_grace_period=self.abandoned_run_grace_period,
+        )
+        if self.recorder is not None:
+            run.recorder = self.recorder
+            self.recorder.run_started(run.run_id, request_id, module_name, args)
+        with self._lock:
+            self._sweep_locked()
+            self._runs[run.run_id] = run
+        profiler = get_lab_profile_store().create_profiler() if profile else None
+        # NOTE: ブローカーへの登録も _drive の中 (バックグラウンドのループ) で行う。リクエストのスレッドは待たせない。
+        #       登録が済むまでの一瞬は、ほかのワーカーに来た GET が 404 になりうる (再試行すれば見つかる) 。
+        asyncio.run_coroutine_threadsafe(self._drive(run, coalesce, profiler, ticket), self._get_loop())
+        return run
+
+    def get(self, run_id: str) -> ActiveLabRun | RemoteLabRun | None:
+        """
+        run を取得する。このワーカーに無ければブローカーに聞く。どこにも無い (あるいはもう捨てた) なら None 。
+        """
+        with self._lock:
+            self._sweep_locked()
+            run = self._runs.get(run_id)
+        if run is None and self.broker_socket_path is not None:
+            return RemoteLabRun.lookup(self.broker_socket_path, run_id)
+        return run
+
+    async def _drive(
+        self,
+        run: ActiveLabRun,
+        coalesce: tuple[float, int] | None,
+        profiler: LabModuleProfiler | None = None,
+        ticket: LabRunTicket | None = None,
+    ) -> None:
+        """
+        モジュールを実行して、フレームを publish する。
+        """
+        encoder = run.encoder
+        module_name = run.module_name
+        run.task = asyncio.current_task()
+        # 履歴 (recorder) に残す、 run の終わり方。
+        status, error = "completed", ""
+        try:
+            if self.broker_socket_path is not None:
+                # NOTE: 最初のフレームより前に登録するので、ブローカー側の購読者もフレームを取りこぼさない。
+                await self._open_broker_publisher(run)
+            # 開始メッセージ
+            await run.publish(
+                partial(encoder.message, f"Starting module: {module_name}", args=run.args, runId=run.run_id)
+            )
+            if ticket is not None and not ticket.granted:
+                # 同時に実行できる run の数がいっぱい。ストリームは開いたまま、空くまで待つ。
+                await run.publish(partial(encoder.message, "Waiting for a free lab run slot"))
+            if ticket is not None:
+                await ticket.wait()
+            logger.info(f"Lab module execution started: {module_name} ({run.run_id})")
+
+            # LabModuleExecuteSSEService を使用してモジュールを実行
+            sse_service = LabModuleExecuteSSEService()
+
+            # NOTE: ctx を受け取るモジュールには、 reaper に止められる前に自分で抜けられるよう max_run_lifetime を渡す。
+            messages = self._atime_module_yields(
+                run, sse_service.aexecute_module_sse(module_name, run.args, profiler, self.max_run_lifetime)
+            )
+
+            # NOTE: フレームごとのログは % 形式で渡す (settings.LOGGING の per_frame フィルタで間引けるように) 。
+            if coalesce is None:
+                async for message in messages:
+                    # aexecute_module_sse から受け取ったメッセージをそのままフレームにする
+                    await run.publish(partial(encoder.message, message))
+                    logger.info("Lab module message sent: %s", message)
+            else:
+                # NOTE: まとめて 1 フレームにすると、ソケットへの write もプロキシの flush も 1 回で済む。
+                async for batch in coalesce_stream(messages, *coalesce):
+                    if len(batch) == 1:
+                        await run.publish(partial(encoder.message, batch[0]))
+                    else:
+                        await run.publish(partial(encoder.messages, batch))
+                    logger.info("Lab module messages sent: %d messages", len(batch))
+
+            # 完了メッセージ
+            await run.publish(encoder.completion)
+            logger.info(f"Lab module execution completed: {module_name} ({run.run_id})")
+
+        except (ModuleNotFoundError, LabModuleImportError, AttributeError) as e:
+            # モジュール/関数の存在チェックエラー (設定ミス)
+            logger.error(f"Lab module configuration error: {e}")
+            status, error = "error", str(e)
+            await run.publish(partial(encoder.error, str(e)))
+
+        except LabModuleResourceLimitExceeded as e:
+            # isolation="process" のモジュールが CPU 時間・メモリの上限を超えて殺された
+            logger.error(f"Lab module resource limit exceeded: {e}")
+            status, error = "error", str(e)
+            await run.publish(partial(encoder.error, str(e)))
+
+        except LabRunRejected as e:
+            # 実行枠が空くのを待ちきれなかった
+            status, error = "error", e.detail
+            await run.publish(partial(encoder.error, e.detail, retryAfter=e.retry_after))
+
+        except LabRunDeadlineExceeded as e:
+            # ctx を受け取るモジュールが deadline (ModuleSpec.timeout など) を過ぎた
+            logger.error(f"Lab module deadline exceeded: {e}")
+            status, error = "error", f"Module '{module_name}' exceeded its deadline"
+            await run.publish(partial(encoder.error, f"Module '{module_name}' exceeded its deadline"))
+
+        except asyncio.CancelledError:
+            status, error = "cancelled", run.cancel_reason or "Event loop stopped"
+            if run.cancel_reason is None:
+                # reaper ではなく、イベントループごと止められた。
+                raise
+            logger.warning(f"Lab module execution cancelled: {module_name} ({run.run_id}): {run.cancel_reason}")
+            await run.publish(partial(encoder.error, f"Run cancelled: {run.cancel_reason}"))
+
+        except Exception as e:
+            # その他の予期しないエラー
+            logger.error(f"Lab module execution error: {e}")
+            status, error = "error", f"Unexpected error: {str(e)}"
+            await run.publish(partial(encoder.error, f"Unexpected error: {str(e)}"))
+
+        finally:
+            if ticket is not None:
+                ticket.release()
+            if profiler is not None:
+                await self._save_profile(run, profiler)
+            run.finish()
+            if run.recorder is not None:
+                duration = time.monotonic() - run.started_at
+                run.recorder.run_finished(run.run_id, status, error, run.frame_count, duration)
+            if run.broker_publisher is not None:
+                try:
+                    await run.broker_publisher.aclose()
+                except OSError:
+                    pass
+
+    @staticmethod
+    async def _save_profile(run: ActiveLabRun, profiler: LabModuleProfiler) -> None:
+        """
+        プロファイルをファイルに保存して、ダウンロード先をメッセージで知らせる。
+        """
+        try:
+            # NOTE: ファイルへの書き込みで run のイベントループを止めないよう、スレッドで行う。
+            await asyncio.to_thread(get_lab_profile_store().save, run.request_id, run.module_name, profiler)
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to save lab module profile: {e}")
+            await run.publish(partial(run.encoder.error, f"Failed to save profile: {e}"))
+            return
+        url = f"/api/app/lab/profiles/{run.request_id}"
+        await run.publish(
+            partial(
+                run.encoder.message,
+                "Profile saved",
+                profile={profile_format: f"{url}?type={profile_format}" for profile_format in PROFILE_FORMATS},
+            )
+        )
+
+    @staticmethod
+    async def _atime_module_yields(run: ActiveLabRun, messages: AsyncIterator[str]) -> AsyncIterator[str]:
+        """
+        モジュールがメッセージをひとつ yield するまでの時間を測る。
+        NOTE: ここで測るのはモジュール側の時間だけ。購読者へ配る時間 (publish) は含まない。
+        """
+        started_at = time.perf_counter()
+        async for message in messages:
+            elapsed = time.perf_counter() - started_at
+            run.module_seconds += elapsed
+            run.module_yields += 1
+            MODULE_YIELD_DURATION.observe(elapsed, module=run.module_name)
+            yield message
+            started_at = time.perf_counter()
+
+    async def _open_broker_publisher(self, run: ActiveLabRun) -> None:
+        assert self.broker_socket_path is not None
+        try:
+            run.broker_publisher = await asyncio.wait_for(
+                LabRunBrokerPublisher.open(self.broker_socket_path, run.run_id), timeout=1.0
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            logger.warning(f"Could not connect to lab run broker, run {run.run_id} is local only: {e!r}")
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        """
+        run を回すイベントループ。最初に使うときに専用スレッドで起動して、 reaper も始める。
+        """
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="lab-runs", daemon=True).start()
+                asyncio.run_coroutine_threadsafe(self._reap_forever(), loop)
+                self._loop = loop
+            return self._loop
+
+    async def _reap_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.reaper_interval)
+            self.reap()
+
+    def reap(self) -> None:
+        """
+        止める条件に当てはまる実行中の run をキャンセルする。
+        NOTE: run を回しているイベントループのスレッドから呼ぶこと (reaper が reaper_interval 秒ごとに呼ぶ) 。
+        """
+        now = time.monotonic()
+        with self._lock:
+            runs = [run for run in self._runs.values() if not run.finished and run.cancel_reason is None]
+        for run in runs:
+            reason = self._reap_reason(run, now)
+            if reason is not None:
+                kind, message = reason
+                RUNS_REAPED.inc(reason=kind)
+                run.cancel(message)
+
+    def _reap_reason(self, run: ActiveLabRun, now: float) -> tuple[str, str] | None:
+        """
+        run を止める理由 (メトリクスのラベル, メッセージ) 。止めないなら None 。
+        """
+        if self.max_run_lifetime is not None and now - run.started_at > self.max_run_lifetime:
+            return "lifetime", f"exceeded the maximum lifetime of {self.max_run_lifetime} seconds"
+        if self.max_run_idle is not None and now - run.last_published_at > self.max_run_idle:
+            return "idle", f"no messages for {self.max_run_idle} seconds"
+        abandoned_at = run.abandoned_at
+        if abandoned_at is not None and now - abandoned_at >= run.abandoned_run_grace_period:
+            return "abandoned", "client went away"
+        # NOTE: ブローカーに流している run は、ほかのワーカーの購読者が見えないので止めない。
+        orphaned_at = run.orphaned_at
+        if (
+            self.orphan_run_timeout is not None
+            and orphaned_at is not None
+            and run.broker_publisher is None
+            and now - orphaned_at > self.orphan_run_timeout
+        ):
+            return "orphaned", f"no subscribers for {self.orphan_run_timeout} seconds"
+        return None
+
+    def _sweep_locked(self) -> None:
+        now = time.monotonic()
+        expired = [
+            run_id
+            for run_id, run in self._runs.items()
+            if run.finished_at is not None and now - run.finished_at > self.finished_run_ttl
+        ]
+        for run_id in expired:
+            del self._runs[run_id]
+
+
+@lru_cache(maxsize=None)
+def get_lab_run_manager() -> LabRunManager:
+    """
+    プロセスで共有する LabRunManager を返す。設定は settings.LAB_RUNS 。
+    """
+    config = getattr(settings, "LAB_RUNS", {})
+    return LabRunManager(**config, recorder=get_lab_run_recorder())
@@ -0,0 +1,208 @@
+"""
+lab モジュールの run と、 run が送ったフレームを DB (app.models.LabRun, LabRunEvent) に残すレコーダー。
+ストリームを閉じたあとでも、 GET /api/app/lab/history から run の履歴と中身を引ける。
+- write-behind: run のイベントループはキューに入れるだけ。バックグラウンドのスレッドがまとめて取り出して、
+  batch_size 件たまるか flush_interval 秒たつごとに bulk_create する。フレームごとの INSERT を待たない。
+- キューが溢れたら待たずに捨てる (捨てた件数はあとで WARNING で出す) 。履歴のためにストリームを止めない。
+- DB への書き込みに失敗しても、ログに出してそのまとまりを捨てるだけ。 run は止めない。
+NOTE: shared.logging_handlers.BackgroundQueueHandler と同じ作り。
+
+settings.LAB_RUN_HISTORY で設定する。
+test: services.tests.test_lab_run_recorder
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from functools import lru_cache
+from typing import Any
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from django.utils import timezone
+
+from app.models import LabRun, LabRunEvent
+from shared.metrics import registry
+from shared.stream_formatters import StreamFrame
+
+logger = logging.getLogger(__name__)
+
+# writer に止まってもらうための印。
+_STOP = object()
+
+RECORDS_DROPPED = registry.counter(
+    "lab_run_history_dropped_total", "Lab run history records dropped because the queue was full or the write failed."
+)
+FLUSH_DURATION = registry.histogram("lab_run_history_flush_seconds", "Time to write a batch of lab run history.")
+
+
+class LabRunRecorder:
+    """
+    run の開始・フレーム・終了をキューに入れて、バックグラウンドのスレッドでまとめて DB に書くクラス。
+    run のイベントループから呼ばれる run_started, record_frame, run_finished はキューに入れるだけで、すぐ返る。
+    """
+
+    def __init__(self, batch_size: int = 200, flush_interval: float = 1.0, queue_size: int = 10000) -> None:
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(queue_size)
+        self._writer: threading.Thread | None = None
+        self._writer_lock = threading.Lock()
+        # NOTE: gunicorn などで fork されると、子プロセスにスレッドは引き継がれない。子で起動し直す。
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_after_fork)
+        atexit.register(self.close)
+
+    def run_started(self, run_id: str, request_id: str, module_name: str, args: dict[str, Any]) -> None:
+        run = LabRun(run_id=run_id, request_id=request_id, module=module_name, args=args, started_at=timezone.now())
+        self._put(("started", run))
+
+    def record_frame(self, run_id: str, event_id: int, frame: StreamFrame) -> None:
+        """
+        Args:
+            frame (StreamFrame): 送ったフレーム。 payload が無ければ、 data はバックグラウンドのスレッドでデコードする。
+        """
+        self._put(("frame", (run_id, event_id, frame, timezone.now())))
+
+    def run_finished(self, run_id: str, status: str, error: str, frame_count: int, duration: float) -> None:
+        """
+        Args:
+            status (str): LabRun.Status の値。 completed / error / cancelled 。
+            error (str): error, cancelled のときの理由。
+            frame_count (int): 送ったフレームの数
+            duration (float): run を始めてから終わるまでの秒数
+        """
+        self._put(("finished", (run_id, status, error, frame_count, duration, timezone.now())))
+
+    def flush(self) -> None:
+        """
+        キューに残っているものを、呼び出したスレッドで書き込む。
+        """
+        items = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                items.append(item)
+        self._write(items)
+
+    def close(self) -> None:
+        """
+        キューに残っているものを書き込んでから止める。
+        """
+        with self._writer_lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            self._queue.put(_STOP)
+            writer.join(timeout=5)
+
+    def _put(self, item: tuple) -> None:
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+            RECORDS_DROPPED.inc()
+
+    def _ensure_writer(self) -> None:
+        if self._writer is not None:
+            return
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_forever, name="lab-run-recorder", daemon=True)
+                self._writer.start()
+
+    def _write_forever(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            # 最初のひとつから flush_interval 秒か batch_size 件、どちらか早いほうまでまとめる。
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1] is not _STOP:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            stop = batch[-1] is _STOP
+            self._write([item for item in batch if item is not _STOP])
+            if stop:
+                return
+
+    def _write(self, items: list[tuple]) -> None:
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            logger.warning(f"Lab run history queue was full, dropped {dropped} records")
+        if not items:
+            return
+        runs: list[LabRun] = []
+        events: list[LabRunEvent] = []
+        finished: list[tuple] = []
+        for kind, value in items:
+            if kind == "started":
+                runs.append(value)
+            elif kind == "frame":
+                event = _frame_to_event(*value)
+                if event is not None:
+                    events.append(event)
+            else:
+                finished.append(value)
+
+        started_at = time.perf_counter()
+        # NOTE: リクエストの外のスレッドなので、切れた・古くなった接続は自分で捨てる。
+        close_old_connections()
+        try:
+            # NOTE: LabRunEvent は LabRun を参照するので、 run → フレーム → 終了の順で書く。
+            #       run の開始は必ずそのフレームより先にキューに入る。
+            if runs:
+                LabRun.objects.bulk_create(runs, batch_size=self.batch_size, ignore_conflicts=True)
+            if events:
+                LabRunEvent.objects.bulk_create(events, batch_size=self.batch_size, ignore_conflicts=True)
+            for run_id, status, error, frame_count, duration, finished_at in finished:
+                LabRun.objects.filter(run_id=run_id).update(
+                    status=status,
+                    error=error,
+                    finished_at=finished_at,
+                    duration_ms=duration * 1000,
+                    frame_count=frame_count,
+                )
+        except DatabaseError as e:
+            RECORDS_DROPPED.inc(len(items))
+            logger.error(f"Failed to write lab run history, dropped {len(items)} records: {e}")
+        finally:
+            FLUSH_DURATION.observe(time.perf_counter() - started_at)
+
+    def _reset_after_fork(self) -> None:
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._queue = queue.Queue(self._queue.maxsize)
+
+
+def _frame_to_event(run_id: str, event_id: int, frame: StreamFrame, created_at: datetime) -> LabRunEvent | None:
+    """
+    フレームのオブジェクト ({"requestId": ..., "data": {...}}) を LabRunEvent にする。 data が壊れているなら None 。
+    """
+    try:
+        data = frame.get_payload()
+    except ValueError:
+        logger.warning(f"Could not parse lab run frame {run_id} #{event_id}")
+        return None
+    return LabRunEvent(run_id=run_id, event_id=event_id, data=data, created_at=created_at)
+
+
+@lru_cache(maxsize=None)
+def get_lab_run_recorder() -> LabRunRecorder | None:
+    """
+    プロセスで共有する LabRunRecorder を返す。設定は settings.LAB_RUN_HISTORY 。 enabled が False なら None 。
+    """
+    config = dict(getattr(settings, "LAB_RUN_HISTORY", {}))
+    if not config.pop("enabled", True):
+        return None
+    return LabRunRecorder(**config)
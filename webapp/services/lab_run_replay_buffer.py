@@ -0,0 +1,77 @@
+"""
+lab の run が配信したフレームを、再接続 (Last-Event-ID) のために残しておくリングバッファ。
+LabRunManager (services.lab_run_manager) とブローカー (services.lab_run_broker) の両方で使う。
+"""
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+
+from shared.stream_formatters import StreamFrame
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class LabRunFrame:
+    """
+    配信済みのフレームひとつ分。
+    """
+
+    event_id: int
+    # 形式に依らないフレーム。送るときに購読者ごとの形式にする (shared.stream_formatters) 。
+    stream_frame: StreamFrame
+    # time.monotonic() 。
+    created_at: float
+
+
+class LabRunReplayBuffer:
+    """
+    直近のフレームを残しておくリングバッファ。
+    max_frames 件・ max_bytes バイトを超えるか、 ttl 秒たったフレームから古い順に捨てる。
+    NOTE: スレッドセーフではない。 ActiveLabRun のロックの中で使うこと。
+    """
+
+    def __init__(self, max_frames: int = 1000, max_bytes: int = 1024 * 1024, ttl: float | None = 300.0) -> None:
+        """
+        Args:
+            max_frames (int): 残しておく最大件数
+            max_bytes (int): 残しておく最大バイト数
+            ttl (float | None): フレームを残しておく秒数。 None なら時間では捨てない。
+        """
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._frames: deque[LabRunFrame] = deque()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def append(self, frame: LabRunFrame) -> None:
+        self._frames.append(frame)
+        self._size += len(frame.stream_frame.data)
+        self._evict(frame.created_at)
+
+    def frames_after(self, last_event_id: int | None) -> list[LabRunFrame]:
+        """
+        last_event_id より後のフレームを返す。 None なら残っている全部。
+        捨てられてしまったフレームは返せないので、そのぶんは欠ける。
+        """
+        self._evict(time.monotonic())
+        if last_event_id is None:
+            return list(self._frames)
+        if self._frames and self._frames[0].event_id > last_event_id + 1:
+            logger.warning(
+                f"Replay buffer no longer has frames {last_event_id + 1}..{self._frames[0].event_id - 1}, skipping them"
+            )
+        return [frame for frame in self._frames if frame.event_id > last_event_id]
+
+    def _evict(self, now: float) -> None:
+        frames = self._frames
+        while frames and (
+            len(frames) > self.max_frames
+            or self._size > self.max_bytes
+            or (self.ttl is not None and now - frames[0].created_at > self.ttl)
+        ):
+            self._size -= len(frames.popleft().stream_frame.data)
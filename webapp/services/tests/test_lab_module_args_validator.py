@@ -0,0 +1,44 @@
+"""
+services.tests.test_lab_module_args_validator
+"""
+
+import unittest
+
+from ..lab_module_args_validator import LabModuleArgsError, LabModuleArgsValidator
+
+
+class TestLabModuleArgsValidator(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.validator = LabModuleArgsValidator(
+            {
+                "count": {"description": "回数", "type": "integer", "default": 3, "min": 1, "max": 100},
+                "name": {"description": "名前", "type": "string", "required": True, "pattern": r"[a-z]+"},
+                "verbose": {"description": "詳細", "type": "boolean"},
+                "note": {"description": "型の宣言なし"},
+            }
+        )
+
+    def test_coerces_and_fills_defaults(self) -> None:
+        # 文字列で来た数値・真偽値を型変換し、省略された引数にはデフォルト値を入れることを確認。
+        self.assertEqual(
+            self.validator.validate({"name": "foo", "verbose": "true", "note": ["as", "is"]}),
+            {"count": 3, "name": "foo", "verbose": True, "note": ["as", "is"]},
+        )
+        self.assertEqual(self.validator.validate({"name": "foo", "count": "42"})["count"], 42)
+
+    def test_collects_errors(self) -> None:
+        # 宣言に合わない引数は、まとめて LabModuleArgsError になることを確認。
+        with self.assertRaises(LabModuleArgsError) as cm:
+            self.validator.validate({"count": "0", "name": "Foo1", "verbose": "maybe", "unknown": 1})
+        self.assertEqual(set(cm.exception.errors), {"count", "name", "verbose", "unknown"})
+
+        with self.assertRaises(LabModuleArgsError) as cm:
+            self.validator.validate({"count": True})
+        self.assertEqual(cm.exception.errors["name"], ["This field is required."])
+        self.assertEqual(cm.exception.errors["count"], ["This field must be an integer."])
+
+    def test_unknown_type_is_rejected_at_compile_time(self) -> None:
+        # 知らない type の宣言は、コンパイルするときにエラーになることを確認。
+        with self.assertRaises(ValueError):
+            LabModuleArgsValidator({"x": {"type": "date"}})
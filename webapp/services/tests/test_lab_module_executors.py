@@ -0,0 +1,100 @@
+"""
+services.tests.test_lab_module_executors
+"""
+
+import asyncio
+import threading
+import time
+import unittest
+from typing import Generator
+
+from lab.run_context import LabRunCancelled, LabRunDeadlineExceeded, RunContext, accepts_run_context
+
+from ..lab_module_executors import ThreadPoolLabModuleExecutor
+from ..lab_process_pool import LabProcessPool
+
+
+class TestRunContext(unittest.TestCase):
+
+    def test_sleep_wakes_up_on_cancel(self) -> None:
+        # 別のスレッドから cancel されたら、 sleep の途中でもすぐに LabRunCancelled になることを確認。
+        ctx = RunContext()
+        threading.Timer(0.05, ctx.cancel, args=("client went away",)).start()
+        started_at = time.monotonic()
+        with self.assertRaisesRegex(LabRunCancelled, "client went away"):
+            ctx.sleep(10)
+        self.assertLess(time.monotonic() - started_at, 1)
+
+    def test_sleep_stops_at_deadline(self) -> None:
+        # deadline を越えて眠らず、 LabRunDeadlineExceeded になることを確認。
+        ctx = RunContext(timeout=0.05)
+        ctx.sleep(0.01)
+        with self.assertRaises(LabRunDeadlineExceeded):
+            ctx.sleep(10)
+        self.assertEqual(ctx.remaining(), 0)
+
+    def test_accepts_run_context(self) -> None:
+        # ctx を宣言した main にだけ渡すことを確認。
+        self.assertTrue(accepts_run_context(lambda ctx, **args: None))
+        self.assertFalse(accepts_run_context(lambda **args: None))
+
+
+class TestThreadPoolLabModuleExecutor(unittest.TestCase):
+
+    def test_cancel_stops_sleeping_main(self) -> None:
+        # 受け取り手が途中でいなくなったら、 ctx.sleep で待っている main もすぐに止まることを確認。
+        stopped = threading.Event()
+
+        def main(ctx: RunContext) -> Generator[str, None, None]:
+            try:
+                yield "start"
+                ctx.sleep(10)
+                yield "never"
+            finally:
+                stopped.set()
+
+        async def scenario() -> None:
+            ctx = RunContext()
+            executor = ThreadPoolLabModuleExecutor(max_workers=1, module_concurrency_limit=1)
+            stream = executor.astream("test", main, {}, ctx=ctx)
+            self.assertEqual(await stream.__anext__(), "start")
+            await stream.aclose()
+            ctx.cancel()
+            self.assertTrue(await asyncio.to_thread(stopped.wait, 1))
+
+        asyncio.run(scenario())
+
+    def test_deadline_is_raised_to_consumer(self) -> None:
+        # deadline を過ぎたら、受け取り手に LabRunDeadlineExceeded が届くことを確認。
+        def main(ctx: RunContext) -> Generator[str, None, None]:
+            yield "start"
+            ctx.sleep(10)
+
+        async def scenario() -> list[str]:
+            executor = ThreadPoolLabModuleExecutor(max_workers=1)
+            messages = []
+            with self.assertRaises(LabRunDeadlineExceeded):
+                async for message in executor.astream("test", main, {}, ctx=RunContext(timeout=0.05)):
+                    messages.append(message)
+            return messages
+
+        self.assertEqual(asyncio.run(scenario()), ["start"])
+
+
+class TestLabProcessPool(unittest.TestCase):
+
+    def test_abandoned_run_is_replaced_without_blocking_the_loop(self) -> None:
+        # 途中で受け取り手がいなくなったワーカーの入れ替え (kill, join, 起動) で、イベントループが止まらないことと、
+        # 入れ替えたワーカーがプールに戻って次の実行に使えることを確認。
+        async def scenario() -> None:
+            pool = LabProcessPool(size=1)
+            stream = pool.astream("foo", {}, run_context=True)
+            await stream.__anext__()
+            started_at = time.monotonic()
+            await stream.aclose()
+            self.assertLess(time.monotonic() - started_at, 0.5)
+            second = pool.astream("foo", {}, run_context=True)
+            self.assertEqual(await asyncio.wait_for(second.__anext__(), 30), "foo module を開始するよー!")
+            await second.aclose()
+
+        asyncio.run(scenario())
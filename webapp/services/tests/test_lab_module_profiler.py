@@ -0,0 +1,96 @@
+"""
+services.tests.test_lab_module_profiler
+"""
+
+import asyncio
+import io
+import marshal
+import pstats
+import tempfile
+import time
+import unittest
+
+from ..lab_module_profiler import LabModuleProfiler
+from ..lab_profile_store import LabProfileStore
+
+
+def _busy(seconds: float) -> None:
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def _main(count: int):
+    for i in range(count):
+        _busy(0.03)
+        yield f"message {i}"
+
+
+async def _async_main(count: int):
+    for i in range(count):
+        await asyncio.sleep(0.01)
+        yield f"message {i}"
+
+
+class TestLabModuleProfiler(unittest.TestCase):
+
+    def test_profile_sync_generator(self) -> None:
+        # メッセージはそのままで、 yield ごとの時間・ pstats ・サンプリングしたスタックが取れることを確認。
+        profiler = LabModuleProfiler(sampling_interval=0.001)
+        messages = list(profiler.wrap(_main)(count=3))
+        self.assertEqual(messages, ["message 0", "message 1", "message 2"])
+
+        self.assertEqual(len(profiler.yields), 3)
+        self.assertTrue(all(y["wallMs"] >= 30 and y["cpuMs"] > 0 for y in profiler.yields))
+        stats = pstats.Stats(_StatsHolder(profiler.pstats_bytes()), stream=io.StringIO())
+        self.assertIn("_busy", {name for _, _, name in stats.stats})  # type: ignore[attr-defined]
+        # サンプリングしたスタックは main から始まり、プロファイラ自身のフレームを含まない。
+        stacks = profiler.collapsed_stacks().splitlines()
+        self.assertTrue(stacks)
+        self.assertTrue(all(line.startswith(f"{__name__}._main;{__name__}._busy") for line in stacks))
+
+    def test_profile_async_generator(self) -> None:
+        # async ジェネレータも async ジェネレータのまま包まれて、 wall 時間に await の待ちが入ることを確認。
+        profiler = LabModuleProfiler()
+
+        async def scenario() -> list[str]:
+            return [message async for message in profiler.wrap(_async_main)(count=2)]
+
+        self.assertEqual(asyncio.run(scenario()), ["message 0", "message 1"])
+        self.assertEqual([y["wallMs"] >= 10 for y in profiler.yields], [True, True])
+        self.assertEqual(profiler.summary()["wallMs"], round(sum(y["wallMs"] for y in profiler.yields), 3))
+
+    def test_merge_exported_profile(self) -> None:
+        # ワーカープロセスから送られてくる export の結果を取り込めることを確認。
+        worker_profiler = LabModuleProfiler(sampling_interval=0.001)
+        list(worker_profiler.wrap(_main)(count=2))
+        profiler = LabModuleProfiler()
+        profiler.merge(worker_profiler.export())
+        self.assertEqual(len(profiler.yields), 2)
+        self.assertEqual(profiler.pstats_bytes(), worker_profiler.pstats_bytes())
+
+
+class TestLabProfileStore(unittest.TestCase):
+
+    def test_save_and_prune(self) -> None:
+        # リクエストIDごとに保存され、上限を超えたら古いものから消えることを確認。
+        with tempfile.TemporaryDirectory() as directory:
+            store = LabProfileStore(directory, max_profiles=1)
+            for request_id in ("rq-00000001", "rq-00000002"):
+                profiler = store.create_profiler()
+                list(profiler.wrap(_main)(count=1))
+                store.save(request_id, "test", profiler)
+                time.sleep(0.01)
+            self.assertIsNone(store.path("rq-00000001", "pstats"))
+            self.assertIsNotNone(store.path("rq-00000002", "pstats"))
+            self.assertIsNotNone(store.path("rq-00000002", "collapsed"))
+            with self.assertRaises(ValueError):
+                store.path("../settings", "summary")
+
+
+class _StatsHolder:
+    def __init__(self, data: bytes) -> None:
+        self.stats = marshal.loads(data)
+
+    def create_stats(self) -> None:
+        pass
@@ -0,0 +1,97 @@
+"""
+services.tests.test_lab_module_registry
+"""
+
+import os
+import sys
+import tempfile
+import textwrap
+import unittest
+import uuid
+
+from lab.module_specs import ModuleSpec
+
+from ..lab_module_registry import LabModuleImportError, LabModuleRegistry
+
+MODULE_SOURCE = """
+from lab.module_specs import ModuleSpec
+
+
+def get_spec():
+    return ModuleSpec(module="{name}", description="{description}")
+
+
+def main(**args):
+    yield "{description}"
+"""
+
+
+class TestLabModuleRegistry(unittest.TestCase):
+    # NOTE: なくても良い。が、あると mypy がインスタンス変数として認識してくれる。
+    package_dir: str
+    package: str
+
+    def setUp(self) -> None:
+        # テストごとに使い捨ての lab パッケージを作る。
+        self._tmp = tempfile.TemporaryDirectory()
+        self.package = f"lab_registry_test_{uuid.uuid4().hex[:8]}"
+        self.package_dir = os.path.join(self._tmp.name, self.package)
+        os.mkdir(self.package_dir)
+        open(os.path.join(self.package_dir, "__init__.py"), "w").close()
+        self._write_module("alpha", "first version")
+        sys.path.insert(0, self._tmp.name)
+
+    def tearDown(self) -> None:
+        sys.path.remove(self._tmp.name)
+        for name in [name for name in sys.modules if name.startswith(self.package)]:
+            del sys.modules[name]
+        self._tmp.cleanup()
+
+    def _write_module(self, name: str, description: str, mtime_offset: int = 0) -> None:
+        path = os.path.join(self.package_dir, f"{name}.py")
+        with open(path, "w") as f:
+            f.write(textwrap.dedent(MODULE_SOURCE.format(name=name, description=description)))
+        # NOTE: 同じ秒の中で書き換えても mtime が変わるように、ずらしておく。
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + mtime_offset))
+
+    def test_get_spec_is_cached(self) -> None:
+        # get_spec の結果が毎回作り直されず、同じ ModuleSpec が返ることを確認。
+        registry = LabModuleRegistry(package=self.package, reload_check_interval=None)
+        spec = registry.get_spec("alpha")
+        self.assertIsInstance(spec, ModuleSpec)
+        self.assertEqual(spec.description, "first version")
+        self.assertIs(registry.get_spec("alpha"), spec)
+        self.assertEqual(list(registry.get_main("alpha")()), ["first version"])
+
+    def test_unknown_module(self) -> None:
+        # 存在しないモジュールは ModuleNotFoundError になることを確認。
+        registry = LabModuleRegistry(package=self.package, reload_check_interval=None)
+        with self.assertRaises(ModuleNotFoundError):
+            registry.get_spec("missing")
+
+    def test_reload_on_mtime_change(self) -> None:
+        # ファイルが書き換えられたら reload され、追加されたモジュールも見つかることを確認。
+        registry = LabModuleRegistry(package=self.package, reload_check_interval=0)
+        self.assertEqual(registry.get_spec("alpha").description, "first version")
+
+        self._write_module("alpha", "second version", mtime_offset=1_000_000_000)
+        self._write_module("beta", "new module")
+        # NOTE: ディレクトリの mtime も確実に変える。
+        stat = os.stat(self.package_dir)
+        os.utime(self.package_dir, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+        self.assertEqual(registry.get_spec("alpha").description, "second version")
+        self.assertEqual(registry.get_spec("beta").description, "new module")
+        self.assertEqual([entry.name for entry in registry.entries()], ["alpha", "beta"])
+
+    def test_import_error_is_not_module_not_found(self) -> None:
+        # import に失敗したモジュールは、中身が ModuleNotFoundError でも「見つからない」ではなく
+        # LabModuleImportError になり、 entries(include_failed=True) にだけ出てくることを確認。
+        with open(os.path.join(self.package_dir, "broken.py"), "w") as f:
+            f.write("import no_such_dependency_for_lab\n")
+        registry = LabModuleRegistry(package=self.package, reload_check_interval=None)
+        with self.assertRaisesRegex(LabModuleImportError, "no_such_dependency_for_lab"):
+            registry.get_spec("broken")
+        self.assertEqual([entry.name for entry in registry.entries()], ["alpha"])
+        self.assertEqual([entry.name for entry in registry.entries(include_failed=True)], ["alpha", "broken"])
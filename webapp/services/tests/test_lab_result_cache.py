@@ -0,0 +1,129 @@
+"""
+services.tests.test_lab_result_cache
+"""
+
+import asyncio
+import unittest
+from typing import AsyncIterator
+from unittest import mock
+
+from ..lab_result_cache import LabResultCache
+
+
+class TestLabResultCache(unittest.TestCase):
+
+    def test_make_key_is_canonical(self) -> None:
+        # args のキーの順番が違っても同じキーに、バージョンが違えば別のキーになることを確認。
+        key = LabResultCache.make_key("foo", "v1", {"a": "1", "b": "2"})
+        self.assertEqual(key, LabResultCache.make_key("foo", "v1", {"b": "2", "a": "1"}))
+        self.assertNotEqual(key, LabResultCache.make_key("foo", "v2", {"a": "1", "b": "2"}))
+
+    def test_lru_and_size_eviction(self) -> None:
+        # 件数・サイズの上限を超えたら、最近使われていないものから捨てることを確認。
+        cache = LabResultCache(max_entries=2, max_bytes=10)
+        cache.set("a", ["aaa"])
+        cache.set("b", ["bbb"])
+        cache.get("a")
+        cache.set("c", ["ccc"])
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), ["aaa"])
+        cache.set("d", ["dddddddd"])
+        self.assertEqual([cache.get("a"), cache.get("c"), cache.get("d")], [None, None, ["dddddddd"]])
+
+    def test_ttl(self) -> None:
+        # ttl 秒たった結果は使わないことを確認。
+        cache = LabResultCache(ttl=10)
+        with mock.patch("services.lab_result_cache.time.monotonic", return_value=100.0):
+            cache.set("a", ["aaa"])
+        with mock.patch("services.lab_result_cache.time.monotonic", return_value=111.0):
+            self.assertIsNone(cache.get("a"))
+
+    def test_single_flight_and_replay(self) -> None:
+        # 同時に来た同じキーの実行は 1 回にまとめ、以降はキャッシュから返すことを確認。
+        cache = LabResultCache()
+        calls = []
+
+        async def produce() -> AsyncIterator[str]:
+            calls.append(1)
+            for message in ["one", "two"]:
+                await asyncio.sleep(0.01)
+                yield message
+
+        async def collect() -> list[str]:
+            return [message async for message in cache.astream("key", produce)]
+
+        async def scenario() -> list[list[str]]:
+            return [*await asyncio.gather(collect(), collect()), await collect()]
+
+        self.assertEqual(asyncio.run(scenario()), [["one", "two"]] * 3)
+        self.assertEqual(len(calls), 1)
+
+    def test_errors_are_not_cached(self) -> None:
+        # エラーになった実行は、相乗りしたストリームにも同じ例外を伝え、キャッシュしないことを確認。
+        cache = LabResultCache()
+
+        async def produce() -> AsyncIterator[str]:
+            await asyncio.sleep(0.01)
+            yield "one"
+            raise ValueError("boom")
+
+        async def collect() -> list[str] | str:
+            try:
+                return [message async for message in cache.astream("key", produce)]
+            except ValueError as e:
+                return str(e)
+
+        async def scenario() -> list:
+            return await asyncio.gather(collect(), collect())
+
+        self.assertEqual(asyncio.run(scenario()), ["boom", "boom"])
+        self.assertIsNone(cache.get("key"))
+
+    def test_cancelling_the_first_requester_does_not_abort_followers(self) -> None:
+        # 最初に呼んだストリームが閉じられても、相乗りしたストリームは最後まで受け取れることを確認。
+        cache = LabResultCache()
+        calls = []
+
+        async def produce() -> AsyncIterator[str]:
+            calls.append(1)
+            for message in ["one", "two", "three"]:
+                await asyncio.sleep(0.01)
+                yield message
+
+        async def collect() -> list[str]:
+            return [message async for message in cache.astream("key", produce)]
+
+        async def scenario() -> list[str]:
+            first = cache.astream("key", produce)
+            self.assertEqual(await first.__anext__(), "one")
+            follower = asyncio.ensure_future(collect())
+            await asyncio.sleep(0)
+            await first.aclose()
+            return await follower
+
+        self.assertEqual(asyncio.run(scenario()), ["one", "two", "three"])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.get("key"), ["one", "two", "three"])
+
+    def test_execution_is_cancelled_when_every_reader_leaves(self) -> None:
+        # 読み手が全員いなくなったら実行をキャンセルし、キャッシュしないことを確認。
+        cache = LabResultCache()
+        closed = []
+
+        async def produce() -> AsyncIterator[str]:
+            try:
+                for message in ["one", "two", "three"]:
+                    await asyncio.sleep(0.01)
+                    yield message
+            finally:
+                closed.append(True)
+
+        async def scenario() -> None:
+            stream = cache.astream("key", produce)
+            await stream.__anext__()
+            await stream.aclose()
+            await asyncio.sleep(0.05)
+
+        asyncio.run(scenario())
+        self.assertEqual(closed, [True])
+        self.assertIsNone(cache.get("key"))
@@ -0,0 +1,58 @@
+"""
+services.tests.test_lab_run_admission
+"""
+
+import asyncio
+import unittest
+from unittest import mock
+
+from ..lab_run_admission import LabRunAdmission, LabRunRejected
+
+
+class TestLabRunAdmission(unittest.TestCase):
+
+    def test_client_rate_limit(self) -> None:
+        # クライアントごとに burst 回まで通り、超えたら次のトークンまでの秒数つきで 429 になることを確認。
+        admission = LabRunAdmission(client_rate=0.5, client_burst=2, max_concurrent_runs=None)
+        with mock.patch("services.lab_run_admission.time.monotonic", return_value=100.0) as monotonic:
+            admission.admit("ip:1", "foo")
+            admission.admit("ip:1", "foo")
+            with self.assertRaises(LabRunRejected) as cm:
+                admission.admit("ip:1", "foo")
+            self.assertEqual((cm.exception.status_code, cm.exception.retry_after), (429, 2.0))
+            # ほかのクライアントは別。
+            admission.admit("ip:2", "foo")
+
+            monotonic.return_value = 102.0
+            admission.admit("ip:1", "foo")
+
+    def test_concurrency_limit_and_queue(self) -> None:
+        # 上限を超えた分は待ち行列に入り、待ち行列もいっぱいなら 503 、空いたら順番に実行できることを確認。
+        admission = LabRunAdmission(client_rate=None, max_concurrent_runs=1, max_queued_runs=1)
+        first = admission.admit("ip:1", "foo")
+        second = admission.admit("ip:1", "foo")
+        self.assertTrue(first.granted)
+        self.assertFalse(second.granted)
+        with self.assertRaises(LabRunRejected) as cm:
+            admission.admit("ip:1", "foo")
+        self.assertEqual(cm.exception.status_code, 503)
+
+        async def scenario() -> None:
+            asyncio.get_running_loop().call_later(0.05, first.release)
+            await asyncio.wait_for(second.wait(), 1)
+
+        asyncio.run(scenario())
+        self.assertEqual((admission.running, admission.queued), (1, 0))
+        second.release()
+        self.assertEqual(admission.running, 0)
+
+    def test_queue_timeout(self) -> None:
+        # queue_timeout 秒待っても空かなければ 503 になり、待ち行列からも抜けることを確認。
+        admission = LabRunAdmission(client_rate=None, max_concurrent_runs=1, queue_timeout=0.05)
+        admission.admit("ip:1", "foo")
+        waiting = admission.admit("ip:1", "foo")
+        with self.assertRaises(LabRunRejected) as cm:
+            asyncio.run(waiting.wait())
+        self.assertEqual(cm.exception.reason, "queue_timeout")
+        waiting.release()
+        self.assertEqual((admission.running, admission.queued), (1, 0))
@@ -0,0 +1,44 @@
+"""
+services.tests.test_lab_run_broker
+"""
+
+import asyncio
+import os
+import tempfile
+import unittest
+
+from shared.stream_formatters import StreamFrame
+
+from ..lab_run_broker import LabRunBroker, LabRunBrokerPublisher, RemoteLabRun
+
+
+class TestLabRunBroker(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.socket_path = os.path.join(self._tmp.name, "broker.sock")
+
+    def test_publish_and_subscribe_across_connections(self) -> None:
+        # publish した run を別の接続から購読でき、 Last-Event-ID の続きから受け取れることを確認。
+        async def scenario() -> tuple[bool, bool, list[StreamFrame]]:
+            server = await LabRunBroker(self.socket_path).start()
+            async with server:
+                loop = asyncio.get_running_loop()
+                publisher = await LabRunBrokerPublisher.open(self.socket_path, "run-test")
+                # NOTE: lookup は同期のソケットを使うので、ブローカーと同じループを止めないようスレッドで呼ぶ。
+                found = await loop.run_in_executor(None, RemoteLabRun.lookup, self.socket_path, "run-test")
+                missing = await loop.run_in_executor(None, RemoteLabRun.lookup, self.socket_path, "run-nope")
+                for event_id in (1, 2):
+                    await publisher.send(event_id, f'{{"n": {event_id}}}'.encode())
+                stream = RemoteLabRun(self.socket_path, "run-test").astream(last_event_id=1)
+                received = [await stream.__anext__()]
+                await publisher.send(3, b'{"n": 3}')
+                await publisher.aclose()
+                received += [frame async for frame in stream]
+            return found is not None, missing is None, received
+
+        found, missing, received = asyncio.run(scenario())
+        self.assertTrue(found)
+        self.assertTrue(missing)
+        self.assertEqual([(frame.event_id, frame.data) for frame in received], [(2, b'{"n": 2}'), (3, b'{"n": 3}')])
@@ -0,0 +1,227 @@
+"""
+services.tests.test_lab_run_manager
+"""
+
+import asyncio
+import unittest
+from functools import partial
+
+from shared.stream_formatters import StreamFrame
+
+from ..lab_run_manager import ActiveLabRun, LabRunManager
+from ..lab_run_replay_buffer import LabRunFrame, LabRunReplayBuffer
+
+
+def _frame(event_id: int, data: bytes) -> LabRunFrame:
+    return LabRunFrame(event_id, StreamFrame(data, event_id=event_id), 0.0)
+
+
+class TestLabRunReplayBuffer(unittest.TestCase):
+
+    def test_evicts_by_frames_and_bytes(self) -> None:
+        # 件数・バイト数の上限を超えたら古い順に捨てることを確認。
+        buffer = LabRunReplayBuffer(max_frames=3, max_bytes=10, ttl=None)
+        for event_id in range(1, 5):
+            buffer.append(_frame(event_id, b"abc"))
+        self.assertEqual([frame.event_id for frame in buffer.frames_after(None)], [2, 3, 4])
+        buffer.append(_frame(5, b"abcdef"))
+        self.assertEqual([frame.event_id for frame in buffer.frames_after(None)], [4, 5])
+
+    def test_evicts_by_ttl(self) -> None:
+        # ttl 秒より古いフレームは捨てることを確認。
+        buffer = LabRunReplayBuffer(ttl=10)
+        buffer.append(LabRunFrame(1, StreamFrame(b"old", event_id=1), 0.0))
+        buffer.append(LabRunFrame(2, StreamFrame(b"new", event_id=2), 11.0))
+        self.assertEqual(len(buffer), 1)
+
+    def test_frames_after(self) -> None:
+        # last_event_id より後のフレームだけ返すことを確認。
+        buffer = LabRunReplayBuffer(ttl=None)
+        for event_id in range(1, 6):
+            buffer.append(_frame(event_id, b"x"))
+        self.assertEqual([frame.event_id for frame in buffer.frames_after(3)], [4, 5])
+        self.assertEqual(buffer.frames_after(5), [])
+
+
+class TestActiveLabRun(unittest.TestCase):
+
+    def _create_run(self) -> ActiveLabRun:
+        return ActiveLabRun("run-test", "rq-12345678", "foo", {}, LabRunReplayBuffer(ttl=None))
+
+    def test_frames_carry_increasing_event_ids(self) -> None:
+        # フレームに 1 からの連番の id がつくことを確認。
+        run = self._create_run()
+
+        async def scenario() -> list[StreamFrame]:
+            await run.publish(partial(run.encoder.message, "one"))
+            await run.publish(partial(run.encoder.message, "two"))
+            run.finish()
+            return [frame async for frame in run.astream()]
+
+        frames = asyncio.run(scenario())
+        self.assertEqual([frame.event_id for frame in frames], [1, 2])
+
+    def test_resume_replays_missed_frames_then_goes_live(self) -> None:
+        # 再接続したら、取りこぼした分を再送してからライブのフレームにつながることを確認。
+        run = self._create_run()
+
+        async def scenario() -> list[StreamFrame]:
+            for message in ["one", "two", "three"]:
+                await run.publish(partial(run.encoder.message, message))
+            stream = run.astream(last_event_id=1)
+            received = [await stream.__anext__(), await stream.__anext__()]
+            await run.publish(partial(run.encoder.message, "four"))
+            run.finish()
+            received += [frame async for frame in stream]
+            return received
+
+        frames = asyncio.run(scenario())
+        self.assertEqual([frame.event_id for frame in frames], [2, 3, 4])
+        self.assertIn(b'"message": "four"', frames[-1].data)
+
+    def test_resume_ahead_of_the_run_skips_frames_up_to_last_event_id(self) -> None:
+        # run がまだ last_event_id まで進んでいないうちに再接続しても、そこまでのフレームは送らないことを確認。
+        run = self._create_run()
+
+        async def scenario() -> list[StreamFrame]:
+            stream = run.astream(last_event_id=2)
+            # NOTE: 先に購読させてから publish する。
+            first = asyncio.ensure_future(stream.__anext__())
+            await asyncio.sleep(0)
+            for message in ["one", "two", "three"]:
+                await run.publish(partial(run.encoder.message, message))
+            run.finish()
+            return [await first] + [frame async for frame in stream]
+
+        frames = asyncio.run(scenario())
+        self.assertEqual([frame.event_id for frame in frames], [3])
+
+    def test_fan_out_to_many_subscribers(self) -> None:
+        # 購読者全員に同じフレームが届くことを確認。
+        run = self._create_run()
+
+        async def scenario() -> list[list[StreamFrame]]:
+            streams = [run.astream(), run.astream()]
+            await run.publish(partial(run.encoder.message, "one"))
+            received: list[list[StreamFrame]] = [[await stream.__anext__()] for stream in streams]
+            await run.publish(partial(run.encoder.message, "two"))
+            run.finish()
+            for frames, stream in zip(received, streams):
+                frames += [frame async for frame in stream]
+            return received
+
+        received = asyncio.run(scenario())
+        self.assertEqual(len(received[0]), 2)
+        self.assertEqual(received[0], received[1])
+
+    def test_slow_subscriber_policies(self) -> None:
+        # キューが溢れたら、 drop_oldest なら古いフレームを捨て、 disconnect なら切断することを確認。
+        async def scenario(policy: str) -> tuple[bool, int]:
+            run = ActiveLabRun(
+                "run-test", "rq-12345678", "foo", {}, LabRunReplayBuffer(ttl=None),
+                subscriber_queue_size=2, slow_subscriber_policy=policy,
+            )
+            _, channel = run.subscribe()
+            for message in ["one", "two", "three"]:
+                await run.publish(partial(run.encoder.message, message))
+            oldest = channel.get_nowait()
+            assert oldest is not None
+            return oldest.event_id == 2, run.subscriber_count
+
+        self.assertEqual(asyncio.run(scenario("drop_oldest")), (True, 1))
+        self.assertEqual(asyncio.run(scenario("disconnect")), (False, 0))
+
+
+class TestLabRunManagerReaper(unittest.TestCase):
+
+    def test_reaps_orphaned_runs(self) -> None:
+        # 購読者のいないまま orphan_run_timeout を過ぎた run だけがキャンセルされることを確認。
+        manager = LabRunManager(orphan_run_timeout=0.05, max_run_idle=None, max_run_lifetime=None)
+        orphaned = ActiveLabRun("run-orphaned", "rq-12345678", "foo", {}, LabRunReplayBuffer(ttl=None))
+        watched = ActiveLabRun("run-watched", "rq-12345678", "foo", {}, LabRunReplayBuffer(ttl=None))
+        manager._runs = {orphaned.run_id: orphaned, watched.run_id: watched}
+
+        async def scenario() -> None:
+            for run in (orphaned, watched):
+                run.task = asyncio.ensure_future(asyncio.sleep(10))
+            watched.subscribe()
+            await asyncio.sleep(0.1)
+            manager.reap()
+            await asyncio.sleep(0)
+            self.assertTrue(orphaned.task.cancelled())
+            self.assertFalse(watched.task.cancelled())
+            watched.task.cancel()
+
+        asyncio.run(scenario())
+        self.assertEqual(orphaned.cancel_reason, "no subscribers for 0.05 seconds")
+        self.assertIsNone(watched.cancel_reason)
+
+    def test_cancels_abandoned_run_after_grace_period(self) -> None:
+        # resumable でない run は、最後の購読者が抜けてから abandoned_run_grace_period 秒で reaper を待たずに
+        # キャンセルされ、 resumable な run はされないことを確認。
+        async def scenario(resumable: bool) -> str | None:
+            run = ActiveLabRun(
+                "run-test",
+                "rq-12345678",
+                "foo",
+                {},
+                LabRunReplayBuffer(ttl=None),
+                resumable=resumable,
+                abandoned_run_grace_period=0.05,
+            )
+            run.task = asyncio.ensure_future(asyncio.sleep(10))
+            stream = run.astream()
+            await run.publish(partial(run.encoder.message, "one"))
+            await stream.__anext__()
+            await stream.aclose()
+            await asyncio.sleep(0.01)
+            # NOTE: 猶予のうちは止めない。
+            self.assertFalse(run.task.done())
+            await asyncio.sleep(0.1)
+            cancelled = run.task.cancelled()
+            run.task.cancel()
+            return run.cancel_reason if cancelled else None
+
+        self.assertEqual(asyncio.run(scenario(resumable=False)), "client went away")
+        self.assertIsNone(asyncio.run(scenario(resumable=True)))
+
+    def test_reconnecting_within_grace_period_gets_live_tail(self) -> None:
+        # resumable でない run でも、猶予のうちに Last-Event-ID で再接続すれば止まらず、
+        # 取りこぼした分とそのあとのライブのフレームを受け取れることを確認。
+        async def scenario() -> list[int]:
+            run = ActiveLabRun(
+                "run-test",
+                "rq-12345678",
+                "foo",
+                {},
+                LabRunReplayBuffer(ttl=None),
+                resumable=False,
+                abandoned_run_grace_period=0.05,
+            )
+            run.task = asyncio.ensure_future(asyncio.sleep(10))
+            stream = run.astream()
+            await run.publish(partial(run.encoder.message, "one"))
+            first = await stream.__anext__()
+            await stream.aclose()
+            await run.publish(partial(run.encoder.message, "two"))
+
+            stream = run.astream(last_event_id=first.event_id)
+            received = [(await stream.__anext__()).event_id]
+            await asyncio.sleep(0.1)
+            self.assertFalse(run.task.done())
+            await run.publish(partial(run.encoder.message, "three"))
+            received.append((await stream.__anext__()).event_id)
+            await stream.aclose()
+            run.task.cancel()
+            self.assertIsNone(run.cancel_reason)
+            return received
+
+        self.assertEqual(asyncio.run(scenario()), [2, 3])
+
+    def test_reaps_abandoned_run_after_grace_period(self) -> None:
+        # reaper も、 abandoned_run_grace_period を過ぎた run だけを止めることを確認。
+        manager = LabRunManager(orphan_run_timeout=None, max_run_idle=None, max_run_lifetime=None)
+        run = ActiveLabRun("run-test", "rq-12345678", "foo", {}, LabRunReplayBuffer(ttl=None))
+        run.abandoned_at = 100.0
+        self.assertIsNone(manager._reap_reason(run, 104.0))
+        self.assertEqual(manager._reap_reason(run, 105.0), ("abandoned", "client went away"))
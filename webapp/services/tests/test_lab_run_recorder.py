@@ -0,0 +1,89 @@
+"""
+services.tests.test_lab_run_recorder
+"""
+
+from datetime import datetime, timedelta, timezone
+
+from django.test import TestCase
+
+from app.models import LabRun
+from shared.stream_formatters import StreamFrame, StreamFrameEncoder
+
+from ..lab_run_history_service import LabRunHistoryService
+from ..lab_run_recorder import LabRunRecorder
+
+
+class TestLabRunRecorder(TestCase):
+
+    def test_flush_writes_run_and_frames(self) -> None:
+        # 開始・フレーム・終了がまとめて書かれ、フレームの data が JSON で残ることを確認。
+        recorder = LabRunRecorder(batch_size=2)
+        # NOTE: TestCase のトランザクションの中で確認したいので、バックグラウンドのスレッドは使わずに flush する。
+        recorder._ensure_writer = lambda: None
+        encoder = StreamFrameEncoder("rq-1", module="foo")
+
+        recorder.run_started("run-1", "rq-1", "foo", {"arg1": "1"})
+        recorder.record_frame("run-1", 1, encoder.message("hello", event_id=1))
+        recorder.record_frame("run-1", 2, encoder.messages(["a", "b"], event_id=2))
+        # NOTE: ブローカー経由のフレームには payload が無いので data をデコードする。壊れていたら残さない。
+        recorder.record_frame("run-1", 3, StreamFrame(b'{"requestId": "rq-1", "data": {"message": "x"}}'))
+        recorder.record_frame("run-1", 4, StreamFrame(b"{broken"))
+        recorder.run_finished("run-1", "completed", "", 3, 0.5)
+        recorder.flush()
+
+        run = LabRun.objects.get(run_id="run-1")
+        self.assertEqual((run.module, run.args, run.status), ("foo", {"arg1": "1"}, "completed"))
+        self.assertEqual((run.frame_count, run.duration_ms), (3, 500.0))
+        events = list(run.events.all())
+        self.assertEqual([event.event_id for event in events], [1, 2, 3])
+        self.assertEqual(events[0].data["data"]["message"], "hello")
+        self.assertEqual(events[1].data["data"]["messages"], ["a", "b"])
+        self.assertEqual(events[2].data["data"]["message"], "x")
+
+    def test_drops_when_queue_is_full(self) -> None:
+        # キューが溢れたら待たずに捨てて、件数を数えることを確認。
+        recorder = LabRunRecorder(queue_size=1)
+        recorder._ensure_writer = lambda: None
+        recorder.run_started("run-1", "rq-1", "foo", {})
+        recorder.run_started("run-2", "rq-2", "foo", {})
+        self.assertEqual(recorder.dropped, 1)
+        recorder.flush()
+        self.assertEqual(recorder.dropped, 0)
+        self.assertEqual(list(LabRun.objects.values_list("run_id", flat=True)), ["run-1"])
+
+
+class TestLabRunHistoryService(TestCase):
+
+    def setUp(self) -> None:
+        started_at = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        # NOTE: 同じ started_at の run を混ぜて、 id でも並ぶことを確認する。
+        for i, offset in enumerate([0, 1, 1, 1, 2]):
+            LabRun.objects.create(
+                run_id=f"run-{i}",
+                request_id=f"rq-{i}",
+                module="foo" if i % 2 == 0 else "bar",
+                started_at=started_at + timedelta(seconds=offset),
+            )
+
+    def test_keyset_pagination(self) -> None:
+        # cursor をたどると、新しい順に重複も抜けもなく全部返ることを確認。
+        service = LabRunHistoryService()
+        run_ids = []
+        cursor = None
+        pages = 0
+        while True:
+            runs, cursor = service.list_runs(cursor=cursor, limit=2)
+            run_ids.extend(run.run_id for run in runs)
+            pages += 1
+            if cursor is None:
+                break
+        self.assertEqual(run_ids, ["run-4", "run-3", "run-2", "run-1", "run-0"])
+        self.assertEqual(pages, 3)
+
+    def test_filter_and_invalid_cursor(self) -> None:
+        service = LabRunHistoryService()
+        runs, cursor = service.list_runs(module_name="bar")
+        self.assertEqual([run.run_id for run in runs], ["run-3", "run-1"])
+        self.assertIsNone(cursor)
+        with self.assertRaises(ValueError):
+            service.list_runs(cursor="not-a-cursor")
@@ -0,0 +1,209 @@
+"""
+sync / async のイテレータを相互に変換したり、まとめたりするユーティリティ。
+"""
+import asyncio
+from typing import AsyncIterator, Iterator, TypeVar
+
+from asgiref.sync import sync_to_async
+
+T = TypeVar("T")
+
+# NOTE: next() は StopIteration を await の外に投げられない (RuntimeError になる) ので、番兵を返してもらう。
+_EXHAUSTED = object()
+
+
+def _next_or_exhausted(iterator: Iterator[T]) -> T | object:
+    return next(iterator, _EXHAUSTED)
+
+
+async def aiterate_sync_iterator(iterator: Iterator[T]) -> AsyncIterator[T]:
+    """
+    同期イテレータを async for で回せるようにする。
+    next() の呼び出しだけをスレッドプールに逃がすので、 time.sleep するジェネレータでもイベントループは止まらない。
+
+    Args:
+        iterator (Iterator[T]): 同期イテレータ。
+
+    Yields:
+        T: iterator が返す値。
+    """
+    # NOTE: thread_sensitive=False にしないと、全ストリームがひとつのスレッドに直列化されてしまう。
+    next_async = sync_to_async(_next_or_exhausted, thread_sensitive=False)
+    try:
+        while True:
+            item = await next_async(iterator)
+            if item is _EXHAUSTED:
+                return
+            yield item  # type: ignore[misc]
+    finally:
+        # NOTE: 途中で閉じられたら、元のジェネレータも閉じて finally を走らせる。
+        #       スレッドで next() している途中だと閉じられない (ValueError) ので、そのときは GC に任せる。
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            try:
+                close()
+            except ValueError:
+                pass
+
+
+def iterate_async_iterator_sync(aiterator: AsyncIterator[T]) -> Iterator[T]:
+    """
+    async イテレータを普通の for で回せるようにする。
+    WSGI では StreamingHttpResponse に async イテレータを渡すと全部バッファされてしまうので、
+    専用のイベントループを呼び出し元のスレッドで回しながら一件ずつ取り出す。
+
+    Args:
+        aiterator (AsyncIterator[T]): async イテレータ。
+
+    Yields:
+        T: aiterator が返す値。
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(aiterator.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        # NOTE: クライアント切断などで途中で閉じられたときも、 async ジェネレータの finally を走らせる。
+        aclose = getattr(aiterator, "aclose", None)
+        if aclose is not None:
+            loop.run_until_complete(aclose())
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+
+async def coalesce(aiterator: AsyncIterator[T], max_latency: float, max_batch_size: int) -> AsyncIterator[list[T]]:
+    """
+    async イテレータの値を、一定時間 or 一定件数ごとにまとめて list で返す。
+    バッチの最初の値が来てから max_latency 秒たつか、 max_batch_size 件たまった時点で吐き出す。
+    値が来ない間は何も返さない (空のバッチは返さない) 。
+
+    Args:
+        aiterator (AsyncIterator[T]): まとめたい async イテレータ。
+        max_latency (float): バッチの最初の値を最大何秒待たせてよいか。
+        max_batch_size (int): 1 バッチの最大件数。
+
+    Yields:
+        list[T]: まとめた値。
+    """
+    loop = asyncio.get_running_loop()
+    batch: list[T] = []
+    deadline = 0.0
+    # NOTE: 待ち時間切れのたびに __anext__ をキャンセルすると元のジェネレータが壊れるので、
+    #       取りに行っている途中の Future は次のバッチに持ち越す。
+    pending: asyncio.Future | None = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(aiterator.__anext__())
+            timeout = max(0.0, deadline - loop.time()) if batch else None
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                yield batch
+                batch = []
+                continue
+
+            completed, pending = pending, None
+            try:
+                item = completed.result()
+            except StopAsyncIteration:
+                break
+            except Exception:
+                # 溜まっている分を先に返してから例外を伝える。
+                if batch:
+                    yield batch
+                raise
+
+            if not batch:
+                deadline = loop.time() + max_latency
+            batch.append(item)
+            if len(batch) >= max_batch_size:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+
+class StreamLimitExceeded(Exception):
+    """
+    keepalive の max_idle / max_lifetime に達した。
+    """
+
+
+async def keepalive(
+    aiterator: AsyncIterator[T],
+    heartbeat: T,
+    heartbeat_interval: float | None,
+    max_idle: float | None = None,
+    max_lifetime: float | None = None,
+) -> AsyncIterator[T]:
+    """
+    async イテレータの値が heartbeat_interval 秒来なければ、代わりに heartbeat を返す。
+    SSE なら heartbeat にコメント行 (": ping") を渡すと、プロキシにアイドルで切られず、
+    クライアントがいなくなったことにも次の heartbeat の write で気づける。
+    max_idle 秒 (heartbeat は数えない) 値が来ないか、始まってから max_lifetime 秒たったらストリームを終える。
+
+    Args:
+        aiterator (AsyncIterator[T]): 元の async イテレータ。
+        heartbeat (T): 値が来ない間に返すもの。
+        heartbeat_interval (float | None): heartbeat を返す間隔 (秒) 。 None なら返さない。
+        max_idle (float | None): 値が来ないまま待つ最大の秒数。 None なら無制限。
+        max_lifetime (float | None): ストリーム全体の最大の秒数。 None なら無制限。
+
+    Yields:
+        T: aiterator が返す値か heartbeat 。
+
+    Raises:
+        StreamLimitExceeded: max_idle / max_lifetime に達した場合
+    """
+    loop = asyncio.get_running_loop()
+    started_at = last_item_at = loop.time()
+    # NOTE: coalesce と同じく、取りに行っている途中の __anext__ はキャンセルせずに持ち越す。
+    pending: asyncio.Future | None = None
+    try:
+        while True:
+            now = loop.time()
+            deadlines = [
+                deadline
+                for deadline in (
+                    None if heartbeat_interval is None else now + heartbeat_interval,
+                    None if max_idle is None else last_item_at + max_idle,
+                    None if max_lifetime is None else started_at + max_lifetime,
+                )
+                if deadline is not None
+            ]
+            if pending is None:
+                pending = asyncio.ensure_future(aiterator.__anext__())
+            timeout = max(0.0, min(deadlines) - now) if deadlines else None
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                now = loop.time()
+                if max_idle is not None and now - last_item_at >= max_idle:
+                    raise StreamLimitExceeded(f"no data for {max_idle} seconds")
+                if max_lifetime is not None and now - started_at >= max_lifetime:
+                    raise StreamLimitExceeded(f"stream lasted {max_lifetime} seconds")
+                yield heartbeat
+                continue
+
+            completed, pending = pending, None
+            try:
+                item = completed.result()
+            except StopAsyncIteration:
+                return
+            last_item_at = loop.time()
+            yield item
+    finally:
+        # NOTE: 途中で閉じられた (クライアントが切断した・上限に達した) ときは、元のイテレータも閉じる。
+        #       モジュールのジェネレータまでキャンセルが伝わって、スレッドやプロセスが早く空く。
+        if pending is not None:
+            pending.cancel()
+            await asyncio.gather(pending, return_exceptions=True)
+        aclose = getattr(aiterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
@@ -0,0 +1,213 @@
+"""
+スレッドとイベントループをまたいで使える、上限つきのキュー。
+test: shared.tests.test_channels
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Generic, TypeVar
+
+T = TypeVar("T")
+
+
+class ChannelClosed(Exception):
+    """
+    close 済みのチャンネルに put したとき、あるいは close 済みで空のチャンネルから get したときに投げる例外。
+    """
+
+
+class ChannelFull(Exception):
+    """
+    put_nowait でチャンネルがいっぱいだったときに投げる例外。
+    """
+
+
+class ChannelTimeout(Exception):
+    """
+    get/put が timeout までに完了しなかったときに投げる例外。
+    """
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class BoundedChannel(Generic[T]):
+    """
+    上限 (high-water mark) つきの FIFO キュー。
+    - put/get は同期 (スレッドをブロック) 、 aput/aget は async (イベントループ上で待つ) 。どの組み合わせでも使える。
+    - いっぱいになると put/aput が待たされるので、遅い consumer が producer を自然に止める (backpressure) 。
+    - close するとそれ以降の put は ChannelClosed 。 get は残りを取り出しきってから ChannelClosed 。
+
+    NOTE: queue.Queue は async で待てないし、 asyncio.Queue はスレッドセーフではないので自前で用意している。
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        if maxsize <= 0:
+            raise ValueError("maxsize must be a positive integer.")
+        self.maxsize = maxsize
+        self._items: deque[T] = deque()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        # async で待っている getter/putter 。 (待っているループ, Future) のリスト。
+        self._async_getters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self._async_putters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def qsize(self) -> int:
+        with self._lock:
+            return len(self._items)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def close(self) -> None:
+        """
+        チャンネルを閉じて、待っている全員を起こす。何回呼んでも OK 。
+        """
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+            self._wake(self._async_getters)
+            self._wake(self._async_putters)
+
+    def put(self, item: T, timeout: float | None = None) -> None:
+        """
+        アイテムを入れる。いっぱいなら空くまで待つ。
+
+        Raises:
+            ChannelClosed: チャンネルが close されている場合
+            ChannelTimeout: timeout 秒待っても空かなかった場合
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while not self._closed and len(self._items) >= self.maxsize:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise ChannelTimeout()
+                self._not_full.wait(remaining)
+            self._put_locked(item)
+
+    def put_nowait(self, item: T) -> None:
+        """
+        アイテムを入れる。いっぱいなら待たずに ChannelFull 。
+
+        Raises:
+            ChannelClosed: チャンネルが close されている場合
+            ChannelFull: チャンネルがいっぱいの場合
+        """
+        with self._lock:
+            if not self._closed and len(self._items) >= self.maxsize:
+                raise ChannelFull()
+            self._put_locked(item)
+
+    async def aput(self, item: T) -> None:
+        """
+        put の async 版。
+
+        Raises:
+            ChannelClosed: チャンネルが close されている場合
+        """
+        while True:
+            with self._lock:
+                if self._closed or len(self._items) < self.maxsize:
+                    self._put_locked(item)
+                    return
+                future = self._add_async_waiter(self._async_putters)
+            await self._await_waiter(future, self._async_putters)
+
+    def get(self, timeout: float | None = None) -> T:
+        """
+        アイテムを取り出す。空なら入るまで待つ。
+
+        Raises:
+            ChannelClosed: チャンネルが close 済みで、もう取り出すものがない場合
+            ChannelTimeout: timeout 秒待っても何も入らなかった場合
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while not self._items:
+                if self._closed:
+                    raise ChannelClosed()
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise ChannelTimeout()
+                self._not_empty.wait(remaining)
+            return self._get_locked()
+
+    def get_nowait(self) -> T | None:
+        """
+        アイテムを取り出す。空なら待たずに None 。
+
+        Raises:
+            ChannelClosed: チャンネルが close 済みで、もう取り出すものがない場合
+        """
+        with self._lock:
+            if self._items:
+                return self._get_locked()
+            if self._closed:
+                raise ChannelClosed()
+            return None
+
+    async def aget(self) -> T:
+        """
+        get の async 版。
+
+        Raises:
+            ChannelClosed: チャンネルが close 済みで、もう取り出すものがない場合
+        """
+        while True:
+            with self._lock:
+                if self._items:
+                    return self._get_locked()
+                if self._closed:
+                    raise ChannelClosed()
+                future = self._add_async_waiter(self._async_getters)
+            await self._await_waiter(future, self._async_getters)
+
+    def _put_locked(self, item: T) -> None:
+        if self._closed:
+            raise ChannelClosed()
+        self._items.append(item)
+        self._not_empty.notify()
+        self._wake(self._async_getters)
+
+    def _get_locked(self) -> T:
+        item = self._items.popleft()
+        self._not_full.notify()
+        self._wake(self._async_putters)
+        return item
+
+    @staticmethod
+    def _add_async_waiter(waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]]) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiters.append((loop, future))
+        return future
+
+    async def _await_waiter(
+        self, future: asyncio.Future, waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]]
+    ) -> None:
+        try:
+            await future
+        finally:
+            # NOTE: キャンセルされたときに、起こされることのない Future が残らないように。
+            with self._lock:
+                waiters[:] = [waiter for waiter in waiters if waiter[1] is not future]
+
+    @staticmethod
+    def _wake(waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]]) -> None:
+        # NOTE: 別スレッドのループの Future を直接触るのは NG なので call_soon_threadsafe で起こす。
+        #       起きた側がもう一度条件を確認するので、全員起こしてしまって問題ない。
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_resolve, future)
+            except RuntimeError:
+                # ループがもう閉じている。
+                pass
+        waiters.clear()
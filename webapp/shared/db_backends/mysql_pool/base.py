@@ -0,0 +1,112 @@
+"""
+接続プール (shared.db_pool) つきの MySQL バックエンド。
+Django の mysql バックエンドはリクエストごとに接続を開いて閉じるので、毎回 TCP と認証のやり取りがかかる。
+このバックエンドは、 Django が接続を閉じる代わりにプールへ返して、次のリクエストで使い回す。
+
+settings.DATABASES での使い方 (postgresql バックエンドの OPTIONS['pool'] と同じ形) :
+    'default': {
+        'ENGINE': 'shared.db_backends.mysql_pool',
+        ...
+        # NOTE: プールに返すのはリクエストの終わりに接続を閉じたとき。 0 (リクエストごとに閉じる) にしておくこと。
+        'CONN_MAX_AGE': 0,
+        # True ならデフォルト。キーは shared.db_pool.ConnectionPool の引数と pre_ping 。
+        'OPTIONS': {'pool': {'pool_size': 5, 'max_overflow': 10, 'timeout': 10, 'pre_ping': True, ...}},
+    }
+
+- WSGI: リクエストのスレッドが接続を借りて、 request_finished (close_old_connections) で返す。
+- ASGI (config.asgi): async view の ORM は sync_to_async のスレッドで動く。接続はそのスレッドが借りて、
+  同じく request_finished で返す。プールはスレッドをまたいで共有するので、 async view 同士でも使い回せる。
+  NOTE: 借りるのを待つのは sync_to_async のスレッドなので、イベントループは止まらない。
+- リクエストの外のスレッド (services.lab_run_recorder など) も close_old_connections を呼べばプールに返る。
+プールのメトリクスは GET /api/app/metrics の db_pool_* 。
+"""
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.mysql import base as mysql_base
+
+from shared.db_pool import ConnectionPool, PoolTimeout
+
+Database = mysql_base.Database
+
+
+class DatabaseWrapper(mysql_base.DatabaseWrapper):
+    # alias → (プールを作ったときの接続パラメータ, プール) 。プロセスで共有する。
+    _connection_pools: dict[str, tuple[dict, ConnectionPool]] = {}
+    _connection_pools_lock = threading.Lock()
+
+    @property
+    def pool(self) -> ConnectionPool | None:
+        pool_options = self.settings_dict["OPTIONS"].get("pool")
+        if not pool_options:
+            return None
+        if self.settings_dict.get("CONN_MAX_AGE", 0) != 0:
+            raise ImproperlyConfigured("Pooling doesn't support persistent connections.")
+
+        conn_params = self.get_connection_params()
+        with self._connection_pools_lock:
+            entry = self._connection_pools.get(self.alias)
+            if entry is not None and entry[0] == conn_params:
+                return entry[1]
+            # NOTE: テストでデータベース名が test_ つきに変わったときなど、接続先が変わったら作り直す。
+            if entry is not None:
+                entry[1].close_all()
+            options = {} if pool_options is True else dict(pool_options)
+            # pre_ping: 貸し出す前に ping して、切れた接続 (wait_timeout を過ぎたものなど) を渡さない。
+            pre_ping = options.pop("pre_ping", True)
+            pool = ConnectionPool(
+                connect=lambda: super(DatabaseWrapper, self).get_new_connection(conn_params),
+                close=lambda connection: connection.close(),
+                ping=(lambda connection: connection.ping()) if pre_ping else None,
+                reset=_rollback,
+                name=self.alias,
+                **options,
+            )
+            self._connection_pools[self.alias] = (conn_params, pool)
+            return pool
+
+    def close_pool(self) -> None:
+        with self._connection_pools_lock:
+            entry = self._connection_pools.pop(self.alias, None)
+        if entry is not None:
+            entry[1].close_all()
+
+    def get_connection_params(self) -> dict:
+        conn_params = super().get_connection_params()
+        # NOTE: OPTIONS はそのまま MySQLdb.connect に渡されるので、プールの設定は抜いておく。
+        conn_params.pop("pool", None)
+        return conn_params
+
+    def get_new_connection(self, conn_params: dict):
+        pool = self.pool
+        if pool is None:
+            return super().get_new_connection(conn_params)
+        try:
+            return pool.checkout()
+        except PoolTimeout as e:
+            # NOTE: Database のエラーにしておくと、 wrap_database_errors で django.db.OperationalError になる。
+            raise Database.OperationalError(str(e)) from e
+
+    def _close(self) -> None:
+        pool = self.pool
+        if self.connection is None or pool is None:
+            return super()._close()
+        # 例外の後など、使えなくなっているかもしれない接続は使い回さない。
+        discard = self.errors_occurred and not self.is_usable()
+        with self.wrap_database_errors:
+            pool.checkin(self.connection, discard=discard)
+            # NOTE: atomic の途中で閉じられても、返した接続はもう使えない。
+            self.connection = None
+
+    def close_if_health_check_failed(self) -> None:
+        if self.pool is not None:
+            # NOTE: プールが貸し出すときに ping しているので、ここでは確かめない。
+            return
+        super().close_if_health_check_failed()
+
+
+def _rollback(connection) -> None:
+    """
+    返された接続に残っているトランザクションを捨てる (atomic の途中で閉じられた場合など) 。
+    """
+    connection.rollback()
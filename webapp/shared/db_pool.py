@@ -0,0 +1,266 @@
+"""
+DB 接続のプール。 Django の DB バックエンド (shared.db_backends.mysql_pool) から使う。
+- pool_size 本までの接続を使い回す。足りなければ max_overflow 本まで追加で開き、返されたら閉じる。
+- 全部使われていたら、空くまで timeout 秒待つ。それでも空かなければ PoolTimeout 。
+- 開いてから recycle 秒たった接続・ max_idle 秒使われなかった接続は、次に触ったときに閉じて開き直す。
+- 貸し出す前に ping して (pre-ping) 、切れていたら捨てて別の接続を使う。
+- 使用中・待っている数・貸し出しまでの時間を shared.metrics に出す。
+どのスレッドからでも使える。 Django には依存しない。
+test: shared.tests.test_db_pool
+"""
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Generic, TypeVar
+
+from shared.metrics import registry
+
+T = TypeVar("T")
+
+CONNECTIONS_IN_USE = registry.gauge("db_pool_connections_in_use", "DB connections checked out of the pool.", ("pool",))
+CONNECTIONS_IDLE = registry.gauge("db_pool_connections_idle", "Idle DB connections kept in the pool.", ("pool",))
+CHECKOUTS_WAITING = registry.gauge("db_pool_checkouts_waiting", "Callers waiting for a free DB connection.", ("pool",))
+CHECKOUT_DURATION = registry.histogram(
+    "db_pool_checkout_seconds", "Time to check a DB connection out of the pool.", ("pool",)
+)
+CHECKOUT_TIMEOUTS = registry.counter(
+    "db_pool_checkout_timeouts_total", "Checkouts that gave up waiting for a free DB connection.", ("pool",)
+)
+CONNECTIONS_DISCARDED = registry.counter(
+    "db_pool_connections_discarded_total", "DB connections closed by the pool.", ("pool", "reason")
+)
+
+
+class PoolTimeout(Exception):
+    """
+    timeout 秒待っても接続が空かなかったときに投げる例外。
+    """
+
+
+class _PooledConnection(Generic[T]):
+    __slots__ = ("connection", "created_at", "returned_at")
+
+    def __init__(self, connection: T, now: float) -> None:
+        self.connection = connection
+        self.created_at = now
+        self.returned_at = now
+
+
+class ConnectionPool(Generic[T]):
+    """
+    上限つきの接続プール。 checkout で借りて、使い終わったら必ず checkin で返す。
+    NOTE: 空いている接続は最後に返されたものから貸す (LIFO) 。
+          負荷が下がったときに余った接続が max_idle で閉じられて、プールが自然に縮む。
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], T],
+        close: Callable[[T], None],
+        ping: Callable[[T], None] | None = None,
+        reset: Callable[[T], None] | None = None,
+        pool_size: int = 5,
+        max_overflow: int = 10,
+        timeout: float = 10.0,
+        recycle: float | None = 3600.0,
+        max_idle: float | None = 600.0,
+        name: str = "default",
+    ) -> None:
+        """
+        Args:
+            connect (Callable[[], T]): 接続を開く関数
+            close (Callable[[T], None]): 接続を閉じる関数
+            ping (Callable[[T], None] | None): 接続が生きているか確かめる関数。切れていたら例外を投げること。
+                                               None なら確かめない。
+            reset (Callable[[T], None] | None): 返された接続をきれいにする関数 (ロールバックなど) 。
+                                                例外を投げたら、その接続は捨てる。
+            name (str): メトリクスの pool ラベル
+        """
+        self.connect = connect
+        self.close = close
+        self.ping = ping
+        self.reset = reset
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.max_idle = max_idle
+        self.name = name
+        self._idle: deque[_PooledConnection[T]] = deque()
+        self._in_use: dict[int, _PooledConnection[T]] = {}
+        # 開いている (使用中と空いているものと、いま開いている途中のもの) 接続の数。
+        self._opened = 0
+        self._waiting = 0
+        self._condition = threading.Condition()
+        # NOTE: fork した子プロセスで親の接続 (ソケット) を使うと壊れる。子では空のプールからやり直す。
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    @property
+    def in_use(self) -> int:
+        return len(self._in_use)
+
+    @property
+    def idle(self) -> int:
+        return len(self._idle)
+
+    def checkout(self) -> T:
+        """
+        接続を借りる。
+
+        Raises:
+            PoolTimeout: timeout 秒待っても接続が空かなかった場合
+            Exception: connect が投げた例外
+        """
+        started_at = time.monotonic()
+        deadline = started_at + self.timeout
+        try:
+            while True:
+                entry, expired = self._acquire(deadline)
+                for stale, reason in expired:
+                    self._close(stale, reason)
+                if entry is None:
+                    entry = self._open()
+                elif not self._is_alive(entry):
+                    continue
+                with self._condition:
+                    self._in_use[id(entry.connection)] = entry
+                    self._update_gauges_locked()
+                return entry.connection
+        finally:
+            CHECKOUT_DURATION.observe(time.monotonic() - started_at, pool=self.name)
+
+    def checkin(self, connection: T, discard: bool = False) -> None:
+        """
+        接続を返す。
+
+        Args:
+            discard (bool): True なら使い回さずに閉じる (壊れているとわかっている接続など) 。
+        """
+        with self._condition:
+            entry = self._in_use.pop(id(connection), None)
+        if entry is None:
+            # このプールから借りたものではない (fork の前に借りたものなど) 。
+            self.close(connection)
+            return
+        reason = "broken" if discard else self._expired_reason(entry, time.monotonic(), idle=False)
+        if reason is None and self.reset is not None:
+            try:
+                self.reset(connection)
+            except Exception:
+                reason = "broken"
+        with self._condition:
+            if reason is None and len(self._idle) >= self.pool_size:
+                reason = "overflow"
+            if reason is None:
+                entry.returned_at = time.monotonic()
+                self._idle.append(entry)
+            else:
+                self._opened -= 1
+            self._update_gauges_locked()
+            self._condition.notify()
+        if reason is not None:
+            self._close(entry, reason)
+
+    def close_all(self) -> None:
+        """
+        空いている接続を全部閉じる。使用中の接続は、返されたときに閉じずにプールに戻る。
+        """
+        with self._condition:
+            idle, self._idle = list(self._idle), deque()
+            self._opened -= len(idle)
+            self._update_gauges_locked()
+            self._condition.notify_all()
+        for entry in idle:
+            self._close(entry, "closed")
+
+    def _acquire(self, deadline: float) -> tuple[_PooledConnection[T] | None, list[tuple[_PooledConnection[T], str]]]:
+        """
+        空いている接続を取り出す。新しく開いてよいなら None (開く枠は確保済み) 。
+        ついでに見つけた、閉じるべき接続も返す。
+        """
+        expired: list[tuple[_PooledConnection[T], str]] = []
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                while self._idle:
+                    entry = self._idle.pop()
+                    reason = self._expired_reason(entry, now, idle=True)
+                    if reason is None:
+                        self._update_gauges_locked()
+                        return entry, expired
+                    self._opened -= 1
+                    expired.append((entry, reason))
+                if self._opened < self.pool_size + self.max_overflow:
+                    self._opened += 1
+                    self._update_gauges_locked()
+                    return None, expired
+                remaining = deadline - now
+                if remaining <= 0:
+                    CHECKOUT_TIMEOUTS.inc(pool=self.name)
+                    raise PoolTimeout(
+                        f"No free DB connection in pool '{self.name}' within {self.timeout} seconds "
+                        f"(pool_size={self.pool_size}, max_overflow={self.max_overflow})"
+                    )
+                self._waiting += 1
+                self._update_gauges_locked()
+                try:
+                    self._condition.wait(remaining)
+                finally:
+                    self._waiting -= 1
+                    self._update_gauges_locked()
+
+    def _open(self) -> _PooledConnection[T]:
+        try:
+            return _PooledConnection(self.connect(), time.monotonic())
+        except BaseException:
+            with self._condition:
+                self._opened -= 1
+                self._update_gauges_locked()
+                self._condition.notify()
+            raise
+
+    def _is_alive(self, entry: _PooledConnection[T]) -> bool:
+        """
+        pre-ping 。切れていたら閉じて False 。
+        """
+        if self.ping is None:
+            return True
+        try:
+            self.ping(entry.connection)
+            return True
+        except Exception:
+            with self._condition:
+                self._opened -= 1
+                self._update_gauges_locked()
+                self._condition.notify()
+            self._close(entry, "ping")
+            return False
+
+    def _expired_reason(self, entry: _PooledConnection[T], now: float, idle: bool) -> str | None:
+        if self.recycle is not None and now - entry.created_at > self.recycle:
+            return "recycle"
+        if idle and self.max_idle is not None and now - entry.returned_at > self.max_idle:
+            return "idle"
+        return None
+
+    def _close(self, entry: _PooledConnection[T], reason: str) -> None:
+        CONNECTIONS_DISCARDED.inc(pool=self.name, reason=reason)
+        try:
+            self.close(entry.connection)
+        except Exception:
+            # NOTE: もう切れている接続を閉じようとして失敗するのは、よくあること。
+            pass
+
+    def _update_gauges_locked(self) -> None:
+        CONNECTIONS_IN_USE.set(len(self._in_use), pool=self.name)
+        CONNECTIONS_IDLE.set(len(self._idle), pool=self.name)
+        CHECKOUTS_WAITING.set(self._waiting, pool=self.name)
+
+    def _reset_after_fork(self) -> None:
+        self._idle = deque()
+        self._in_use = {}
+        self._opened = 0
+        self._waiting = 0
+        self._condition = threading.Condition()
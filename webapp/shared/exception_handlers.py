@@ -31,7 +31,11 @@ def custom_exception_handler(exc: Exception, context: dict[str, Any]) -> Respons
     request_id = getattr(request, "request_id", "unknown")
 
     # 何であれエラーが発生した場合はロギング。
-    logger.exception(f"Exception occurred during processing request ID: {request_id}")
+    if getattr(exc, "wait", None) is not None:
+        # NOTE: Retry-After つきの拒否 (429, 503) は過負荷のときに大量に出るので、スタックトレースは出さない。
+        logger.warning(f"Request rejected: {request_id}: {exc}")
+    else:
+        logger.exception(f"Exception occurred during processing request ID: {request_id}")
 
     if response:
         # DRF のエラーレスポンスにも requestId, message を追加。
@@ -0,0 +1,104 @@
+"""
+モジュールごとの import 時間を測るタイマー。起動のどこで時間がかかっているかを見るために使う。
+python -X importtime と同じく、そのモジュール自身の時間 (self) と、中で import したものを含む時間 (cumulative) を出す。
+NOTE: 測れるのは start してから初めて import されたモジュールだけ。
+      ファイルから読み込むモジュール (.py, .pyc, 拡張モジュール) の、モジュールの実行 (exec_module) の時間を測る。
+
+使用例:
+timer = ImportTimer()
+timer.start()
+import django  # noqa
+timer.stop()
+print(timer.report())
+
+test: shared.tests.test_import_timer
+"""
+import importlib.machinery
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Callable
+
+_FILE_LOADERS = (
+    importlib.machinery.SourceFileLoader,
+    importlib.machinery.SourcelessFileLoader,
+    importlib.machinery.ExtensionFileLoader,
+)
+
+@dataclass
+class ImportTiming:
+    name: str
+    # そのモジュール自身の時間 (中で import したモジュールの分を除く) (秒) 。
+    self_seconds: float
+    # 中で import したモジュールの分も含めた時間 (秒) 。
+    cumulative_seconds: float
+
+
+class ImportTimer:
+    """
+    sys.meta_path の先頭に入って、見つかったモジュールの exec_module を時間を測るものに差し替えるクラス。
+    モジュールの探し方は変えない (後ろのファインダーにそのまま聞く) 。
+    """
+
+    def __init__(self) -> None:
+        self.timings: list[ImportTiming] = []
+        # import の入れ子ごとの、中で import したモジュールの時間の合計。スレッドごと。
+        self._local = threading.local()
+
+    def start(self) -> None:
+        if self not in sys.meta_path:
+            sys.meta_path.insert(0, self)  # type: ignore[arg-type]
+
+    def stop(self) -> None:
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)  # type: ignore[arg-type]
+
+    def find_spec(self, name: str, path: Any, target: Any = None) -> importlib.machinery.ModuleSpec | None:
+        for finder in sys.meta_path:
+            if finder is self:
+                continue
+            find_spec = getattr(finder, "find_spec", None)
+            if find_spec is None:
+                continue
+            spec = find_spec(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        loader = spec.loader
+        # NOTE: FileLoader はモジュールごとのインスタンスなので、差し替えてもほかのモジュールに影響しない。
+        #       組み込み・ frozen のローダーはクラスを共有しているので触らない (どちらにせよ速い) 。
+        if isinstance(loader, _FILE_LOADERS):
+            loader.exec_module = partial(self._timed_exec_module, name, loader.exec_module)  # type: ignore[method-assign]
+        return spec
+
+    def report(self, limit: int = 30) -> str:
+        """
+        self の時間が長い順に limit 件の表にする。
+        """
+        timings = sorted(self.timings, key=lambda timing: timing.self_seconds, reverse=True)
+        total = sum(timing.self_seconds for timing in self.timings)
+        lines = [
+            f"Imported {len(self.timings)} modules in {total * 1000:.1f} ms",
+            f"{'self [ms]':>12} | {'cumulative [ms]':>15} | module",
+        ]
+        for timing in timings[:limit]:
+            lines.append(
+                f"{timing.self_seconds * 1000:12.1f} | {timing.cumulative_seconds * 1000:15.1f} | {timing.name}"
+            )
+        return "\n".join(lines)
+
+    def _timed_exec_module(self, name: str, exec_module: Callable[[Any], None], module: Any) -> None:
+        stack: list[float] = self._local.__dict__.setdefault("stack", [])
+        stack.append(0.0)
+        started_at = time.perf_counter()
+        try:
+            exec_module(module)
+        finally:
+            cumulative = time.perf_counter() - started_at
+            children = stack.pop()
+            if stack:
+                stack[-1] += cumulative
+            self.timings.append(ImportTiming(name, cumulative - children, cumulative))
@@ -0,0 +1,53 @@
+"""
+ロガーごとにかけるフィルタ。
+test: shared.tests.test_logging_handlers
+"""
+import threading
+import time
+from logging import INFO, Filter, LogRecord
+
+# 覚えておくメッセージの種類の上限。超えたら、間引いていないものを忘れる。
+_MAX_BUCKETS = 1024
+
+
+class RateLimitFilter(Filter):
+    """
+    同じメッセージ (logger.info("... %s", value) の "... %s" の部分) ごとに、
+    1 秒あたり rate 件 (瞬間的には burst 件) までしか通さないフィルタ (トークンバケット) 。
+    SSE のフレームごとのログのように、大量に出る同じ形のログを間引くのに使う。
+    - max_level より上 (WARNING など) は間引かない。
+    - 間引いた件数は、次に通ったログの最後に "[+N suppressed]" とつける。
+    NOTE: f-string で組み立てたメッセージは毎回違う文字列になるので、 % 形式で渡すこと。
+
+    settings.LOGGING での使い方:
+        'filters': {'per_frame': {'()': 'shared.logging_filters.RateLimitFilter', 'rate': 10, 'burst': 20}},
+        'loggers': {'services.lab_run_manager': {'filters': ['per_frame']}},
+    """
+
+    def __init__(self, rate: float = 10.0, burst: int = 20, max_level: int = INFO, name: str = "") -> None:
+        super().__init__(name)
+        self.rate = rate
+        self.burst = burst
+        self.max_level = max_level
+        # メッセージ → (トークン数, 最後に補充した時刻, 間引いた件数)
+        self._buckets: dict[str, tuple[float, float, int]] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: LogRecord) -> bool:
+        if record.levelno > self.max_level:
+            return True
+        key = str(record.msg)
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at, suppressed = self._buckets.get(key, (float(self.burst), now, 0))
+            tokens = min(float(self.burst), tokens + (now - updated_at) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now, suppressed + 1)
+                return False
+            self._buckets[key] = (tokens - 1, now, 0)
+            if len(self._buckets) > _MAX_BUCKETS:
+                self._buckets = {k: bucket for k, bucket in self._buckets.items() if bucket[2]}
+        if suppressed:
+            # NOTE: msg は % 形式のテンプレートなので、 % を含まない文字列だけを足す。
+            record.msg = f"{record.msg} [+{suppressed} suppressed]"
+        return True
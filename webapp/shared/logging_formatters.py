@@ -1,63 +1,119 @@
 """
 test: shared.tests.test_logging_formatters
+bench: benchmarks.bench_logging_formatters
 """
 from datetime import datetime, timedelta, timezone
+from json.encoder import encode_basestring_ascii
 from logging import Formatter, LogRecord
 
 
-class JSTFormatter(Formatter):
+class _SecondCachingFormatter(Formatter):
+    """
+    asctime の秒までの部分を、 1 秒ごとにキャッシュする Formatter 。
+    datetime を作って strftime するのは秒が変わったときだけで、レコードごとにはミリ秒をくっつけるだけ。
+    NOTE: キャッシュは (秒, datefmt, 文字列) のタプルひとつ。
+          差し替えはアトミックなので、スレッドから同時に触られても壊れない。
+    """
 
-    JST = timezone(timedelta(hours=+9), 'JST')
+    tz: timezone
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._time_cache: tuple[int, str | None, str] = (-1, None, "")
 
     def formatTime(self, record: LogRecord, datefmt: str | None = None) -> str:
         """
-        `record.created` を基に JST での時刻を表示。
-        これを使うと logging が [2023-02-07 00:00:00,000] -> [2023-02-07 09:00:00,000] こうなる。
+        `record.created` を tz の時刻文字列にする。
 
         Args:
             record (LogRecord): ログレコード。
-            datefmt (str | None): 日付フォーマット。 '%Y-%m-%dT%H:%M:%S+09:00' などをどうぞ。
+            datefmt (str | None): 日付フォーマット。
 
         Returns:
-            str: JST での時刻文字列。
+            str: tz での時刻文字列。
         """
-        # record.created を datetime オブジェクトに変換して JST に変換
-        ct: datetime = datetime.fromtimestamp(record.created, timezone.utc).astimezone(self.JST)
+        # NOTE: %f (マイクロ秒) は 1 秒の中でも変わるのでキャッシュできない。
+        if datefmt and "%f" in datefmt:
+            return datetime.fromtimestamp(record.created, timezone.utc).astimezone(self.tz).strftime(datefmt)
+
+        second = int(record.created)
+        cached_second, cached_datefmt, formatted = self._time_cache
+        if second != cached_second or datefmt != cached_datefmt:
+            # record.created を datetime オブジェクトに変換して、このフォーマッタのタイムゾーンに変換
+            ct: datetime = datetime.fromtimestamp(second, timezone.utc).astimezone(self.tz)
+            # フォーマットが指定されているならそれに。
+            # フォーマットが指定されていないならデフォルトのフォーマットを使う。
+            # NOTE: 親クラスのインスタンス変数がきっちり定義されていることを確認。
+            assert self.default_time_format is not None
+            formatted = ct.strftime(datefmt or self.default_time_format)
+            self._time_cache = (second, datefmt, formatted)
 
-        # フォーマットが指定されているならそれに。
         if datefmt:
-            return ct.strftime(datefmt)
-        # フォーマットが指定されていないならデフォルトのフォーマットを使う。
-        # NOTE: 親クラスのインスタンス変数がきっちり定義されていることを確認。
-        assert self.default_time_format is not None
+            return formatted
         assert self.default_msec_format is not None
-        t = ct.strftime(self.default_time_format)
-        return self.default_msec_format % (t, record.msecs)
+        return self.default_msec_format % (formatted, record.msecs)
 
 
-class UTCFormatter(Formatter):
+class JSTFormatter(_SecondCachingFormatter):
+    """
+    `record.created` を基に JST での時刻を表示。
+    これを使うと logging が [2023-02-07 00:00:00,000] -> [2023-02-07 09:00:00,000] こうなる。
+    datefmt は '%Y-%m-%dT%H:%M:%S+09:00' などをどうぞ。
+    """
 
-    def formatTime(self, record: LogRecord, datefmt: str | None = None) -> str:
-        """
-        `record.created` を基に UTC での時刻を表示。
-        これを使うと logging が [2023-02-07 00:00:00,000] -> [2023-02-07 00:00:00,000] こうなる。
+    JST = timezone(timedelta(hours=+9), 'JST')
+    tz = JST
 
-        Args:
-            record (LogRecord): ログレコード。
-            datefmt (str | None): 日付フォーマット。 '%Y-%m-%dT%H:%M:%SZ' などをどうぞ。
 
-        Returns:
-            str: UTC での時刻文字列。
-        """
-        # record.created を datetime オブジェクトに変換。
-        ct: datetime = datetime.fromtimestamp(record.created, timezone.utc)
+class UTCFormatter(_SecondCachingFormatter):
+    """
+    `record.created` を基に UTC での時刻を表示。
+    これを使うと logging が [2023-02-07 00:00:00,000] -> [2023-02-07 00:00:00,000] こうなる。
+    datefmt は '%Y-%m-%dT%H:%M:%SZ' などをどうぞ。
+    """
 
-        # フォーマットが指定されているならそれに。
-        if datefmt:
-            return ct.strftime(datefmt)
-        # フォーマットが指定されていないならデフォルトのフォーマットを使う。
-        # NOTE: 親クラスのインスタンス変数がきっちり定義されていることを確認。
-        assert self.default_time_format is not None
-        assert self.default_msec_format is not None
-        t = ct.strftime(self.default_time_format)
-        return self.default_msec_format % (t, record.msecs)
+    tz = timezone.utc
+
+
+class _JSONFormatterMixin(Formatter):
+    """
+    1 レコードを 1 行の JSON にする。
+    {"time": ..., "level": ..., "logger": ..., "message": ..., "requestId": ..., "exception": ...}
+    - dict を作って json.dumps するのではなく、文字列を直接つなげる (キーの順番は固定) 。
+    - requestId は extra={"request_id": ...} で渡されたときだけ、 exception は例外があるときだけ出る。
+    """
+
+    def format(self, record: LogRecord) -> str:
+        parts = [
+            '{"time": ',
+            encode_basestring_ascii(self.formatTime(record, self.datefmt)),
+            ', "level": ',
+            encode_basestring_ascii(record.levelname),
+            ', "logger": ',
+            encode_basestring_ascii(record.name),
+            ', "message": ',
+            encode_basestring_ascii(record.getMessage()),
+        ]
+        request_id = getattr(record, "request_id", None)
+        if request_id is not None:
+            parts += [', "requestId": ', encode_basestring_ascii(str(request_id))]
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            parts += [', "exception": ', encode_basestring_ascii(record.exc_text)]
+        if record.stack_info:
+            parts += [', "stack": ', encode_basestring_ascii(self.formatStack(record.stack_info))]
+        parts.append("}")
+        return "".join(parts)
+
+
+class JSTJSONFormatter(_JSONFormatterMixin, JSTFormatter):
+    """
+    JSTFormatter の JSON 版。ログを集めるサービス (Cloud Logging, Datadog など) に送るとき用。
+    """
+
+
+class UTCJSONFormatter(_JSONFormatterMixin, UTCFormatter):
+    """
+    UTCFormatter の JSON 版。
+    """
@@ -0,0 +1,158 @@
+"""
+ログの書き出しを、ログを出したスレッド (SSE のストリームなど) から切り離すためのハンドラ。
+- BackgroundQueueHandler: レコードをキューに入れるだけ。バックグラウンドのスレッドがまとめて取り出して、
+  sink ロガーに設定したハンドラ (コンソール・ファイル) へ流す。ディスクが遅くてもストリームは待たされない。
+- BatchingStreamHandler, BatchingTimedRotatingFileHandler: レコードごとではなく、
+  バックグラウンドのスレッドが取り出したひとまとまりごとに 1 回だけ flush する。
+
+settings.LOGGING での使い方:
+    'handlers': {
+        'console': {'class': 'shared.logging_handlers.BatchingStreamHandler', ...},
+        'queue': {'()': 'shared.logging_handlers.BackgroundQueueHandler', 'sink': 'logging_sink'},
+    },
+    'loggers': {
+        'logging_sink': {'handlers': ['console'], 'propagate': False},
+        'root': {'handlers': ['queue']},
+    },
+test: shared.tests.test_logging_handlers
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+from logging.handlers import QueueHandler, TimedRotatingFileHandler
+
+# listener に止まってもらうための印。
+_STOP = object()
+
+
+class _BatchingFlushMixin:
+    """
+    emit のたびの flush を、バックグラウンドのスレッドがひとまとまり書き終わるまで遅らせる。
+    """
+
+    _in_batch = False
+
+    def begin_batch(self) -> None:
+        self._in_batch = True
+
+    def end_batch(self) -> None:
+        self._in_batch = False
+        self.flush()
+
+    def flush(self) -> None:
+        if not self._in_batch:
+            super().flush()  # type: ignore[misc]
+
+
+class BatchingStreamHandler(_BatchingFlushMixin, logging.StreamHandler):
+    pass
+
+
+class BatchingTimedRotatingFileHandler(_BatchingFlushMixin, TimedRotatingFileHandler):
+    pass
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """
+    レコードを上限つきのキューに入れて、バックグラウンドのスレッドで sink ロガーのハンドラへ流すハンドラ。
+    - キューが溢れたら待たずに捨てる (捨てた件数はあとで WARNING で出す) 。ログのためにストリームを止めない。
+    - logger.info("... %s", value) の % の組み立ては、バックグラウンドのスレッドで行う。
+    NOTE: 組み立てを遅らせるので、 args に渡したオブジェクトをあとで書き換えると、書き換えた後の値が出る。
+    """
+
+    def __init__(self, sink: str, queue_size: int = 10000, batch_size: int = 256) -> None:
+        super().__init__(queue.Queue(queue_size))
+        self.sink = sink
+        self.batch_size = batch_size
+        self.dropped = 0
+        self._listener: threading.Thread | None = None
+        self._listener_lock = threading.Lock()
+        # NOTE: gunicorn などで fork されると、子プロセスにスレッドは引き継がれない。子で起動し直す。
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_after_fork)
+        atexit.register(self.close)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # NOTE: 親クラスはここでメッセージを組み立ててしまう (別プロセスへ pickle するため) 。
+        #       同じプロセスのスレッドへ渡すだけなので、組み立ては sink 側のハンドラに任せる。
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self) -> None:
+        """
+        キューに残っているレコードを書き出してから止める。
+        """
+        with self._listener_lock:
+            listener, self._listener = self._listener, None
+        if listener is not None:
+            self.queue.put(_STOP)
+            listener.join(timeout=5)
+        super().close()
+
+    def _ensure_listener(self) -> None:
+        if self._listener is not None:
+            return
+        with self._listener_lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name="logging-listener", daemon=True)
+                self._listener.start()
+
+    def _listen(self) -> None:
+        handlers = logging.getLogger(self.sink).handlers
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = _STOP in batch
+            records = [record for record in batch if record is not _STOP]
+            if self.dropped:
+                dropped, self.dropped = self.dropped, 0
+                records.append(
+                    logging.makeLogRecord(
+                        {
+                            "name": __name__,
+                            "levelno": logging.WARNING,
+                            "levelname": "WARNING",
+                            "msg": "Logging queue was full, dropped %d records",
+                            "args": (dropped,),
+                        }
+                    )
+                )
+            self._write(handlers, records)
+            if stop:
+                return
+
+    @staticmethod
+    def _write(handlers: list[logging.Handler], records: list[logging.LogRecord]) -> None:
+        for handler in handlers:
+            if isinstance(handler, _BatchingFlushMixin):
+                handler.begin_batch()
+            try:
+                for record in records:
+                    if record.levelno < handler.level:
+                        continue
+                    try:
+                        handler.handle(record)
+                    except Exception:
+                        # NOTE: ハンドラの中の例外はふつう handleError が拾うが、フィルタなどで漏れたものも
+                        #       そのレコードだけ handleError でトレースバックを出して、残りのレコードは書き続ける。
+                        handler.handleError(record)
+            finally:
+                if isinstance(handler, _BatchingFlushMixin):
+                    handler.end_batch()
+
+    def _reset_after_fork(self) -> None:
+        self._listener = None
+        self._listener_lock = threading.Lock()
+        self.queue = queue.Queue(self.queue.maxsize)
@@ -0,0 +1,52 @@
+"""
+ストリームの形式 (shared.stream_formatters) ごとの DRF のレンダラー。
+ストリームを返す view の renderer_classes に入れると、 DRF のコンテントネゴシエーションで
+Accept (あるいは ?format=ndjson など) からストリームの形式が選ばれる。
+選ばれたレンダラーの formatter でストリームを送る。エラーレスポンスも同じ形式の 1 フレームになる。
+NOTE: これが無いと、 Accept: text/event-stream を送るクライアント (EventSource) が 406 になる。
+"""
+import json
+from typing import Any
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from shared.stream_formatters import (
+    MESSAGEPACK_STREAM_FORMATTER,
+    NDJSON_STREAM_FORMATTER,
+    SSE_STREAM_FORMATTER,
+    StreamFormatter,
+    StreamFrame,
+)
+
+
+class StreamRenderer(BaseRenderer):
+    formatter: StreamFormatter
+    charset = None
+
+    def render(self, data: Any, accepted_media_type: str | None = None, renderer_context: Any = None) -> bytes:
+        if data is None:
+            return b""
+        return self.formatter.format_frame(StreamFrame(json.dumps(data, cls=JSONEncoder).encode()))
+
+
+class SSERenderer(StreamRenderer):
+    media_type = SSE_STREAM_FORMATTER.media_type
+    format = "sse"
+    formatter = SSE_STREAM_FORMATTER
+
+
+class NDJSONRenderer(StreamRenderer):
+    media_type = NDJSON_STREAM_FORMATTER.media_type
+    format = "ndjson"
+    formatter = NDJSON_STREAM_FORMATTER
+
+
+class MessagePackRenderer(StreamRenderer):
+    media_type = MESSAGEPACK_STREAM_FORMATTER.media_type
+    format = "msgpack"
+    formatter = MESSAGEPACK_STREAM_FORMATTER
+
+
+# ストリームを返す view に足すレンダラー。
+STREAM_RENDERER_CLASSES: list[type[StreamRenderer]] = [SSERenderer, NDJSONRenderer, MessagePackRenderer]
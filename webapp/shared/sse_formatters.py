@@ -1,5 +1,10 @@
 import json
+import time
+from datetime import datetime
+from datetime import timezone as dt_timezone
+from typing import Any
 
+from django.conf import settings
 from django.utils import timezone
 
 
@@ -13,13 +18,14 @@ class SSEFormatter:
     """
 
     @staticmethod
-    def format_message(request_id: str, message: str, **extra_data) -> str:
+    def format_message(request_id: str, message: str, *, event_id: int | None = None, **extra_data) -> str:
         """
         メッセージを SSE 形式にフォーマットする。
 
         Args:
             request_id (str): リクエストID
             message (str): フォーマットするメッセージ
+            event_id (int | None): SSE の id フィールド。指定するとフレームの先頭に `id: ...` 行がつく。
             **extra_data: data 内に追加するフィールド
 
         Returns:
@@ -29,16 +35,17 @@ class SSEFormatter:
             "requestId": request_id,
             "data": {"message": message, "sentAt": timezone.now().strftime("%Y-%m-%dT%H:%M:%S%z"), **extra_data},
         }
-        return f"data: {json.dumps(response)}\n\n"
+        return f"{_id_line(event_id)}data: {json.dumps(response)}\n\n"
 
     @staticmethod
-    def format_error(request_id: str, error_message: str, **extra_data) -> str:
+    def format_error(request_id: str, error_message: str, *, event_id: int | None = None, **extra_data) -> str:
         """
         エラーメッセージを SSE 形式にフォーマットする。
 
         Args:
             request_id (str): リクエストID
             error_message (str): エラーメッセージ
+            event_id (int | None): SSE の id フィールド。指定するとフレームの先頭に `id: ...` 行がつく。
             **extra_data: data 内に追加するフィールド
 
         Returns:
@@ -48,15 +55,36 @@ class SSEFormatter:
             "requestId": request_id,
             "data": {"error": error_message, "sentAt": timezone.now().strftime("%Y-%m-%dT%H:%M:%S%z"), **extra_data},
         }
-        return f"data: {json.dumps(response)}\n\n"
+        return f"{_id_line(event_id)}data: {json.dumps(response)}\n\n"
 
     @staticmethod
-    def format_completion(request_id: str, **extra_data) -> str:
+    def format_messages(request_id: str, messages: list[str], *, event_id: int | None = None, **extra_data) -> str:
+        """
+        複数のメッセージをひとつの SSE イベントにまとめてフォーマットする。
+
+        Args:
+            request_id (str): リクエストID
+            messages (list[str]): フォーマットするメッセージのリスト
+            event_id (int | None): SSE の id フィールド。指定するとフレームの先頭に `id: ...` 行がつく。
+            **extra_data: data 内に追加するフィールド
+
+        Returns:
+            str: SSE 形式の文字列 ("data: {...}\n\n") 。 data.messages にメッセージの配列が入る。
+        """
+        response = {
+            "requestId": request_id,
+            "data": {"messages": messages, "sentAt": timezone.now().strftime("%Y-%m-%dT%H:%M:%S%z"), **extra_data},
+        }
+        return f"{_id_line(event_id)}data: {json.dumps(response)}\n\n"
+
+    @staticmethod
+    def format_completion(request_id: str, *, event_id: int | None = None, **extra_data) -> str:
         """
         完了メッセージを SSE 形式にフォーマットする。
 
         Args:
             request_id (str): リクエストID
+            event_id (int | None): SSE の id フィールド。指定するとフレームの先頭に `id: ...` 行がつく。
             **extra_data: data 内に追加するフィールド
 
         Returns:
@@ -70,4 +98,157 @@ class SSEFormatter:
                 **extra_data,
             },
         }
-        return f"data: {json.dumps(response)}\n\n"
+        return f"{_id_line(event_id)}data: {json.dumps(response)}\n\n"
+
+    @staticmethod
+    def format_summary(request_id: str, **summary) -> str:
+        """
+        ストリームの最後に送る、まとめ (計測結果など) のイベント。
+        NOTE: event: summary をつけた名前つきイベントなので、 EventSource の onmessage には届かない。
+              受け取りたいクライアントは addEventListener("summary", ...) する。
+
+        Args:
+            request_id (str): リクエストID
+            **summary: data 内に入れるフィールド
+
+        Returns:
+            str: SSE形式のイベント
+        """
+        response = {"requestId": request_id, "data": summary}
+        return f"event: summary\ndata: {json.dumps(response)}\n\n"
+
+    @staticmethod
+    def format_comment(comment: str) -> str:
+        """
+        コメント行 (": ..." で始まる行) 。 EventSource は読み飛ばすので、クライアントの onmessage には届かない。
+        何も送るものが無い間の heartbeat (": ping") などに使う。
+
+        Args:
+            comment (str): コメント。改行を含めないこと。
+
+        Returns:
+            str: SSE形式のコメント
+        """
+        return f": {comment}\n\n"
+
+
+def _id_line(event_id: int | None) -> str:
+    """
+    SSE の id 行。クライアントは再接続するときに、最後に受け取った id を Last-Event-ID ヘッダで送ってくる。
+    """
+    return "" if event_id is None else f"id: {event_id}\n"
+
+
+# sentAt のキャッシュ。 (UNIX 秒, フォーマット済み文字列) 。
+# NOTE: タプルの差し替えはアトミックなので、スレッドから同時に触られても壊れない。
+_sent_at_cache: tuple[int, str] = (-1, "")
+
+
+def _sent_at() -> str:
+    """
+    timezone.now().strftime("%Y-%m-%dT%H:%M:%S%z") と同じ文字列を、1秒単位でキャッシュして返す。
+    """
+    global _sent_at_cache
+    second = int(time.time())
+    cached_second, cached = _sent_at_cache
+    if second == cached_second:
+        return cached
+    # NOTE: timezone.now() は USE_TZ なら UTC 、そうでなければローカルの naive な datetime を返す。
+    now = datetime.fromtimestamp(second, dt_timezone.utc) if settings.USE_TZ else datetime.fromtimestamp(second)
+    formatted = now.strftime("%Y-%m-%dT%H:%M:%S%z")
+    _sent_at_cache = (second, formatted)
+    return formatted
+
+
+class SSEFrameEncoder:
+    """
+    ひとつのストリーム専用の、 SSEFormatter の高速版。
+    requestId や module のような毎フレーム同じ部分を最初に一度だけ JSON にしておき、
+    フレームごとには message と可変のフィールドだけを json.dumps して、 bytes で返す。
+    出力は SSEFormatter とバイト単位で同じ。
+
+    使用例:
+    encoder = SSEFrameEncoder(request.request_id, module="foo")
+    encoder.message("hello")  # == SSEFormatter.format_message(request_id, "hello", module="foo").encode()
+
+    test: shared.tests.test_sse_formatters
+    bench: benchmarks.bench_sse_formatters
+    """
+
+    def __init__(self, request_id: str, **constant_extra_data: Any) -> None:
+        """
+        Args:
+            request_id (str): リクエストID
+            **constant_extra_data: 全フレームの data に入れるフィールド。 per-call の extra_data より前に並ぶ。
+        """
+        self.request_id = request_id
+        self.constant_extra_data = constant_extra_data
+        self._prefix = f'{{"requestId": {json.dumps(request_id)}, "data": {{'
+        self._constant_fields = "".join(
+            f", {json.dumps(key)}: {json.dumps(value)}" for key, value in constant_extra_data.items()
+        )
+        # NOTE: これらと被るキーが per-call で来たら、 dict の上書きの順序を再現するために SSEFormatter に任せる。
+        self._reserved_keys = {"message", "messages", "error", "sentAt", *constant_extra_data}
+
+    def message(self, message: str, *, event_id: int | None = None, **extra_data: Any) -> bytes:
+        """
+        SSEFormatter.format_message と同じフレームを bytes で返す。
+        """
+        if extra_data and not self._reserved_keys.isdisjoint(extra_data):
+            return SSEFormatter.format_message(
+                self.request_id, message, event_id=event_id, **{**self.constant_extra_data, **extra_data}
+            ).encode()
+        return self._encode("message", message, event_id, extra_data)
+
+    def messages(self, messages: list[str], *, event_id: int | None = None, **extra_data: Any) -> bytes:
+        """
+        SSEFormatter.format_messages と同じフレームを bytes で返す。
+        """
+        if extra_data and not self._reserved_keys.isdisjoint(extra_data):
+            return SSEFormatter.format_messages(
+                self.request_id, messages, event_id=event_id, **{**self.constant_extra_data, **extra_data}
+            ).encode()
+        return self._encode("messages", messages, event_id, extra_data)
+
+    def error(self, error_message: str, *, event_id: int | None = None, **extra_data: Any) -> bytes:
+        """
+        SSEFormatter.format_error と同じフレームを bytes で返す。
+        """
+        if extra_data and not self._reserved_keys.isdisjoint(extra_data):
+            return SSEFormatter.format_error(
+                self.request_id, error_message, event_id=event_id, **{**self.constant_extra_data, **extra_data}
+            ).encode()
+        return self._encode("error", error_message, event_id, extra_data)
+
+    def completion(self, *, event_id: int | None = None, **extra_data: Any) -> bytes:
+        """
+        SSEFormatter.format_completion と同じフレームを bytes で返す。
+        """
+        return self.message("Stream completed", event_id=event_id, **extra_data)
+
+    def encode_data(
+        self, key: str, value: str | list[str], sent_at: str, extra_data: dict[str, Any]
+    ) -> bytes | None:
+        """
+        フレームの data 行の中身 (JSON のオブジェクト) だけを bytes で返す (shared.stream_formatters で使う) 。
+        extra_data のキーが message や constant_extra_data と被るときは、 dict の上書きの順序を再現できないので None 。
+
+        Args:
+            key (str): "message", "messages", "error" のどれか
+            value (str | list[str]): key の値
+            sent_at (str): sentAt の値
+            extra_data (dict[str, Any]): data 内に追加するフィールド
+        """
+        if extra_data and not self._reserved_keys.isdisjoint(extra_data):
+            return None
+        parts = [self._prefix, f'"{key}": ', json.dumps(value), f', "sentAt": "{sent_at}"', self._constant_fields]
+        for extra_key, extra_value in extra_data.items():
+            parts.append(f", {json.dumps(extra_key)}: {json.dumps(extra_value)}")
+        parts.append("}}")
+        # NOTE: json.dumps は ensure_ascii=True なので、中身は必ず ASCII 。
+        return "".join(parts).encode("ascii")
+
+    def _encode(self, key: str, value: str | list[str], event_id: int | None, extra_data: dict[str, Any]) -> bytes:
+        data = self.encode_data(key, value, _sent_at(), extra_data)
+        assert data is not None
+        return f"{_id_line(event_id)}data: ".encode() + data + b"\n\n"
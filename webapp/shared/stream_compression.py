@@ -0,0 +1,97 @@
+"""
+ストリーミングのレスポンス (SSE) を、フレームごとに送り出せる形で圧縮するコンプレッサー。
+- ストリームごとにひとつのコンプレッサー (圧縮の辞書) を使い続ける。 requestId, module, sentAt のように
+  毎フレーム同じキーは、前のフレームを参照するだけになるので、フレームが進むほど小さくなる。
+- compress はチャンクごとに sync flush する。チャンクを渡したらすぐに、クライアントが展開できるバイト列が返る。
+  圧縮のために次のフレームを待つことはないので、遅延は増えない。
+- gzip は標準ライブラリ (zlib) 、 brotli は brotli パッケージ。
+test: shared.tests.test_stream_compression
+"""
+import gzip
+import zlib
+
+import brotli
+
+# 使える Content-Encoding 。 Accept-Encoding の q 値が同じなら前にあるものを選ぶ。
+AVAILABLE_ENCODINGS: tuple[str, ...] = ("br", "gzip")
+
+
+class GzipStreamCompressor:
+    def __init__(self, level: int = 6) -> None:
+        # NOTE: wbits = 16 + MAX_WBITS で、 zlib ではなく gzip のヘッダ・トレーラをつける。
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliStreamCompressor:
+    def __init__(self, quality: int = 4) -> None:
+        self._compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+def create_stream_compressor(
+    encoding: str, gzip_level: int = 6, brotli_quality: int = 4
+) -> GzipStreamCompressor | BrotliStreamCompressor:
+    """
+    Content-Encoding に対応するコンプレッサーを作る。
+    """
+    if encoding == "br":
+        return BrotliStreamCompressor(brotli_quality)
+    if encoding == "gzip":
+        return GzipStreamCompressor(gzip_level)
+    raise ValueError(f"Unsupported encoding: '{encoding}'")
+
+
+def compress(data: bytes, encoding: str, gzip_level: int = 6, brotli_quality: int = 4) -> bytes:
+    """
+    ストリーミングではないレスポンスを、まとめて圧縮する。
+    """
+    if encoding == "br":
+        return brotli.compress(data, mode=brotli.MODE_TEXT, quality=brotli_quality)
+    if encoding == "gzip":
+        # NOTE: mtime=0 にして、同じ中身なら同じバイト列になるようにする。
+        return gzip.compress(data, compresslevel=gzip_level, mtime=0)
+    raise ValueError(f"Unsupported encoding: '{encoding}'")
+
+
+def negotiate_encoding(accept_encoding: str, encodings: tuple[str, ...] = AVAILABLE_ENCODINGS) -> str | None:
+    """
+    Accept-Encoding ヘッダから、 encodings の中で使うものを選ぶ。どれも受け付けないなら None 。
+
+    使用例:
+    negotiate_encoding("gzip, deflate, br")  # == "br"
+    negotiate_encoding("br;q=0, gzip;q=0.5")  # == "gzip"
+    """
+    qualities: dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name] = quality
+
+    best: str | None = None
+    best_quality = 0.0
+    for encoding in encodings:
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
@@ -0,0 +1,247 @@
+"""
+lab の出力ストリームを、クライアントが Accept で選んだ形式で送るためのフォーマッタ。
+- SSE (text/event-stream): ブラウザの EventSource 向け。これまでどおり。
+- NDJSON (application/x-ndjson): 1 行にひとつの JSON オブジェクト。 EventSource を使わない機械的なクライアント向け。
+  行で split して json.loads するだけで読める。
+- MessagePack (application/vnd.msgpack): 4 バイト (big endian) の長さ + MessagePack の map 、の繰り返し。
+どの形式でも、 SSEFormatter と同じ {"requestId": ..., "data": {...}} のオブジェクトがひとつのフレームになる。
+SSE の id, event (summary など) は、オブジェクトの先頭の "id", "event" キーになる。
+SSE のコメント (heartbeat の ": ping" など) は {"comment": "ping"} になる。
+
+NOTE: run の中 (リプレイバッファ、ブローカー、 run の履歴) では、フレームは形式に依らない StreamFrame のまま持つ。
+      view が購読者ごとに選んだ StreamFormatter に渡して、送り出すところで一度だけその形式にエンコードする。
+      StreamFrame は JSON (SSE の data 行の中身) と、作ったところで持っていたオブジェクトの両方を持つので、
+      SSE と NDJSON は JSON をつなぐだけ、 MessagePack はオブジェクトをそのまま pack するだけで済む。
+
+test: shared.tests.test_stream_formatters
+"""
+import json
+import struct
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, AsyncIterator
+
+import msgpack
+
+from shared.sse_formatters import SSEFormatter, SSEFrameEncoder, _sent_at
+
+
+@dataclass
+class StreamFrame:
+    """
+    ストリームのフレームひとつ分を、形式に依らない形で持つもの。
+    """
+
+    # {"requestId": ..., "data": {...}} のオブジェクトの JSON 。 SSE のフレームの data 行の中身。
+    data: bytes
+    event_id: int | None = None
+    # 名前つきイベントの名前 ("summary" など) 。
+    event: str | None = None
+    # data をデコードしたもの。フレームを作ったところで持っていれば入れておく (MessagePack が json.loads しない) 。
+    # NOTE: フレームは購読者の間で共有されるので、変更しないこと。
+    payload: dict[str, Any] | None = None
+
+    def get_payload(self) -> dict[str, Any]:
+        """
+        data をデコードしたもの。 payload を持っていなければ (ブローカー経由のフレームなど) data をデコードする。
+        """
+        return self.payload if self.payload is not None else json.loads(self.data)
+
+
+class StreamFrameEncoder:
+    """
+    ひとつのストリーム専用の、 StreamFrame を作るエンコーダ。 SSEFrameEncoder と同じ使い方で、 data は
+    SSEFrameEncoder のフレームの data 行とバイト単位で同じ (毎フレーム同じ部分は最初に一度だけ JSON にしておく) 。
+
+    使用例:
+    encoder = StreamFrameEncoder(request.request_id, module="foo")
+    frame = encoder.message("hello")
+    SSE_STREAM_FORMATTER.format_frame(frame)  # == SSEFrameEncoder(request.request_id, module="foo").message("hello")
+    """
+
+    def __init__(self, request_id: str, **constant_extra_data: Any) -> None:
+        """
+        Args:
+            request_id (str): リクエストID
+            **constant_extra_data: 全フレームの data に入れるフィールド。 per-call の extra_data より前に並ぶ。
+        """
+        self.request_id = request_id
+        self.constant_extra_data = constant_extra_data
+        self._encoder = SSEFrameEncoder(request_id, **constant_extra_data)
+
+    def message(self, message: str, *, event_id: int | None = None, **extra_data: Any) -> StreamFrame:
+        """
+        SSEFrameEncoder.message と同じ data の StreamFrame を返す。
+        """
+        return self._frame("message", message, event_id, extra_data)
+
+    def messages(self, messages: list[str], *, event_id: int | None = None, **extra_data: Any) -> StreamFrame:
+        """
+        SSEFrameEncoder.messages と同じ data の StreamFrame を返す。
+        """
+        return self._frame("messages", messages, event_id, extra_data)
+
+    def error(self, error_message: str, *, event_id: int | None = None, **extra_data: Any) -> StreamFrame:
+        """
+        SSEFrameEncoder.error と同じ data の StreamFrame を返す。
+        """
+        return self._frame("error", error_message, event_id, extra_data)
+
+    def completion(self, *, event_id: int | None = None, **extra_data: Any) -> StreamFrame:
+        """
+        SSEFrameEncoder.completion と同じ data の StreamFrame を返す。
+        """
+        return self.message("Stream completed", event_id=event_id, **extra_data)
+
+    def _frame(
+        self, key: str, value: str | list[str], event_id: int | None, extra_data: dict[str, Any]
+    ) -> StreamFrame:
+        sent_at = _sent_at()
+        payload = {
+            "requestId": self.request_id,
+            "data": {key: value, "sentAt": sent_at, **self.constant_extra_data, **extra_data},
+        }
+        data = self._encoder.encode_data(key, value, sent_at, extra_data)
+        if data is None:
+            # NOTE: extra_data のキーが被るときは、 dict の上書きの順序のまま json.dumps する (SSEFormatter と同じ) 。
+            data = json.dumps(payload).encode()
+        return StreamFrame(data, event_id=event_id, payload=payload)
+
+
+class StreamFormatter(ABC):
+    """
+    ストリームの形式ひとつ分。 StreamFrame を、その形式のフレーム (bytes) にする。
+    """
+
+    # レスポンスの Content-Type 。
+    media_type = ""
+
+    def __init__(self) -> None:
+        # 何も送るものが無い間に送る heartbeat 。
+        self.heartbeat = self.format_comment("ping")
+
+    @abstractmethod
+    def format_frame(self, frame: StreamFrame) -> bytes:
+        """
+        StreamFrame をこの形式のフレームにする。
+        """
+
+    @abstractmethod
+    def is_comment(self, chunk: bytes) -> bool:
+        """
+        format_comment で作ったフレームかどうか。計測でフレームとして数えないために使う。
+        """
+
+    def format_comment(self, comment: str) -> bytes:
+        """
+        クライアントが読み飛ばしてよいフレーム (heartbeat など) 。
+        """
+        payload = {"comment": comment}
+        return self.format_frame(StreamFrame(json.dumps(payload).encode(), payload=payload))
+
+    def format_summary(self, request_id: str, **summary: Any) -> bytes:
+        """
+        ストリームの最後に送る、まとめのイベント (SSEFormatter.format_summary を参照) 。
+        """
+        payload = {"requestId": request_id, "data": summary}
+        return self.format_frame(StreamFrame(json.dumps(payload).encode(), event="summary", payload=payload))
+
+    async def aformat(self, stream: AsyncIterator[StreamFrame]) -> AsyncIterator[bytes]:
+        """
+        StreamFrame のストリームを、この形式のストリームにする。
+        """
+        try:
+            async for frame in stream:
+                yield self.format_frame(frame)
+        finally:
+            # NOTE: 途中で閉じられたら、元のストリームも閉じる。 run の購読がすぐに外れる
+            #       (resumable でない run は止まる) 。
+            aclose = getattr(stream, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+
+class SSEStreamFormatter(StreamFormatter):
+    media_type = "text/event-stream"
+
+    def format_frame(self, frame: StreamFrame) -> bytes:
+        id_line = b"" if frame.event_id is None else f"id: {frame.event_id}\n".encode()
+        event_line = b"" if frame.event is None else f"event: {frame.event}\n".encode()
+        return id_line + event_line + b"data: " + frame.data + b"\n\n"
+
+    def format_comment(self, comment: str) -> bytes:
+        return SSEFormatter.format_comment(comment).encode()
+
+    def is_comment(self, chunk: bytes) -> bool:
+        return chunk.startswith(b":")
+
+
+class NDJSONStreamFormatter(StreamFormatter):
+    media_type = "application/x-ndjson"
+
+    def format_frame(self, frame: StreamFrame) -> bytes:
+        fields = []
+        if frame.event_id is not None:
+            fields.append(f'"id": {frame.event_id}')
+        if frame.event is not None:
+            fields.append(f'"event": {json.dumps(frame.event)}')
+        if not fields:
+            return frame.data + b"\n"
+        # NOTE: data は "{" で始まる JSON のオブジェクト。デコードせずに、先頭にキーを差し込む。
+        rest = frame.data.lstrip()[1:].lstrip()
+        separator = b"" if rest.startswith(b"}") else b", "
+        return b"{" + ", ".join(fields).encode() + separator + rest + b"\n"
+
+    def is_comment(self, chunk: bytes) -> bool:
+        return chunk.startswith(b'{"comment": ')
+
+
+class MessagePackStreamFormatter(StreamFormatter):
+    media_type = "application/vnd.msgpack"
+
+    def __init__(self) -> None:
+        # {"comment": ""} を pack したものから、空文字列の 1 バイトを除いたもの。 is_comment で使う。
+        self._comment_prefix = msgpack.packb({"comment": ""})[:-1]
+        super().__init__()
+
+    def format_frame(self, frame: StreamFrame) -> bytes:
+        obj = frame.get_payload()
+        if frame.event is not None:
+            obj = {"event": frame.event, **obj}
+        if frame.event_id is not None:
+            obj = {"id": frame.event_id, **obj}
+        return self._pack(obj)
+
+    def format_comment(self, comment: str) -> bytes:
+        return self._pack({"comment": comment})
+
+    def is_comment(self, chunk: bytes) -> bool:
+        return chunk[4:].startswith(self._comment_prefix)
+
+    @staticmethod
+    def _pack(obj: Any) -> bytes:
+        payload = msgpack.packb(obj)
+        return struct.pack(">I", len(payload)) + payload
+
+
+SSE_STREAM_FORMATTER = SSEStreamFormatter()
+NDJSON_STREAM_FORMATTER = NDJSONStreamFormatter()
+MESSAGEPACK_STREAM_FORMATTER = MessagePackStreamFormatter()
+
+# 使えるフォーマッタ。
+STREAM_FORMATTERS: tuple[StreamFormatter, ...] = (
+    SSE_STREAM_FORMATTER,
+    NDJSON_STREAM_FORMATTER,
+    MESSAGEPACK_STREAM_FORMATTER,
+)
+
+
+def get_stream_formatter(content_type: str) -> StreamFormatter | None:
+    """
+    レスポンスの Content-Type から、そのストリームのフォーマッタを返す。ストリームの形式でなければ None 。
+    """
+    media_type = content_type.partition(";")[0].strip().lower()
+    for formatter in STREAM_FORMATTERS:
+        if formatter.media_type == media_type:
+            return formatter
+    return None
@@ -0,0 +1,81 @@
+"""
+shared.tests.test_async_streams
+"""
+
+import asyncio
+import unittest
+from typing import AsyncIterator
+
+from ..async_streams import StreamLimitExceeded, coalesce, keepalive
+
+
+async def _emit(schedule: list[tuple[float, str]]) -> AsyncIterator[str]:
+    # (待ち時間, 値) の順に値を出す。
+    for delay, value in schedule:
+        await asyncio.sleep(delay)
+        yield value
+
+
+async def _collect(aiterator: AsyncIterator[list[str]]) -> list[list[str]]:
+    return [batch async for batch in aiterator]
+
+
+class TestCoalesce(unittest.TestCase):
+
+    def test_batches_by_size(self) -> None:
+        # 一気に来た値は max_batch_size 件ごとにまとまることを確認。
+        schedule = [(0, str(i)) for i in range(5)]
+        batches = asyncio.run(_collect(coalesce(_emit(schedule), max_latency=1, max_batch_size=2)))
+        self.assertEqual(batches, [["0", "1"], ["2", "3"], ["4"]])
+
+    def test_batches_by_latency(self) -> None:
+        # 間が空いた値は max_latency で区切られることを確認。
+        schedule = [(0, "a"), (0, "b"), (0.2, "c"), (0, "d")]
+        batches = asyncio.run(_collect(coalesce(_emit(schedule), max_latency=0.05, max_batch_size=100)))
+        self.assertEqual(batches, [["a", "b"], ["c", "d"]])
+
+    def test_flushes_before_raising(self) -> None:
+        # 元のイテレータが例外を投げても、溜まっていた分を先に返すことを確認。
+        async def failing() -> AsyncIterator[str]:
+            yield "a"
+            raise ValueError("boom")
+
+        async def run() -> list[list[str]]:
+            batches = []
+            with self.assertRaises(ValueError):
+                async for batch in coalesce(failing(), max_latency=1, max_batch_size=100):
+                    batches.append(batch)
+            return batches
+
+        self.assertEqual(asyncio.run(run()), [["a"]])
+
+
+class TestKeepalive(unittest.TestCase):
+
+    def test_heartbeat_while_waiting(self) -> None:
+        # 値が来ない間は heartbeat_interval ごとに heartbeat が入ることを確認。
+        schedule = [(0, "a"), (0.25, "b")]
+        items = asyncio.run(_collect(keepalive(_emit(schedule), "ping", heartbeat_interval=0.1)))
+        self.assertEqual(items, ["a", "ping", "ping", "b"])
+
+    def test_max_idle_closes_source(self) -> None:
+        # max_idle を超えたら StreamLimitExceeded になり、元のイテレータも閉じられることを確認。
+        closed = []
+
+        async def silent() -> AsyncIterator[str]:
+            try:
+                yield "a"
+                await asyncio.sleep(10)
+                yield "never"
+            finally:
+                closed.append(True)
+
+        async def run() -> list[str]:
+            items = []
+            with self.assertRaises(StreamLimitExceeded):
+                async for item in keepalive(silent(), "ping", heartbeat_interval=0.04, max_idle=0.1):
+                    items.append(item)
+            return items
+
+        self.assertEqual(asyncio.run(run()), ["a", "ping", "ping"])
+        self.assertEqual(closed, [True])
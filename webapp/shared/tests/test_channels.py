@@ -0,0 +1,93 @@
+"""
+shared.tests.test_channels
+"""
+
+import asyncio
+import threading
+import time
+import unittest
+
+from ..channels import BoundedChannel, ChannelClosed, ChannelFull, ChannelTimeout
+
+
+class TestBoundedChannel(unittest.TestCase):
+
+    def test_put_and_get(self) -> None:
+        # FIFO で取り出せることを確認。
+        channel: BoundedChannel[int] = BoundedChannel(3)
+        for i in range(3):
+            channel.put(i)
+        self.assertEqual([channel.get(), channel.get(), channel.get()], [0, 1, 2])
+
+    def test_put_nowait_when_full(self) -> None:
+        # いっぱいなら待たずに ChannelFull になることを確認。
+        channel: BoundedChannel[int] = BoundedChannel(1)
+        channel.put_nowait(1)
+        with self.assertRaises(ChannelFull):
+            channel.put_nowait(2)
+
+    def test_put_blocks_until_consumed(self) -> None:
+        # いっぱいのときは consumer が取り出すまで producer が待たされる (backpressure) ことを確認。
+        channel: BoundedChannel[int] = BoundedChannel(1)
+        channel.put(1)
+        with self.assertRaises(ChannelTimeout):
+            channel.put(2, timeout=0.05)
+
+        threading.Timer(0.05, channel.get).start()
+        channel.put(2, timeout=1)
+        self.assertEqual(channel.get(), 2)
+
+    def test_close_drains_remaining_items(self) -> None:
+        # close 後も残りは取り出せて、そのあと ChannelClosed になることを確認。
+        channel: BoundedChannel[int] = BoundedChannel(2)
+        channel.put(1)
+        channel.close()
+        with self.assertRaises(ChannelClosed):
+            channel.put(2)
+        self.assertEqual(channel.get(), 1)
+        with self.assertRaises(ChannelClosed):
+            channel.get()
+
+    def test_aget_from_producer_thread(self) -> None:
+        # 別スレッドの同期 producer から async consumer へ渡せることを確認。
+        channel: BoundedChannel[int] = BoundedChannel(2)
+
+        def produce() -> None:
+            for i in range(10):
+                channel.put(i)
+                time.sleep(0.001)
+            channel.close()
+
+        async def consume() -> list[int]:
+            items = []
+            while True:
+                try:
+                    items.append(await channel.aget())
+                except ChannelClosed:
+                    return items
+
+        threading.Thread(target=produce).start()
+        self.assertEqual(asyncio.run(consume()), list(range(10)))
+
+    def test_aput_waits_for_sync_consumer(self) -> None:
+        # async producer が、いっぱいのときに別スレッドの consumer を待つことを確認。
+        channel: BoundedChannel[int] = BoundedChannel(1)
+        received: list[int] = []
+
+        def consume() -> None:
+            while True:
+                try:
+                    received.append(channel.get())
+                except ChannelClosed:
+                    return
+
+        async def produce() -> None:
+            for i in range(5):
+                await channel.aput(i)
+            channel.close()
+
+        consumer = threading.Thread(target=consume)
+        consumer.start()
+        asyncio.run(produce())
+        consumer.join(timeout=1)
+        self.assertEqual(received, list(range(5)))
@@ -0,0 +1,80 @@
+"""
+shared.tests.test_db_pool
+"""
+
+import itertools
+import threading
+import time
+import unittest
+from unittest import mock
+
+from ..db_pool import ConnectionPool, PoolTimeout
+
+
+class _Connection:
+    """
+    接続の代わり。 ping は alive が False なら例外を投げる。
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self) -> None:
+        self.id = next(self._ids)
+        self.alive = True
+        self.closed = False
+
+    def ping(self) -> None:
+        if not self.alive:
+            raise ConnectionError("gone away")
+
+
+def _create_pool(**kwargs) -> ConnectionPool[_Connection]:
+    def close(connection: _Connection) -> None:
+        connection.closed = True
+
+    return ConnectionPool(_Connection, close, ping=_Connection.ping, name="test", **kwargs)
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def test_reuses_connections_and_closes_overflow(self) -> None:
+        # pool_size 本は使い回し、 max_overflow の分は返されたら閉じることを確認。
+        pool = _create_pool(pool_size=1, max_overflow=1)
+        first = pool.checkout()
+        second = pool.checkout()
+        pool.checkin(first)
+        pool.checkin(second)
+        self.assertFalse(first.closed)
+        self.assertTrue(second.closed)
+        self.assertIs(pool.checkout(), first)
+        self.assertEqual((pool.in_use, pool.idle), (1, 0))
+
+    def test_checkout_waits_then_times_out(self) -> None:
+        # 全部使われていたら空くまで待ち、 timeout 秒たっても空かなければ PoolTimeout になることを確認。
+        pool = _create_pool(pool_size=1, max_overflow=0, timeout=1)
+        connection = pool.checkout()
+        threading.Timer(0.05, pool.checkin, args=(connection,)).start()
+        self.assertIs(pool.checkout(), connection)
+
+        pool.timeout = 0.05
+        with self.assertRaises(PoolTimeout):
+            pool.checkout()
+
+    def test_pre_ping_replaces_dead_connection(self) -> None:
+        # 切れた接続は貸し出さずに閉じて、新しい接続を開くことを確認。
+        pool = _create_pool(pool_size=1, max_overflow=0)
+        connection = pool.checkout()
+        pool.checkin(connection)
+        connection.alive = False
+        replacement = pool.checkout()
+        self.assertIsNot(replacement, connection)
+        self.assertTrue(connection.closed)
+
+    def test_recycles_idle_connections(self) -> None:
+        # max_idle 秒使われなかった接続は、次に借りるときに開き直すことを確認。
+        pool = _create_pool(max_idle=60)
+        connection = pool.checkout()
+        pool.checkin(connection)
+        with mock.patch("shared.db_pool.time.monotonic", return_value=time.monotonic() + 61):
+            self.assertIsNot(pool.checkout(), connection)
+        self.assertTrue(connection.closed)
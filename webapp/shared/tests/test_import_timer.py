@@ -0,0 +1,48 @@
+"""
+shared.tests.test_import_timer
+"""
+
+import importlib
+import sys
+import tempfile
+import textwrap
+import unittest
+from pathlib import Path
+
+from ..import_timer import ImportTimer
+
+
+class TestImportTimer(unittest.TestCase):
+
+    def test_self_time_excludes_nested_imports(self) -> None:
+        # 中で import したモジュールの時間は、 self ではなく cumulative にだけ入ることを確認。
+        directory = Path(tempfile.mkdtemp())
+        (directory / "import_timer_outer.py").write_text(
+            textwrap.dedent(
+                """
+                import time
+                import import_timer_inner
+                time.sleep(0.02)
+                """
+            )
+        )
+        (directory / "import_timer_inner.py").write_text("import time\ntime.sleep(0.05)\n")
+        sys.path.insert(0, str(directory))
+        self.addCleanup(sys.path.remove, str(directory))
+        for name in ("import_timer_outer", "import_timer_inner"):
+            self.addCleanup(sys.modules.pop, name, None)
+
+        timer = ImportTimer()
+        timer.start()
+        try:
+            importlib.import_module("import_timer_outer")
+        finally:
+            timer.stop()
+
+        timings = {timing.name: timing for timing in timer.timings}
+        outer, inner = timings["import_timer_outer"], timings["import_timer_inner"]
+        self.assertGreaterEqual(inner.self_seconds, 0.05)
+        self.assertGreaterEqual(outer.cumulative_seconds, 0.07)
+        self.assertLess(outer.self_seconds, 0.05)
+        self.assertIn("import_timer_inner", timer.report())
+        self.assertNotIn(timer, sys.meta_path)
@@ -2,12 +2,13 @@
 shared.tests.test_logging_formatters
 """
 
+import json
 import logging
 import unittest
 from datetime import datetime, timedelta, timezone
 from logging import LogRecord
 
-from ..logging_formatters import JSTFormatter, UTCFormatter
+from ..logging_formatters import JSTFormatter, JSTJSONFormatter, UTCFormatter
 
 
 class TestJSTFormatter(unittest.TestCase):
@@ -71,3 +72,44 @@ class TestUTCFormatter(unittest.TestCase):
         formatter = UTCFormatter('[%(asctime)s] [%(levelname)s] %(message)s', datefmt='%Y-%m-%dT%H:%M:%SZ')
         formatted_message: str = formatter.format(self.record)
         self.assertEqual(formatted_message, "[2023-02-07T00:00:00Z] [DEBUG] Sample message.")
+
+
+class TestSecondCaching(unittest.TestCase):
+
+    def test_cache_follows_seconds_and_datefmt(self) -> None:
+        # 同じ秒の中ではミリ秒だけが変わり、秒や datefmt が変わればキャッシュし直すことを確認。
+        formatter = UTCFormatter('%(asctime)s')
+        base = datetime.timestamp(datetime(2023, 2, 7, tzinfo=timezone.utc))
+        times = []
+        for created in (base + 0.25, base + 0.75, base + 1.5):
+            record = LogRecord("test", logging.INFO, "", 0, "msg", (), None)
+            record.created = created
+            record.msecs = int((created - int(created)) * 1000)
+            times.append(formatter.formatTime(record))
+        self.assertEqual(
+            times, ["2023-02-07 00:00:00,250", "2023-02-07 00:00:00,750", "2023-02-07 00:00:01,500"]
+        )
+        self.assertEqual(formatter.formatTime(record, "%H:%M:%S"), "00:00:01")
+        self.assertEqual(formatter.formatTime(record, "%S.%f"), "01.500000")
+
+
+class TestJSTJSONFormatter(unittest.TestCase):
+
+    def test_format(self) -> None:
+        # json.dumps で dict を書き出したのと同じ JSON になることを確認。
+        formatter = JSTJSONFormatter(datefmt='%Y-%m-%dT%H:%M:%S+09:00')
+        record = LogRecord("app.views", logging.INFO, "", 0, "sent: %s", ('"引用"\n',), None)
+        record.created = datetime.timestamp(datetime(2023, 2, 7, tzinfo=timezone.utc))
+        record.request_id = "rq-12345678"
+        self.assertEqual(
+            formatter.format(record),
+            json.dumps(
+                {
+                    "time": "2023-02-07T09:00:00+09:00",
+                    "level": "INFO",
+                    "logger": "app.views",
+                    "message": 'sent: "引用"\n',
+                    "requestId": "rq-12345678",
+                }
+            ),
+        )
@@ -0,0 +1,96 @@
+"""
+shared.tests.test_logging_handlers
+"""
+
+import io
+import logging
+import unittest
+from unittest import mock
+
+from ..logging_filters import RateLimitFilter
+from ..logging_handlers import BackgroundQueueHandler, BatchingStreamHandler
+
+
+class TestBackgroundQueueHandler(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.stream = _CountingStream()
+        self.sink = logging.getLogger("test_logging_sink")
+        self.sink.propagate = False
+        self.sink_handler = BatchingStreamHandler(self.stream)
+        self.sink_handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+        self.sink.addHandler(self.sink_handler)
+        self.addCleanup(self.sink.removeHandler, self.sink_handler)
+
+        self.logger = logging.getLogger("test_logging_source")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.handler = BackgroundQueueHandler("test_logging_sink", queue_size=2)
+        self.logger.addHandler(self.handler)
+        self.addCleanup(self.logger.removeHandler, self.handler)
+
+    def test_records_are_written_by_listener(self) -> None:
+        # バックグラウンドのスレッドで書き出され、 flush はまとまりごとに 1 回であることを確認。
+        self.logger.info("message %s", "a")
+        self.logger.info("message %s", "b")
+        self.handler.close()
+        self.assertEqual(self.stream.getvalue(), "INFO message a\nINFO message b\n")
+        self.assertLessEqual(self.stream.flush_count, 2)
+
+    def test_drop_when_queue_is_full(self) -> None:
+        # キューが溢れたら待たずに捨てて、捨てた件数を WARNING で出すことを確認。
+        self.handler._ensure_listener = lambda: None  # type: ignore[method-assign]
+        for i in range(5):
+            self.logger.info("message %d", i)
+        self.assertEqual(self.handler.dropped, 3)
+        self.handler._listener = None
+        BackgroundQueueHandler._ensure_listener(self.handler)
+        self.handler.close()
+        self.assertEqual(
+            self.stream.getvalue(),
+            "INFO message 0\nINFO message 1\nWARNING Logging queue was full, dropped 3 records\n",
+        )
+
+    def test_failing_record_does_not_drop_the_rest_of_the_batch(self) -> None:
+        # ハンドラが例外を投げたレコードだけ handleError に回して、残りのレコードは書き出すことを確認。
+        def reject_bad(record: logging.LogRecord) -> bool:
+            if record.getMessage() == "bad":
+                raise ValueError("boom")
+            return True
+
+        self.sink_handler.addFilter(reject_bad)
+        with mock.patch.object(self.sink_handler, "handleError") as handle_error:
+            # NOTE: queue_size=2 なので、溢れないよう 2 件にしておく。
+            self.logger.info("bad")
+            self.logger.info("good")
+            self.handler.close()
+        self.assertEqual(self.stream.getvalue(), "INFO good\n")
+        self.assertEqual([call.args[0].getMessage() for call in handle_error.call_args_list], ["bad"])
+
+
+class TestRateLimitFilter(unittest.TestCase):
+
+    def _record(self, msg: str, level: int = logging.INFO) -> logging.LogRecord:
+        return logging.LogRecord("test", level, "", 0, msg, ("value",), None)
+
+    def test_rate_limit_per_message(self) -> None:
+        # 同じ形のメッセージは burst 件まで通り、間引いた件数が次に通ったログにつくことを確認。
+        log_filter = RateLimitFilter(rate=1, burst=2)
+        with mock.patch("shared.logging_filters.time.monotonic", return_value=100.0) as monotonic:
+            passed = [log_filter.filter(self._record("sent: %s")) for _ in range(5)]
+            self.assertEqual(passed, [True, True, False, False, False])
+            # 形の違うメッセージや WARNING は別。
+            self.assertTrue(log_filter.filter(self._record("done: %s")))
+            self.assertTrue(log_filter.filter(self._record("sent: %s", logging.WARNING)))
+
+            monotonic.return_value = 101.0
+            record = self._record("sent: %s")
+            self.assertTrue(log_filter.filter(record))
+            self.assertEqual(record.getMessage(), "sent: value [+3 suppressed]")
+
+
+class _CountingStream(io.StringIO):
+    flush_count = 0
+
+    def flush(self) -> None:
+        self.flush_count += 1
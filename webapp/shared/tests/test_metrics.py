@@ -0,0 +1,62 @@
+"""
+shared.tests.test_metrics
+"""
+
+import unittest
+
+from ..metrics import MetricsRegistry
+
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def test_render_counter(self) -> None:
+        # ラベルごとに値が分かれて、 Prometheus のテキスト形式で書き出されることを確認。
+        registry = MetricsRegistry()
+        counter = registry.counter("frames_total", "Frames.", ("route",))
+        counter.inc(route="lab")
+        counter.inc(2, route="lab")
+        counter.inc(route='a"b')
+        self.assertEqual(
+            registry.render(),
+            "# HELP frames_total Frames.\n"
+            "# TYPE frames_total counter\n"
+            'frames_total{route="a\\"b"} 1\n'
+            'frames_total{route="lab"} 3\n',
+        )
+
+    def test_render_gauge(self) -> None:
+        # set した値から inc / dec で上下することを確認。
+        registry = MetricsRegistry()
+        gauge = registry.gauge("connections_in_use", "Connections.", ("alias",))
+        gauge.set(3, alias="default")
+        gauge.inc(alias="default")
+        gauge.dec(2, alias="default")
+        self.assertEqual(
+            registry.render(),
+            "# HELP connections_in_use Connections.\n"
+            "# TYPE connections_in_use gauge\n"
+            'connections_in_use{alias="default"} 2\n',
+        )
+
+    def test_render_histogram_buckets_are_cumulative(self) -> None:
+        # バケットは累積の件数で、 +Inf のバケットが件数と一致することを確認。
+        registry = MetricsRegistry()
+        histogram = registry.histogram("duration_seconds", "Duration.", buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.7, 3.0):
+            histogram.observe(value)
+        lines = registry.render().splitlines()
+        self.assertIn('duration_seconds_bucket{le="0.1"} 1', lines)
+        self.assertIn('duration_seconds_bucket{le="1"} 3', lines)
+        self.assertIn('duration_seconds_bucket{le="+Inf"} 4', lines)
+        self.assertIn("duration_seconds_sum 4.25", lines)
+        self.assertIn("duration_seconds_count 4", lines)
+
+    def test_register_returns_existing_metric(self) -> None:
+        # 同じ名前なら同じインスタンス、定義が違えばエラーになることを確認。
+        registry = MetricsRegistry()
+        counter = registry.counter("requests_total", "Requests.", ("method",))
+        self.assertIs(registry.counter("requests_total", "Requests.", ("method",)), counter)
+        with self.assertRaises(ValueError):
+            registry.histogram("requests_total", "Requests.", ("method",))
+        with self.assertRaises(ValueError):
+            counter.inc(route="lab")
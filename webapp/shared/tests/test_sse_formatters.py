@@ -0,0 +1,74 @@
+"""
+shared.tests.test_sse_formatters
+"""
+
+from datetime import datetime, timezone
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from ..sse_formatters import SSEFormatter, SSEFrameEncoder
+
+# 2023-02-07T00:00:00+0000 。
+FROZEN_TIMESTAMP = 1675728000.25
+
+
+class TestSSEFrameEncoder(SimpleTestCase):
+
+    def setUp(self) -> None:
+        # SSEFormatter と SSEFrameEncoder で同じ時刻を使うように固定する。
+        frozen_now = datetime.fromtimestamp(FROZEN_TIMESTAMP, timezone.utc)
+        patchers = [
+            mock.patch("shared.sse_formatters.time.time", return_value=FROZEN_TIMESTAMP),
+            mock.patch("shared.sse_formatters.timezone.now", return_value=frozen_now),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_message_is_byte_identical(self) -> None:
+        # SSEFormatter.format_message とバイト単位で同じことを確認。
+        encoder = SSEFrameEncoder("rq-12345678", module="foo")
+        self.assertEqual(
+            encoder.message("こんにちは", args={"arg1": "1"}),
+            SSEFormatter.format_message("rq-12345678", "こんにちは", module="foo", args={"arg1": "1"}).encode(),
+        )
+        self.assertIn(b'"sentAt": "2023-02-07T00:00:00+0000"', encoder.message("hello"))
+
+    def test_error_and_completion_are_byte_identical(self) -> None:
+        # format_error, format_completion ともバイト単位で同じことを確認。
+        encoder = SSEFrameEncoder("rq-12345678", module="foo")
+        self.assertEqual(
+            encoder.error("Boom \"quoted\""),
+            SSEFormatter.format_error("rq-12345678", "Boom \"quoted\"", module="foo").encode(),
+        )
+        self.assertEqual(
+            encoder.completion(), SSEFormatter.format_completion("rq-12345678", module="foo").encode()
+        )
+
+    def test_messages_is_byte_identical(self) -> None:
+        # まとめたメッセージのフレームも、 SSEFormatter.format_messages とバイト単位で同じことを確認。
+        encoder = SSEFrameEncoder("rq-12345678", module="foo")
+        self.assertEqual(
+            encoder.messages(["one", "二"]),
+            SSEFormatter.format_messages("rq-12345678", ["one", "二"], module="foo").encode(),
+        )
+
+    def test_overlapping_keys_follow_dict_semantics(self) -> None:
+        # constant と per-call でキーが被っても、 SSEFormatter と同じ出力になることを確認。
+        encoder = SSEFrameEncoder("rq-12345678", module="foo", progress="0%")
+        self.assertEqual(
+            encoder.message("hello", progress="50%"),
+            SSEFormatter.format_message("rq-12345678", "hello", module="foo", progress="50%").encode(),
+        )
+
+    def test_event_id_is_byte_identical(self) -> None:
+        # event_id をつけたフレームも、 SSEFormatter とバイト単位で同じことを確認。
+        encoder = SSEFrameEncoder("rq-12345678", module="foo")
+        frame = encoder.message("hello", event_id=7)
+        self.assertEqual(frame, SSEFormatter.format_message("rq-12345678", "hello", event_id=7, module="foo").encode())
+        self.assertTrue(frame.startswith(b"id: 7\ndata: "))
+        self.assertEqual(
+            encoder.completion(event_id=8),
+            SSEFormatter.format_completion("rq-12345678", event_id=8, module="foo").encode(),
+        )
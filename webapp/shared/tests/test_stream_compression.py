@@ -0,0 +1,72 @@
+"""
+shared.tests.test_stream_compression
+"""
+
+import unittest
+import zlib
+
+import brotli
+
+from ..sse_formatters import SSEFrameEncoder
+from ..stream_compression import (
+    AVAILABLE_ENCODINGS,
+    BrotliStreamCompressor,
+    GzipStreamCompressor,
+    compress,
+    negotiate_encoding,
+)
+
+
+class TestGzipStreamCompressor(unittest.TestCase):
+
+    def test_each_frame_can_be_decompressed_immediately(self) -> None:
+        # フレームごとの出力を、続きを待たずにそのまま展開できることと、
+        # 同じキーが繰り返されるので後のフレームほど小さくなることを確認。
+        encoder = SSEFrameEncoder("rq-12345678", module="foo")
+        compressor = GzipStreamCompressor()
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        sizes = []
+        for i in range(5):
+            frame = encoder.message(f"message {i}", event_id=i + 1)
+            compressed = compressor.compress(frame)
+            sizes.append(len(compressed))
+            self.assertEqual(decompressor.decompress(compressed), frame)
+        decompressor.decompress(compressor.finish())
+        self.assertTrue(decompressor.eof)
+        self.assertLess(sizes[-1], sizes[0] / 2)
+
+
+class TestBrotliStreamCompressor(unittest.TestCase):
+
+    def test_each_frame_can_be_decompressed_immediately(self) -> None:
+        # gzip と同じく、フレームごとの出力をそのまま展開でき、後のフレームほど小さくなることを確認。
+        encoder = SSEFrameEncoder("rq-12345678", module="foo")
+        compressor = BrotliStreamCompressor()
+        decompressor = brotli.Decompressor()
+        sizes = []
+        for i in range(5):
+            frame = encoder.message(f"message {i}", event_id=i + 1)
+            compressed = compressor.compress(frame)
+            sizes.append(len(compressed))
+            self.assertEqual(decompressor.process(compressed), frame)
+        decompressor.process(compressor.finish())
+        self.assertTrue(decompressor.is_finished())
+        self.assertLess(sizes[-1], sizes[0] / 2)
+
+    def test_compress(self) -> None:
+        # ストリーミングではないレスポンスも br で圧縮できることを確認。
+        data = b'{"message": "hello"}' * 100
+        self.assertEqual(brotli.decompress(compress(data, "br")), data)
+
+
+class TestNegotiateEncoding(unittest.TestCase):
+
+    def test_negotiate_encoding(self) -> None:
+        self.assertEqual(negotiate_encoding("gzip, deflate, br", ("br", "gzip")), "br")
+        self.assertEqual(negotiate_encoding("br;q=0.5, gzip", ("br", "gzip")), "gzip")
+        self.assertEqual(negotiate_encoding("br;q=0, *", ("br", "gzip")), "gzip")
+        self.assertEqual(negotiate_encoding("gzip;q=0", ("gzip",)), None)
+        self.assertEqual(negotiate_encoding("", ("br", "gzip")), None)
+        # br はデフォルトで使える。
+        self.assertEqual(AVAILABLE_ENCODINGS, ("br", "gzip"))
+        self.assertEqual(negotiate_encoding("gzip, deflate, br"), "br")
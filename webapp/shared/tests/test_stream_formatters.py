@@ -0,0 +1,148 @@
+"""
+shared.tests.test_stream_formatters
+"""
+
+import asyncio
+import json
+import struct
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+
+import msgpack
+
+from ..sse_formatters import SSEFormatter, SSEFrameEncoder
+from ..stream_formatters import (
+    MESSAGEPACK_STREAM_FORMATTER,
+    NDJSON_STREAM_FORMATTER,
+    SSE_STREAM_FORMATTER,
+    StreamFormatter,
+    StreamFrame,
+    StreamFrameEncoder,
+    get_stream_formatter,
+)
+
+# 2023-02-07T00:00:00+0000 。
+FROZEN_TIMESTAMP = 1675728000.25
+
+
+async def _aformat(formatter, frames: list[StreamFrame]) -> list[bytes]:
+    async def stream():
+        for frame in frames:
+            yield frame
+
+    return [chunk async for chunk in formatter.aformat(stream())]
+
+
+def _frames() -> list[StreamFrame]:
+    encoder = StreamFrameEncoder("rq-12345678", module="foo")
+    return [encoder.message("hello", event_id=1), encoder.completion(event_id=2)]
+
+
+class TestStreamFrameEncoder(unittest.TestCase):
+
+    def setUp(self) -> None:
+        # SSEFormatter (キーが被ったとき) と同じ時刻を使うように固定する。
+        frozen_now = datetime.fromtimestamp(FROZEN_TIMESTAMP, timezone.utc)
+        patchers = [
+            mock.patch("shared.sse_formatters.time.time", return_value=FROZEN_TIMESTAMP),
+            mock.patch("shared.sse_formatters.timezone.now", return_value=frozen_now),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_sse_is_byte_identical_to_sse_frame_encoder(self) -> None:
+        # SSE にしたものが SSEFrameEncoder とバイト単位で同じで、 payload が data と一致することを確認。
+        # NOTE: extra_data のキーが被る場合 (progress) も含める。
+        frame_encoder = StreamFrameEncoder("rq-12345678", module="foo", progress="0%")
+        sse_encoder = SSEFrameEncoder("rq-12345678", module="foo", progress="0%")
+        frames = [
+            frame_encoder.message("こんにちは", event_id=1, args={"arg1": "1"}),
+            frame_encoder.messages(["a", "b"], event_id=2, progress="50%"),
+            frame_encoder.error("boom"),
+            frame_encoder.completion(event_id=3),
+        ]
+        expected = [
+            sse_encoder.message("こんにちは", event_id=1, args={"arg1": "1"}),
+            sse_encoder.messages(["a", "b"], event_id=2, progress="50%"),
+            sse_encoder.error("boom"),
+            sse_encoder.completion(event_id=3),
+        ]
+        self.assertEqual([SSE_STREAM_FORMATTER.format_frame(frame) for frame in frames], expected)
+        for frame in frames:
+            self.assertEqual(json.loads(frame.data), frame.payload)
+
+
+class TestStreamFormatters(unittest.TestCase):
+
+    def test_formatter_is_abstract(self) -> None:
+        # format_frame, is_comment を実装しないフォーマッタは作れないことを確認。
+        class IncompleteStreamFormatter(StreamFormatter):
+            media_type = "text/plain"
+
+        with self.assertRaises(TypeError):
+            IncompleteStreamFormatter()  # type: ignore[abstract]
+
+    def test_ndjson_keeps_id_and_event_as_keys(self) -> None:
+        lines = asyncio.run(_aformat(NDJSON_STREAM_FORMATTER, _frames()))
+        lines += [NDJSON_STREAM_FORMATTER.heartbeat, NDJSON_STREAM_FORMATTER.format_summary("rq-12345678", frames=2)]
+        self.assertTrue(all(line.endswith(b"\n") and line.count(b"\n") == 1 for line in lines))
+        objects = [json.loads(line) for line in lines]
+        self.assertEqual(objects[0]["id"], 1)
+        self.assertEqual(objects[0]["requestId"], "rq-12345678")
+        self.assertEqual(objects[0]["data"]["message"], "hello")
+        self.assertEqual(objects[0]["data"]["module"], "foo")
+        self.assertEqual(objects[1]["data"]["message"], "Stream completed")
+        self.assertEqual(objects[2], {"comment": "ping"})
+        self.assertEqual(objects[3], {"event": "summary", "requestId": "rq-12345678", "data": {"frames": 2}})
+        self.assertEqual([NDJSON_STREAM_FORMATTER.is_comment(line) for line in lines], [False, False, True, False])
+
+    def test_sse(self) -> None:
+        chunks = asyncio.run(_aformat(SSE_STREAM_FORMATTER, _frames()))
+        self.assertTrue(chunks[0].startswith(b'id: 1\ndata: {"requestId": "rq-12345678"'))
+        self.assertEqual(SSE_STREAM_FORMATTER.heartbeat, SSEFormatter.format_comment("ping").encode())
+        self.assertEqual(
+            SSE_STREAM_FORMATTER.format_summary("rq-12345678", frames=2),
+            SSEFormatter.format_summary("rq-12345678", frames=2).encode(),
+        )
+
+    def test_messagepack_is_length_prefixed(self) -> None:
+        # NOTE: payload の無いフレーム (ブローカー経由) も data をデコードして送れることを確認する。
+        frames = [*_frames(), StreamFrame(b'{"requestId": "rq-12345678", "data": {}}', event_id=3)]
+        chunks = asyncio.run(_aformat(MESSAGEPACK_STREAM_FORMATTER, frames))
+        chunks += [MESSAGEPACK_STREAM_FORMATTER.heartbeat, MESSAGEPACK_STREAM_FORMATTER.format_summary("rq-1")]
+        objects = []
+        for chunk in chunks:
+            (length,) = struct.unpack(">I", chunk[:4])
+            self.assertEqual(length, len(chunk) - 4)
+            objects.append(msgpack.unpackb(chunk[4:]))
+        self.assertEqual(objects[0]["id"], 1)
+        self.assertEqual(objects[2], {"id": 3, "requestId": "rq-12345678", "data": {}})
+        self.assertEqual(objects[3], {"comment": "ping"})
+        self.assertEqual(objects[4]["event"], "summary")
+        self.assertTrue(MESSAGEPACK_STREAM_FORMATTER.is_comment(chunks[3]))
+
+    def test_closing_the_formatted_stream_closes_the_source(self) -> None:
+        # 送る側のストリームを途中で閉じたら、元のストリーム (run の購読) も閉じることを確認。
+        closed = []
+
+        async def scenario() -> None:
+            async def stream():
+                try:
+                    for frame in _frames():
+                        yield frame
+                finally:
+                    closed.append(True)
+
+            chunks = NDJSON_STREAM_FORMATTER.aformat(stream())
+            await chunks.__anext__()
+            await chunks.aclose()
+
+        asyncio.run(scenario())
+        self.assertEqual(closed, [True])
+
+    def test_get_stream_formatter(self) -> None:
+        self.assertIs(get_stream_formatter("application/x-ndjson"), NDJSON_STREAM_FORMATTER)
+        self.assertIs(get_stream_formatter("text/event-stream; charset=utf-8"), SSE_STREAM_FORMATTER)
+        self.assertIsNone(get_stream_formatter("application/json"))